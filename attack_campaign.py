@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import argparse
+import itertools
+
+from create_federated_clients import load_clients
+from generate_multiface_attack import (
+    DEFAULT_PARAMS, generate_attacks, save_outputs, materialize
+)
+
+# ================= CONFIG =================
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
+BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
+
+CELEBA_DIR = os.path.join(BASE_DIR, "celeba_identities")
+FEDERATED_DIR = os.path.join(BASE_DIR, "federated")
+OUTPUT_DIR = os.path.join(BASE_DIR, "attack_campaigns")
+
+CAMPAIGN_FILE = "campaign.json"
+
+# Every grid axis takes a value or a list of values; the campaign is their
+# cross product.
+DEFAULT_SPEC = {
+    "name": "campaign",
+    "seeds": [42],
+    "client_settings": [20],
+    **{key: [value] for key, value in DEFAULT_PARAMS.items()},
+    "materialize": None              # None: manifests only
+}
+# ==========================================
+
+
+# ---------------- SPEC ----------------
+def load_spec(path):
+    """Read a campaign spec from JSON or, with PyYAML installed, YAML and
+    fill in the defaults."""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(
+                    "YAML campaign specs need PyYAML (pip install pyyaml); "
+                    "use a .json spec instead"
+                )
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    unknown = set(spec) - set(DEFAULT_SPEC)
+    if unknown:
+        raise ValueError(f"Unknown campaign keys: {sorted(unknown)}")
+    return dict(DEFAULT_SPEC, **spec)
+
+
+def expand_grid(spec):
+    """One ``(seed, num_clients, params)`` per grid point, in a fixed
+    order (client settings outermost so each federation loads once)."""
+    def values(key):
+        v = spec[key]
+        return v if isinstance(v, list) else [v]
+
+    keys = list(DEFAULT_PARAMS)
+    for num_clients in values("client_settings"):
+        for seed in values("seeds"):
+            for combo in itertools.product(*(values(k) for k in keys)):
+                yield seed, num_clients, dict(zip(keys, combo))
+
+
+def variant_name(seed, num_clients, params):
+    return (
+        f"c{num_clients}_s{seed}_f{params['attack_fraction']:g}"
+        f"_t{params['num_attack_ids_per_client']}"
+        f"_d{params['donors_per_attack']}_i{params['images_per_id']}"
+    )
+
+
+# ---------------- RUN ----------------
+def run_campaign(spec, celeba_dir=CELEBA_DIR, federated_dir=FEDERATED_DIR,
+                 output_dir=OUTPUT_DIR, verbose=True):
+    """Generate every grid point of ``spec`` in this process.
+
+    Client assignments are loaded once per federation size, and folder
+    scans and per-seed image orders are cached by generate_multiface_attack
+    across grid points, so each extra point only costs its selection.
+    Writes ``<output_dir>/<name>/<variant>/`` plus a campaign.json index
+    and returns that index.
+    """
+    log = print if verbose else (lambda *a, **k: None)
+    root = os.path.join(output_dir, spec["name"])
+    os.makedirs(root, exist_ok=True)
+
+    start = time.perf_counter()
+    federations = {}
+    variants = []
+    for seed, num_clients, params in expand_grid(spec):
+        if num_clients not in federations:
+            federations[num_clients] = load_clients(
+                os.path.join(federated_dir, f"clients_{num_clients}")
+            )
+
+        t = time.perf_counter()
+        attack_metadata, manifest = generate_attacks(
+            seed, celeba_dir=celeba_dir, verbose=False,
+            clients=federations[num_clients], params=params
+        )
+        name = variant_name(seed, num_clients, params)
+        variant_dir = os.path.join(root, name)
+        manifest_path, meta_path = save_outputs(
+            variant_dir, attack_metadata, manifest
+        )
+        if spec["materialize"]:
+            materialize(manifest, variant_dir, spec["materialize"])
+
+        variants.append({
+            "name": name,
+            "seed": seed,
+            "num_clients": num_clients,
+            "params": params,
+            "num_records": len(manifest["records"]),
+            "manifest": manifest_path,
+            "metadata": meta_path
+        })
+        log(
+            f"[INFO] {name}: {len(manifest['records'])} images "
+            f"({(time.perf_counter() - t) * 1000:.0f} ms)"
+        )
+
+    campaign = {
+        "spec": spec,
+        "seconds": time.perf_counter() - start,
+        "variants": variants
+    }
+    with open(os.path.join(root, CAMPAIGN_FILE), "w") as f:
+        json.dump(campaign, f, indent=2)
+
+    log(
+        f"[INFO] {len(variants)} variants in {campaign['seconds']:.1f}s "
+        f"-> {root}"
+    )
+    return campaign
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a grid of attack scenarios in one pass"
+    )
+    parser.add_argument(
+        "spec",
+        nargs="?",
+        default=None,
+        help="Campaign spec (.json, or .yaml with PyYAML); omitted: defaults"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=OUTPUT_DIR,
+        help="Campaigns are written to <output-dir>/<name>"
+    )
+    parser.add_argument(
+        "--dump-spec",
+        action="store_true",
+        help="Print the resolved spec as JSON and exit"
+    )
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec) if args.spec else dict(DEFAULT_SPEC)
+    if args.dump_spec:
+        print(json.dumps(spec, indent=2))
+        return
+
+    run_campaign(spec, output_dir=args.output_dir)
+    print("\nAttack campaign generation COMPLETE.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+
+from rebuild_train_ids import TRAIN_RATIO
+from embedding_engine import (
+    random_init_supported, BACKBONES, DEFAULT_BACKBONE
+)
+
+# ================= CONFIG =================
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE_JSON = os.path.join("results", "benchmark_baseline.json")
+LATEST_JSON = os.path.join("results", "benchmark_latest.json")
+
+REGRESSION_TOLERANCE = 0.20      # flag stages >20% slower than baseline
+NUM_CLIENTS = 20                 # generate_multiface_attack uses clients_20
+MIN_IDS_PER_CLIENT = 3           # generate_multiface_attack skips smaller
+# =========================================
+
+
+# ---------------- SYNTHETIC CELEBA ----------------
+def make_synthetic_celeba(root, num_ids, imgs_per_id, size, seed=0):
+    """Write a CelebA-shaped tree under ``root``: numbered JPEGs in
+    Celeba/img_align_celeba/img_align_celeba plus identity_CelebA.txt,
+    with identities interleaved like the real file."""
+    rng = np.random.default_rng(seed)
+    celeba_root = os.path.join(root, "Celeba")
+    image_dir = os.path.join(celeba_root, "img_align_celeba", "img_align_celeba")
+    os.makedirs(image_dir, exist_ok=True)
+
+    pids = np.repeat(np.arange(1, num_ids + 1), imgs_per_id)
+    rng.shuffle(pids)
+
+    # One colour pattern per identity plus per-image noise, so images of
+    # an identity are more alike than images of different identities.
+    bases = rng.integers(0, 256, (num_ids + 1, 8, 8, 3))
+
+    lines = []
+    for n, pid in enumerate(pids, start=1):
+        name = f"{n:06d}.jpg"
+        noise = rng.normal(0, 24, (8, 8, 3))
+        pixels = np.clip(bases[pid] + noise, 0, 255).astype(np.uint8)
+        Image.fromarray(pixels).resize(size).save(
+            os.path.join(image_dir, name), quality=90
+        )
+        lines.append(f"{name} {pid}")
+
+    with open(os.path.join(celeba_root, "identity_CelebA.txt"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return len(pids)
+
+
+# ---------------- MEASUREMENT ----------------
+def tree_bytes(path):
+    # Count each inode once so hard-linked trees are not double counted.
+    seen, total = set(), 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            st = os.lstat(os.path.join(dirpath, f))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def run_stage(name, argv, root, log_dir):
+    env = dict(os.environ, FACE_PROJECT_ROOT=root)
+    log_path = os.path.join(log_dir, f"{name}.log")
+    before = tree_bytes(root)
+
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable] + argv,
+            cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is KiB on Linux, bytes on macOS.
+            scale = 1 if sys.platform == "darwin" else 1024
+            peak_rss = usage.ru_maxrss * scale
+        else:
+            returncode = proc.wait()
+            peak_rss = None
+    seconds = time.perf_counter() - start
+
+    if returncode != 0:
+        raise RuntimeError(f"Stage '{name}' failed, see {log_path}")
+
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": peak_rss / 1024 ** 2 if peak_rss else None,
+        "bytes_written": max(0, tree_bytes(root) - before)
+    }
+
+
+def add_rates(stage, images=None, identities=None):
+    if images is not None:
+        stage["images"] = images
+        stage["images_per_sec"] = images / stage["seconds"]
+    if identities is not None:
+        stage["identities"] = identities
+        stage["identities_per_sec"] = identities / stage["seconds"]
+    return stage
+
+
+def script(name):
+    return os.path.join(REPO_DIR, name)
+
+
+# ---------------- PIPELINE ----------------
+def run_pipeline(root, args):
+    log_dir = os.path.join(root, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    data = os.path.join(root, "data_processed")
+    stages = {}
+
+    num_images = make_synthetic_celeba(
+        root, args.identities, args.images_per_id,
+        (args.image_size, args.image_size), seed=args.seed
+    )
+
+    stages["separate"] = add_rates(
+        run_stage("separate", [
+            script("separate_celeba_identities.py"), "--link", args.link
+        ], root, log_dir),
+        images=num_images, identities=args.identities
+    )
+
+    stages["split"] = add_rates(
+        run_stage("split", [script("rebuild_train_ids.py")], root, log_dir),
+        identities=args.identities
+    )
+
+    with open(os.path.join(data, "splits", "train_ids.txt")) as f:
+        num_train = sum(1 for line in f if line.strip())
+    # Every client must fit in the primary assignment or
+    # create_federated_clients.py reports empty clients: even if every
+    # client draws max_ids, NUM_CLIENTS * max_ids <= num_train (main()
+    # guarantees max_ids >= MIN_IDS_PER_CLIENT).
+    max_ids = num_train // NUM_CLIENTS
+    min_ids = max(MIN_IDS_PER_CLIENT, max_ids // 2)
+
+    stages["federate"] = add_rates(
+        run_stage("federate", [
+            script("create_federated_clients.py"),
+            "--client-settings", str(NUM_CLIENTS),
+            "--min-ids-per-client", str(min_ids),
+            "--max-ids-per-client", str(max_ids)
+        ], root, log_dir),
+        identities=num_train
+    )
+
+    stages["attack"] = run_stage("attack", [
+        script("generate_multiface_attack.py"), "--seed", str(args.seed)
+    ], root, log_dir)
+
+    with open(os.path.join(data, "attack_dataset",
+                           "attack_manifest.json")) as f:
+        records = json.load(f)["records"]
+    registrations = len({(r["client"], r["identity"]) for r in records})
+    add_rates(stages["attack"], images=len(records),
+              identities=registrations)
+
+    detect_argv = [
+        script("embedding_detection.py"),
+        "--backbone", args.backbone,
+        "--batch-size", str(args.batch_size),
+        "--num-workers", str(args.num_workers),
+        "--no-cache",
+        "--output-dir", os.path.join(root, "results")
+    ]
+    if not args.pretrained:
+        detect_argv.append("--random-weights")
+
+    stages["detect"] = add_rates(
+        run_stage("detect", detect_argv, root, log_dir),
+        images=len(records), identities=registrations
+    )
+
+    return stages
+
+
+# ---------------- BASELINE ----------------
+def compare(report, baseline, tolerance):
+    regressions = []
+    print("\n===== COMPARISON WITH BASELINE =====")
+    for name, stage in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        ratio = stage["seconds"] / base["seconds"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else "ok"
+        if flag != "ok":
+            regressions.append(name)
+        print(
+            f"{name:9s}: {base['seconds']:8.2f}s -> {stage['seconds']:8.2f}s "
+            f"(x{ratio:.2f}) {flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time every pipeline stage on a synthetic CelebA tree"
+    )
+    parser.add_argument("--identities", type=int, default=200)
+    parser.add_argument("--images-per-id", type=int, default=6)
+    parser.add_argument("--image-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--link",
+        choices=["auto", "reflink", "hardlink", "copy"],
+        default="auto"
+    )
+    parser.add_argument(
+        "--backbone", choices=sorted(BACKBONES), default=DEFAULT_BACKBONE
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument(
+        "--pretrained",
+        action="store_true",
+        help="Use pretrained weights (needs them cached or network access); "
+             "default is random init"
+    )
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--output", default=LATEST_JSON)
+    parser.add_argument("--baseline", default=BASELINE_JSON)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Write this run as the new baseline"
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit non-zero if a stage is slower than the baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=REGRESSION_TOLERANCE
+    )
+    args = parser.parse_args()
+    if not args.pretrained and not random_init_supported(args.backbone):
+        parser.error(f"{args.backbone} needs --pretrained")
+
+    # Smallest corpus whose train split gives every client enough
+    # identities to be attacked.
+    needed = NUM_CLIENTS * MIN_IDS_PER_CLIENT
+    min_identities = int(np.ceil(needed / TRAIN_RATIO))
+    while int(TRAIN_RATIO * min_identities) < needed:
+        min_identities += 1
+    if args.identities < min_identities:
+        parser.error(
+            f"--identities must be at least {min_identities} "
+            f"({MIN_IDS_PER_CLIENT} train identities for each of "
+            f"{NUM_CLIENTS} clients)"
+        )
+
+    root = args.workdir or tempfile.mkdtemp(prefix="face_bench_")
+    os.makedirs(root, exist_ok=True)
+    print(f"[INFO] Synthetic tree: {root}")
+
+    start = time.perf_counter()
+    try:
+        stages = run_pipeline(root, args)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "config": {
+            k: getattr(args, k) for k in (
+                "identities", "images_per_id", "image_size", "seed", "link",
+                "backbone", "batch_size", "num_workers", "pretrained"
+            )
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "stages": stages,
+        "total_seconds": time.perf_counter() - start
+    }
+
+    print("\n===== PIPELINE BENCHMARK =====")
+    for name, s in stages.items():
+        rate = ""
+        if "images_per_sec" in s:
+            rate += f" {s['images_per_sec']:9.1f} img/s"
+        if "identities_per_sec" in s:
+            rate += f" {s['identities_per_sec']:9.1f} id/s"
+        rss = f"{s['peak_rss_mb']:.0f} MB" if s["peak_rss_mb"] else "n/a"
+        print(
+            f"{name:9s}: {s['seconds']:8.2f}s{rate}  rss={rss}  "
+            f"written={s['bytes_written'] / 1024 ** 2:.1f} MB"
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved report → {args.output}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("[WARN] Baseline was recorded with a different config")
+        regressions = compare(report, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline → {args.baseline}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,62 +3,92 @@ import random
 from collections import defaultdict
 import json
 import argparse
+import numpy as np
 
-# ================= ARGUMENTS =================
-parser = argparse.ArgumentParser(description="Create federated client splits")
-parser.add_argument("--seed", type=int, default=42, help="Random seed")
-args = parser.parse_args()
-
-BASE_SEED = args.seed
-# =============================================
+from metadata_index import index_path, load_index
 
 # ================= CONFIG =================
-PROJECT_ROOT = r"D:\Face recogination project"
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
 BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
 
 TRAIN_IDS_FILE = os.path.join(BASE_DIR, "splits", "train_ids.txt")
 CELEBA_DIR = os.path.join(BASE_DIR, "celeba_identities")
 OUTPUT_DIR = os.path.join(BASE_DIR, "federated")
 
+BASE_SEED = 42
 CLIENT_SETTINGS = [10, 20, 50]
 
 MIN_IDS_PER_CLIENT = 50
 MAX_IDS_PER_CLIENT = 150
+
+# Client-size distribution: "uniform" (sizes in [min, max], the original
+# splits), or non-IID "dirichlet" / "powerlaw" size skew.
+PARTITIONS = ("uniform", "dirichlet", "powerlaw")
+DEFAULT_PARTITION = "uniform"
+DIRICHLET_ALPHA = 0.5        # smaller = more skewed client sizes
+POWERLAW_EXPONENT = 1.2      # client k gets weight ~ (k + 1) ** -exponent
+IMAGE_SKEW = 0.0             # 0 = IID image counts, 1 = each client gets a
+                             # narrow band of images-per-identity
+
+ASSIGNMENT_FILE = "assignment.npz"   # columnar identity -> client
+TEXT_FILE_MAX_CLIENTS = 100          # above this no client_XX.txt files
 # =========================================
 
+
 # ---------------- LOAD & VALIDATE IDS ----------------
-with open(TRAIN_IDS_FILE, "r") as f:
-    raw_ids = [line.strip() for line in f if line.strip()]
+def load_train_ids(train_ids=TRAIN_IDS_FILE, celeba_dir=CELEBA_DIR):
+    """Train identities that exist in celeba_identities, sorted.
+    ``train_ids`` is a path to train_ids.txt or an in-memory list. Both
+    the split and the folder check come from the metadata index when it
+    is current."""
+    index = load_index(celeba_dir)
+    if isinstance(train_ids, str):
+        if index is not None and index.has_source("splits", train_ids):
+            train_ids = index.split_ids("train")
+        else:
+            with open(train_ids, "r") as f:
+                train_ids = [line.strip() for line in f if line.strip()]
 
-celeba_folders = set(os.listdir(CELEBA_DIR))
-train_ids_master = sorted([i for i in raw_ids if i in celeba_folders])
+    if index is not None:
+        celeba_folders = index.identity_set
+    else:
+        celeba_folders = set(os.listdir(celeba_dir))
+    return len(train_ids), sorted([i for i in train_ids if i in celeba_folders])
 
-print(f"Base random seed      : {BASE_SEED}")
-print(f"Total train IDs (raw) : {len(raw_ids)}")
-print(f"Total train IDs(valid): {len(train_ids_master)}")
 
-if len(train_ids_master) == 0:
-    raise RuntimeError("No valid identities found in celeba_identities!")
+def client_file_name(cid, num_clients=0):
+    # Wide enough that names sort in client order for any federation size.
+    width = max(2, len(str(num_clients - 1)))
+    return f"client_{cid:0{width}d}.txt"
 
-# ---------------- CREATE CLIENTS ----------------
-for num_clients in CLIENT_SETTINGS:
-    print(f"\nCreating {num_clients} federated clients...")
 
+def image_counts(identities, celeba_dir=CELEBA_DIR):
+    index = load_index(celeba_dir)
+    if index is not None:
+        return index.image_counts(identities)
+    return np.array([
+        len(os.listdir(os.path.join(celeba_dir, i))) for i in identities
+    ])
+
+
+# ---------------- ASSIGN ----------------
+def assign_clients(train_ids_master, num_clients, base_seed=BASE_SEED,
+                   min_ids=MIN_IDS_PER_CLIENT, max_ids=MAX_IDS_PER_CLIENT):
+    """Return ``{client_file_name: [identity, ...]}`` for one federation."""
     # 🔒 FAIR + REPRODUCIBLE SEEDING
-    rng = random.Random(BASE_SEED + num_clients)
+    rng = random.Random(base_seed + num_clients)
 
     train_ids = train_ids_master.copy()
     rng.shuffle(train_ids)
 
-    out_dir = os.path.join(OUTPUT_DIR, f"clients_{num_clients}")
-    os.makedirs(out_dir, exist_ok=True)
-
     clients = defaultdict(list)
     idx = 0
 
     # ---------------- PRIMARY ASSIGNMENT ----------------
     for cid in range(num_clients):
-        size = rng.randint(MIN_IDS_PER_CLIENT, MAX_IDS_PER_CLIENT)
+        size = rng.randint(min_ids, max_ids)
 
         for _ in range(size):
             if idx >= len(train_ids):
@@ -72,44 +102,312 @@ for num_clients in CLIENT_SETTINGS:
         cid = rng.randint(0, num_clients - 1)
         clients[cid].append(rid)
 
-    # ---------------- SAVE CLIENT FILES ----------------
-    total_assigned = 0
-    empty_clients = []
-
-    for cid in range(num_clients):
-        ids = clients[cid]
-        if len(ids) == 0:
-            empty_clients.append(cid)
-            continue
-
-        client_file = os.path.join(out_dir, f"client_{cid:02d}.txt")
-        with open(client_file, "w") as f:
-            f.write("\n".join(ids))
-
-        total_assigned += len(ids)
-
     # ---------------- HARD ASSERTIONS ----------------
+    empty_clients = [cid for cid in range(num_clients) if not clients[cid]]
+    total_assigned = sum(len(ids) for ids in clients.values())
+
     assert total_assigned == len(train_ids_master), \
         "Identity loss during federated assignment!"
 
     assert len(empty_clients) == 0, \
         f"Empty clients detected: {empty_clients}"
 
-    # ---------------- SAVE METADATA ----------------
-    meta = {
-        "num_clients": num_clients,
-        "base_seed": BASE_SEED,
-        "effective_seed": BASE_SEED + num_clients,
-        "min_ids_per_client": MIN_IDS_PER_CLIENT,
-        "max_ids_per_client": MAX_IDS_PER_CLIENT,
-        "total_train_ids": len(train_ids_master),
-        "total_assigned": total_assigned
+    return {
+        client_file_name(cid, num_clients): clients[cid]
+        for cid in range(num_clients)
     }
 
+
+def client_sizes(num_ids, num_clients, rng, partition=DEFAULT_PARTITION,
+                 min_ids=1, alpha=DIRICHLET_ALPHA,
+                 exponent=POWERLAW_EXPONENT):
+    """Non-IID client sizes summing to ``num_ids``, each >= ``min_ids``:
+    the floor plus a multinomial draw of the rest with Dirichlet or
+    (shuffled) power-law client weights."""
+    spare = num_ids - num_clients * min_ids
+    if spare < 0:
+        raise ValueError(
+            f"{num_ids} identities cannot give {num_clients} clients "
+            f"{min_ids} each (lower the minimum per client)"
+        )
+
+    if partition == "dirichlet":
+        weights = rng.dirichlet(np.full(num_clients, alpha))
+    elif partition == "powerlaw":
+        weights = np.arange(1, num_clients + 1) ** -float(exponent)
+        weights = rng.permutation(weights / weights.sum())
+    else:
+        raise ValueError(f"Unknown partition: {partition}")
+
+    return min_ids + rng.multinomial(spare, weights)
+
+
+def partition_clients(train_ids_master, num_clients, base_seed=BASE_SEED,
+                      partition="dirichlet", min_ids=1,
+                      alpha=DIRICHLET_ALPHA, exponent=POWERLAW_EXPONENT,
+                      image_skew=IMAGE_SKEW, counts=None):
+    """Vectorized non-IID assignment for large federations.
+
+    Returns ``client`` (one client index per identity in
+    ``train_ids_master``). The drawn client sizes are laid out with
+    ``np.repeat`` over a random order of the identities, so every step is
+    linear in their number. With ``image_skew`` in (0, 1] (``counts``
+    required) the order is biased by each identity's images-per-identity
+    rank, so clients get narrower bands of image counts.
+    ``ValueError`` if ``min_ids`` per client does not fit.
+    """
+    rng = np.random.default_rng(base_seed + num_clients)
+    n = len(train_ids_master)
+
+    sizes = client_sizes(
+        n, num_clients, rng, partition, min_ids, alpha, exponent
+    )
+    order = rng.permutation(n)
+    if image_skew > 0:
+        # Rank by image count from a histogram (ties spread at random),
+        # then a 16-bit key: NumPy's stable argsort of uint16 is a radix
+        # sort, so this stays O(N) too.
+        counts = np.asarray(counts, dtype=np.int64)
+        freq = np.bincount(counts)
+        below = np.cumsum(freq) - freq
+        rank = (below[counts] + rng.random(n) * freq[counts]) / n
+        key = image_skew * rank + (1 - image_skew) * rng.random(n)
+        key = np.minimum(key * 65536, 65535).astype(np.uint16)
+        order = order[np.argsort(key[order], kind="stable")]
+
+    client = np.empty(n, dtype=np.int32)
+    client[order] = np.repeat(
+        rng.permutation(num_clients).astype(np.int32), sizes
+    )
+
+    # ---------------- HARD ASSERTIONS ----------------
+    per_client = np.bincount(client, minlength=num_clients)
+    assert per_client.sum() == n, "Identity loss during federated assignment!"
+    assert (per_client > 0).all(), \
+        f"Empty clients detected: {np.flatnonzero(per_client == 0).tolist()}"
+
+    return client
+
+
+def group_clients(identities, client, num_clients):
+    # Columnar assignment -> {client_file_name: [identity, ...]}, O(N).
+    order = np.argsort(client, kind="stable")
+    bounds = np.cumsum(np.bincount(client, minlength=num_clients))[:-1]
+    ids = np.asarray(identities)[order]
+    return {
+        client_file_name(cid, num_clients): part.tolist()
+        for cid, part in enumerate(np.split(ids, bounds))
+    }
+
+
+def load_clients(federated_dir):
+    """``{client_file_name: [identity, ...]}`` of one ``clients_<n>``
+    folder, from its assignment.npz or else its client_XX.txt files."""
+    path = os.path.join(federated_dir, ASSIGNMENT_FILE)
+    if os.path.exists(path):
+        data = np.load(path)
+        return group_clients(
+            data["identity"], data["client"], int(data["num_clients"])
+        )
+
+    clients = {}
+    for f in os.listdir(federated_dir):
+        if f.endswith(".txt"):
+            with open(os.path.join(federated_dir, f), "r") as fh:
+                clients[f] = [l.strip() for l in fh if l.strip()]
+    return clients
+
+
+def save_clients(out_dir, clients, meta, text_files=True):
+    os.makedirs(out_dir, exist_ok=True)
+
+    # One columnar file for any federation size: identity -> client index
+    # (clients numbered in sorted file-name order).
+    names = sorted(clients)
+    np.savez(
+        os.path.join(out_dir, ASSIGNMENT_FILE),
+        identity=np.array([i for name in names for i in clients[name]]),
+        client=np.repeat(
+            np.arange(len(names), dtype=np.int32),
+            [len(clients[name]) for name in names]
+        ),
+        num_clients=len(names)
+    )
+
+    # client_XX.txt of an earlier run would mix with this assignment for
+    # readers that fall back to the text files.
+    for f in os.listdir(out_dir):
+        if f.startswith("client_") and f.endswith(".txt"):
+            os.remove(os.path.join(out_dir, f))
+
+    if text_files:
+        for name, ids in clients.items():
+            with open(os.path.join(out_dir, name), "w") as f:
+                f.write("\n".join(ids))
+
     with open(os.path.join(out_dir, "federated_meta.json"), "w") as f:
         json.dump(meta, f, indent=2)
 
-    print(f"  Total identities assigned: {total_assigned}")
-    print(f"  Saved to: {out_dir}")
 
-print("\nFederated client split COMPLETE (REPRODUCIBLE & SAFE).")
\ No newline at end of file
+# ---------------- CREATE CLIENTS ----------------
+def create_federated_clients(train_ids=TRAIN_IDS_FILE, celeba_dir=CELEBA_DIR,
+                             output_dir=OUTPUT_DIR,
+                             client_settings=CLIENT_SETTINGS,
+                             base_seed=BASE_SEED,
+                             min_ids=MIN_IDS_PER_CLIENT,
+                             max_ids=MAX_IDS_PER_CLIENT,
+                             partition=DEFAULT_PARTITION,
+                             alpha=DIRICHLET_ALPHA,
+                             exponent=POWERLAW_EXPONENT,
+                             image_skew=IMAGE_SKEW,
+                             verbose=True):
+    """Write ``clients_<n>`` folders for every federation size and return
+    ``{n: {client_file_name: [identity, ...]}}``.
+
+    ``partition="uniform"`` reproduces the original splits; "dirichlet" and
+    "powerlaw" draw skewed client sizes (``min_ids`` is the floor,
+    ``max_ids`` unused) via ``partition_clients``. Every federation gets an
+    assignment.npz; client_XX.txt files only up to
+    ``TEXT_FILE_MAX_CLIENTS`` clients.
+    """
+    log = print if verbose else (lambda *a, **k: None)
+
+    num_raw, train_ids_master = load_train_ids(train_ids, celeba_dir)
+
+    log(f"Base random seed      : {base_seed}")
+    log(f"Total train IDs (raw) : {num_raw}")
+    log(f"Total train IDs(valid): {len(train_ids_master)}")
+
+    if len(train_ids_master) == 0:
+        raise RuntimeError("No valid identities found in celeba_identities!")
+
+    index = load_index(celeba_dir)
+    counts = None
+    if partition != "uniform" and image_skew > 0:
+        counts = image_counts(train_ids_master, celeba_dir)
+
+    federations = {}
+    for num_clients in client_settings:
+        log(f"\nCreating {num_clients} federated clients ({partition})...")
+
+        if partition == "uniform":
+            clients = assign_clients(
+                train_ids_master, num_clients, base_seed, min_ids, max_ids
+            )
+        else:
+            client = partition_clients(
+                train_ids_master, num_clients, base_seed, partition,
+                min_ids, alpha, exponent, image_skew, counts
+            )
+            clients = group_clients(train_ids_master, client, num_clients)
+        sizes = np.array([len(ids) for ids in clients.values()])
+        total_assigned = int(sizes.sum())
+
+        # ---------------- SAVE CLIENT FILES + METADATA ----------------
+        meta = {
+            "num_clients": num_clients,
+            "base_seed": base_seed,
+            "effective_seed": base_seed + num_clients,
+            "min_ids_per_client": min_ids,
+            "max_ids_per_client": max_ids,
+            "total_train_ids": len(train_ids_master),
+            "total_assigned": total_assigned,
+            "partition": partition,
+            "client_size_min": int(sizes.min()),
+            "client_size_median": float(np.median(sizes)),
+            "client_size_max": int(sizes.max())
+        }
+        if partition == "dirichlet":
+            meta["dirichlet_alpha"] = alpha
+        elif partition == "powerlaw":
+            meta["powerlaw_exponent"] = exponent
+        if partition != "uniform":
+            meta["image_skew"] = image_skew
+
+        out_dir = os.path.join(output_dir, f"clients_{num_clients}")
+        save_clients(
+            out_dir, clients, meta,
+            text_files=num_clients <= TEXT_FILE_MAX_CLIENTS
+        )
+        federations[num_clients] = clients
+        if index is not None:
+            index.set_clients(
+                num_clients, clients,
+                [os.path.join(out_dir, ASSIGNMENT_FILE)]
+            )
+
+        log(f"  Total identities assigned: {total_assigned}")
+        log(
+            f"  Client sizes: min {meta['client_size_min']}, median "
+            f"{meta['client_size_median']:.0f}, max {meta['client_size_max']}"
+        )
+        log(f"  Saved to: {out_dir}")
+
+    if index is not None:
+        index.save(index_path(celeba_dir))
+    return federations
+
+
+def main():
+    # ================= ARGUMENTS =================
+    parser = argparse.ArgumentParser(
+        description="Create federated client splits"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=BASE_SEED, help="Random seed"
+    )
+    parser.add_argument(
+        "--client-settings",
+        type=int,
+        nargs="+",
+        default=CLIENT_SETTINGS,
+        help="Federation sizes to create (one clients_<n> folder each)"
+    )
+    parser.add_argument(
+        "--min-ids-per-client", type=int, default=MIN_IDS_PER_CLIENT
+    )
+    parser.add_argument(
+        "--max-ids-per-client", type=int, default=MAX_IDS_PER_CLIENT,
+        help="Upper bound for --partition uniform only"
+    )
+    parser.add_argument(
+        "--partition",
+        choices=PARTITIONS,
+        default=DEFAULT_PARTITION,
+        help="Client-size distribution (dirichlet/powerlaw = non-IID)"
+    )
+    parser.add_argument(
+        "--alpha", type=float, default=DIRICHLET_ALPHA,
+        help="Dirichlet concentration (smaller = more skew)"
+    )
+    parser.add_argument(
+        "--exponent", type=float, default=POWERLAW_EXPONENT,
+        help="Power-law exponent of client sizes"
+    )
+    parser.add_argument(
+        "--image-skew", type=float, default=IMAGE_SKEW,
+        help="0..1: how strongly clients differ in images per identity "
+             "(non-IID partitions)"
+    )
+    args = parser.parse_args()
+    # =============================================
+
+    try:
+        create_federated_clients(
+            client_settings=args.client_settings,
+            base_seed=args.seed,
+            min_ids=args.min_ids_per_client,
+            max_ids=args.max_ids_per_client,
+            partition=args.partition,
+            alpha=args.alpha,
+            exponent=args.exponent,
+            image_skew=args.image_skew
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("\nFederated client split COMPLETE (REPRODUCIBLE & SAFE).")
+
+
+if __name__ == "__main__":
+    main()
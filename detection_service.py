@@ -0,0 +1,553 @@
+import io
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import Request, urlopen
+import numpy as np
+
+from embedding_detection import (
+    load_model, get_transform, SCORE_MODE, TARGET_FPRS
+)
+from embedding_engine import (
+    embed_tensors, random_init_supported, DEFAULT_BACKBONE, BACKBONES
+)
+from identity_scorers import SCORERS
+from streaming_eval import StreamingROC
+
+# ================= CONFIG =================
+HOST = "127.0.0.1"
+PORT = 8765
+
+MAX_BATCH = 32            # images per forward pass
+MAX_WAIT_MS = 5.0         # how long a batch waits for more uploads
+P99_TARGET_MS = 250.0     # reported as met / missed in /stats
+LATENCY_WINDOW = 10000    # uploads kept for the latency percentiles
+
+ONLINE_SCORES = ("max", "mean", "spread")
+REPLAY_CONCURRENCY = 16
+# ==========================================
+
+
+# ---------------- PER-IDENTITY STATE ----------------
+class IdentityState:
+    """Running statistics of one registration folder.
+
+    ``sum`` and ``sumsq`` give the "mean" centroid distance (1 - |sum| / n)
+    and the "spread" (mean squared distance to the mean) in O(d) per image.
+    "max" follows the member least similar to the centroid: each upload
+    updates its similarity and scores the new image, both O(d). The other
+    members are only rescanned when the centroid has turned far enough
+    from the last scan that one of them could have dropped below it, so no
+    image is ever re-embedded and scores match identity_scorers on the same
+    embeddings.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum = None
+        self.sumsq = 0.0
+        self.rows = None            # (capacity, d) member embeddings
+        self.worst = 0              # member least similar to the centroid
+        self.worst_dot = 0.0        # <x_worst, sum>
+        self.axis = None            # unit sum at the last rescan
+        self.others = np.inf        # min <x_i, axis> over the other members
+        self.perp = 0.0             # max |x_i - <x_i, axis> axis|
+
+    def add(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.sum is None:
+            self.sum = np.zeros(len(x), dtype=np.float64)
+            self.rows = np.zeros((4, len(x)), dtype=np.float32)
+        if self.n == len(self.rows):
+            self.rows = np.concatenate([self.rows, np.zeros_like(self.rows)])
+
+        n = self.n
+        self.rows[n] = x
+        self.sum += x
+        self.sumsq += float(x @ x)
+        self.n += 1
+        if n == 0:
+            return self._rescan()
+
+        self.worst_dot += float(self.rows[self.worst] @ x)
+        dot = float(x @ self.sum)
+        if dot < self.worst_dot:
+            self.others = min(
+                self.others, float(self.rows[self.worst] @ self.axis)
+            )
+            self.worst, self.worst_dot = n, dot
+        else:
+            self.others = min(self.others, float(x @ self.axis))
+        along = float(x @ self.axis)
+        self.perp = max(self.perp, np.sqrt(max(x @ x - along * along, 0.0)))
+
+        # Splitting sum along / across the scanned axis bounds every other
+        # member's <x_i, sum> from below by others * along - perp * across.
+        along = float(self.sum @ self.axis)
+        across = np.sqrt(max(self.sum @ self.sum - along * along, 0.0))
+        if along <= 0 or self.others * along - self.perp * across \
+                < self.worst_dot:
+            self._rescan()
+
+    def _rescan(self):
+        rows = self.rows[:self.n]
+        dots = rows @ self.sum
+        self.worst = int(dots.argmin())
+        self.worst_dot = float(dots[self.worst])
+        norm = np.sqrt(max(self.sum @ self.sum, 1e-12))
+        self.axis = self.sum / norm
+        along = dots / norm
+        self.perp = float(np.sqrt(np.maximum(
+            np.einsum("ij,ij->i", rows, rows) - along * along, 0.0
+        )).max())
+        along[self.worst] = np.inf
+        self.others = float(along.min()) if self.n > 1 else np.inf
+
+    def scores(self):
+        if self.n < 2:
+            return None
+        norm = np.sqrt(max(self.sum @ self.sum, 1e-12))
+        mean = self.sum / self.n
+        return {
+            "max": float(1.0 - self.worst_dot / norm),
+            "mean": float(1.0 - norm / self.n),
+            "spread": float(self.sumsq / self.n - mean @ mean)
+        }
+
+
+# ---------------- MICRO-BATCHING ----------------
+class MicroBatcher:
+    """Single model thread that merges concurrent uploads into one
+    forward pass: it takes the first waiting image, then whatever else
+    arrives within ``max_wait_ms``, up to ``max_batch`` images."""
+
+    def __init__(self, embed_fn, max_batch=MAX_BATCH,
+                 max_wait_ms=MAX_WAIT_MS):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self.thread = threading.Thread(
+            target=self._run, name="micro-batcher", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, x):
+        fut = Future()
+        self.queue.put((x, fut))
+        return fut
+
+    def _run(self):
+        import torch
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                emb = self.embed_fn(torch.stack([x for x, _ in batch]))
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, fut), row in zip(batch, emb):
+                fut.set_result(row)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch": self.images / self.batches if self.batches else 0.0
+        }
+
+
+# ---------------- SERVICE ----------------
+class DetectionService:
+    """Scores each uploaded image against its registration as it arrives.
+
+    ``register`` decodes in the calling thread, embeds through the
+    ``MicroBatcher`` and folds the embedding into the identity's
+    ``IdentityState``. ``threshold`` (e.g. from ``calibrate_threshold``)
+    turns the ``score_mode`` score into a flag; without one nothing is
+    flagged.
+    """
+
+    def __init__(self, name=None, random_weights=False, max_batch=MAX_BATCH,
+                 max_wait_ms=MAX_WAIT_MS, score_mode=SCORE_MODE,
+                 threshold=None, device="cpu"):
+        if score_mode not in ONLINE_SCORES:
+            raise ValueError(f"Online scores: {ONLINE_SCORES}")
+        model = load_model(name, random_weights)
+        self.transform = get_transform()
+        self.batcher = MicroBatcher(
+            lambda x: embed_tensors(model, x, device), max_batch, max_wait_ms
+        )
+        self.score_mode = score_mode
+        self.threshold = threshold
+        self.states = {}
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.flagged = set()
+
+    def _decode(self, image):
+        from PIL import Image
+        if isinstance(image, (bytes, bytearray)):
+            image = io.BytesIO(image)
+        return self.transform(Image.open(image).convert("RGB"))
+
+    def register(self, client, identity, image):
+        """Add one image (raw bytes or a path) and return the identity's
+        updated scores."""
+        start = time.perf_counter()
+        emb = self.batcher.submit(self._decode(image)).result()
+
+        key = (client, identity)
+        with self.lock:
+            state = self.states.setdefault(key, IdentityState())
+            state.add(emb)
+            scores = state.scores()
+            flagged = None
+            if self.threshold is not None:
+                flagged = (
+                    scores is not None
+                    and scores[self.score_mode] >= self.threshold
+                )
+                if flagged:
+                    self.flagged.add(key)
+            latency = (time.perf_counter() - start) * 1000
+            self.latencies.append(latency)
+            n = state.n
+
+        return {
+            "client": client,
+            "identity": identity,
+            "num_images": n,
+            "score": None if scores is None else scores[self.score_mode],
+            "scores": scores,
+            "flagged": flagged,
+            "latency_ms": latency
+        }
+
+    def lookup(self, client, identity):
+        with self.lock:
+            state = self.states.get((client, identity))
+            if state is None:
+                return None
+            return {
+                "client": client,
+                "identity": identity,
+                "num_images": state.n,
+                "scores": state.scores(),
+                "flagged": (client, identity) in self.flagged
+            }
+
+    def reset(self, client, identity):
+        with self.lock:
+            self.flagged.discard((client, identity))
+            return self.states.pop((client, identity), None) is not None
+
+    def stats(self):
+        with self.lock:
+            lat = np.array(self.latencies)
+            out = {
+                "identities": len(self.states),
+                "flagged": len(self.flagged),
+                "uploads": len(lat),
+                "score_mode": self.score_mode,
+                "threshold": self.threshold
+            }
+        if len(lat):
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            out.update({
+                "latency_p50_ms": float(p50),
+                "latency_p95_ms": float(p95),
+                "latency_p99_ms": float(p99),
+                "p99_target_ms": P99_TARGET_MS,
+                "p99_ok": bool(p99 <= P99_TARGET_MS)
+            })
+        out["batcher"] = self.batcher.stats()
+        return out
+
+
+def calibrate_threshold(scores_path, score_mode=SCORE_MODE,
+                        fpr=TARGET_FPRS[0]):
+    """Threshold at ``fpr`` on the normal identities of an offline run's
+    scores.npz (see embedding_detection.py)."""
+    saved = np.load(scores_path)
+    key = f"score_{score_mode}"
+    if key in saved:
+        scores = saved[key]
+    elif "score_mode" in saved and str(saved["score_mode"]) == score_mode:
+        scores = saved["y_score"]
+    else:
+        raise ValueError(
+            f"{scores_path} has no {score_mode!r} scores to calibrate on "
+            f"(offline scorers: {sorted(SCORERS)}); pass --threshold instead"
+        )
+    return float(np.quantile(scores[saved["y_true"] == 0], 1.0 - fpr))
+
+
+# ---------------- HTTP API ----------------
+def resolve_image_path(image_root, path):
+    # Server-local files only below image_root (symlinks resolved), so
+    # clients cannot make the server read arbitrary files.
+    root = os.path.realpath(image_root)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        raise PermissionError(f"path outside the image root: {path}")
+    return full
+
+
+def make_handler(service, image_root=None):
+    class Handler(BaseHTTPRequestHandler):
+        # POST /register?client=&identity=   body: image bytes, or JSON
+        #      {"client", "identity", "path"} for files below image_root
+        #      (only when the server was started with one)
+        # GET /identity?client=&identity=    current scores
+        # DELETE /identity?client=&identity= drop the running state
+        # GET /stats                         latency percentiles, batching
+        def _reply(self, code, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _query(self):
+            url = urlparse(self.path)
+            return url.path, {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        def do_POST(self):
+            path, q = self._query()
+            if path != "/register":
+                return self._reply(404, {"error": "not found"})
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                if self.headers.get("Content-Type") == "application/json":
+                    if image_root is None:
+                        return self._reply(403, {
+                            "error": "path uploads are disabled "
+                                     "(start with --image-root)"
+                        })
+                    q.update(json.loads(body))
+                    body = resolve_image_path(image_root, q["path"])
+                result = service.register(q["client"], q["identity"], body)
+            except KeyError as e:
+                return self._reply(400, {"error": f"missing {e}"})
+            except PermissionError as e:
+                return self._reply(403, {"error": str(e)})
+            except Exception as e:
+                return self._reply(422, {"error": str(e)})
+            self._reply(200, result)
+
+        def do_GET(self):
+            path, q = self._query()
+            if path == "/stats":
+                return self._reply(200, service.stats())
+            if path == "/identity":
+                result = service.lookup(q.get("client"), q.get("identity"))
+                if result is None:
+                    return self._reply(404, {"error": "unknown identity"})
+                return self._reply(200, result)
+            self._reply(404, {"error": "not found"})
+
+        def do_DELETE(self):
+            path, q = self._query()
+            if path != "/identity":
+                return self._reply(404, {"error": "not found"})
+            found = service.reset(q.get("client"), q.get("identity"))
+            self._reply(200 if found else 404, {"reset": found})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(service, host=HOST, port=PORT, image_root=None):
+    return ThreadingHTTPServer(
+        (host, port), make_handler(service, image_root)
+    )
+
+
+# ---------------- REPLAY (LOCAL STAND-IN CLIENT) ----------------
+def upload(url, client, identity, img_path):
+    with open(img_path, "rb") as f:
+        data = f.read()
+    query = urlencode({"client": client, "identity": identity})
+    req = Request(
+        f"{url}/register?{query}",
+        data=data, headers={"Content-Type": "application/octet-stream"}
+    )
+    with urlopen(req) as resp:
+        return json.loads(resp.read())
+
+
+def replay(manifest, url, concurrency=REPLAY_CONCURRENCY):
+    """Upload an attack_manifest.json over HTTP the way clients would:
+    each registration's images one after another, ``concurrency``
+    registrations at a time. Returns client-side latencies, throughput and
+    the ROC-AUC of the final online scores."""
+    celeba_dir = manifest["celeba_dir"]
+    regs = []
+    for r in manifest["records"]:
+        key = (r["client"], r["identity"])
+        if not regs or regs[-1][0] != key:
+            regs.append((key, r["label"], []))
+        regs[-1][2].append(
+            os.path.join(celeba_dir, r["source_identity"], r["source_image"])
+        )
+
+    def run(reg):
+        (client, identity), label, paths = reg
+        lat, last = [], None
+        for p in paths:
+            t = time.perf_counter()
+            last = upload(url, client, identity, p)
+            lat.append((time.perf_counter() - t) * 1000)
+        return label, last, lat
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(run, regs))
+    wall = time.perf_counter() - start
+
+    lat = np.array([ms for _, _, l in results for ms in l])
+    scored = [(label, r["score"]) for label, r, _ in results
+              if r["score"] is not None]
+    p50 = p99 = auc = None
+    if len(lat):
+        p50, p99 = (float(p) for p in np.percentile(lat, [50, 99]))
+    # ROC-AUC needs both classes among the scored registrations
+    if len({label for label, _ in scored}) == 2:
+        auc = StreamingROC().update(
+            [label for label, _ in scored], [s for _, s in scored]
+        ).auc()
+    return {
+        "registrations": len(regs),
+        "uploads": len(lat),
+        "uploads_per_sec": len(lat) / wall if wall > 0 else None,
+        "client_p50_ms": p50,
+        "client_p99_ms": p99,
+        "roc_auc": auc
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Online multi-face registration scoring service"
+    )
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--backbone",
+        choices=sorted(BACKBONES),
+        default=DEFAULT_BACKBONE
+    )
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="Seeded random init instead of pretrained weights (offline tests)"
+    )
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument(
+        "--score-mode",
+        choices=ONLINE_SCORES,
+        default=SCORE_MODE
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Flag identities whose score reaches this value"
+    )
+    parser.add_argument(
+        "--calibrate",
+        default=None,
+        metavar="SCORES_NPZ",
+        help="Set --threshold at 1%% FPR from an offline scores.npz"
+    )
+    parser.add_argument(
+        "--replay",
+        default=None,
+        metavar="MANIFEST",
+        help="Upload this attack_manifest.json concurrently and report "
+             "latency (against --url, else an in-process server)"
+    )
+    parser.add_argument("--url", default=None)
+    parser.add_argument(
+        "--image-root",
+        default=None,
+        help="Accept JSON {\"path\": ...} uploads of server-local files "
+             "below this directory (off by default)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=REPLAY_CONCURRENCY,
+        help="Registrations uploading at once during --replay"
+    )
+    args = parser.parse_args()
+    if args.random_weights and not random_init_supported(args.backbone):
+        parser.error(f"--random-weights is not supported for {args.backbone}")
+
+    if args.replay and args.url:
+        with open(args.replay) as f:
+            report = replay(json.load(f), args.url, args.concurrency)
+        print(json.dumps(report, indent=2))
+        return
+
+    threshold = args.threshold
+    if args.calibrate:
+        try:
+            threshold = calibrate_threshold(args.calibrate, args.score_mode)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"[INFO] Threshold at 1% FPR: {threshold:.4f}")
+
+    service = DetectionService(
+        args.backbone, args.random_weights, args.max_batch,
+        args.max_wait_ms, args.score_mode, threshold
+    )
+    port = 0 if args.replay else args.port
+    server = serve(service, args.host, port, args.image_root)
+    url = f"http://{args.host}:{server.server_address[1]}"
+
+    if args.replay:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        with open(args.replay) as f:
+            report = replay(json.load(f), url, args.concurrency)
+        server.shutdown()
+        report["service"] = service.stats()
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"[INFO] Serving {args.backbone} on {url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
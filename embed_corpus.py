@@ -0,0 +1,194 @@
+import os
+import json
+import argparse
+import numpy as np
+
+# ================= CONFIG =================
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
+BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
+
+CELEBA_DIR = os.path.join(BASE_DIR, "celeba_identities")
+CORPUS_DIR = os.path.join(BASE_DIR, "corpus_embeddings")
+
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_FILE = "index.json"
+# =========================================
+
+
+# ---------------- INDEX READER ----------------
+class CorpusEmbeddings:
+    """Read side of the precomputed corpus.
+
+    ``embeddings.npy`` holds one L2-normalised row per image of
+    celeba_identities, grouped by identity; ``index.json`` maps each
+    identity to its ``[start, end)`` row range and stores the image file
+    names in row order, so any (identity, image) pair resolves to a row.
+    """
+
+    def __init__(self, corpus_dir=CORPUS_DIR):
+        with open(os.path.join(corpus_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        self.fingerprint = index["fingerprint"]
+        self.ranges = index["identities"]
+        self.images = index["images"]
+        self.embeddings = np.load(
+            os.path.join(corpus_dir, EMBEDDINGS_FILE), mmap_mode="r"
+        )
+
+        self.rows = {}
+        for identity, (start, end) in self.ranges.items():
+            for row in range(start, end):
+                self.rows[(identity, self.images[row])] = row
+
+    def identity_matrix(self, identity):
+        start, end = self.ranges[identity]
+        return np.asarray(self.embeddings[start:end], dtype=np.float32)
+
+    def lookup(self, pairs):
+        """Stack rows for ``(identity, image)`` pairs; unknown pairs are
+        skipped, mirroring how unreadable images are skipped."""
+        rows = [self.rows[p] for p in pairs if p in self.rows]
+        return np.asarray(self.embeddings[sorted(rows)], dtype=np.float32)
+
+    def lookup_many(self, groups):
+        """``lookup`` for many pair lists at once: returns the stacked rows
+        of every group (each group's rows sorted, as in ``lookup``) and
+        the row count per group, read in one sorted pass over the file."""
+        per_group = [
+            sorted(self.rows[p] for p in pairs if p in self.rows)
+            for pairs in groups
+        ]
+        lengths = np.array([len(r) for r in per_group], dtype=np.int64)
+        rows = np.fromiter(
+            (r for g in per_group for r in g), dtype=np.int64,
+            count=int(lengths.sum())
+        )
+
+        order = np.argsort(rows, kind="stable")
+        out = np.empty((len(rows), self.embeddings.shape[1]), dtype=np.float32)
+        out[order] = self.embeddings[rows[order]]
+        return out, lengths
+
+
+# ---------------- BUILD ----------------
+def build_corpus(celeba_dir, out_dir, batch_size, num_workers,
+                 dtype="float32", cache=None, backbone=None,
+                 loader="dataloader"):
+    from embedding_engine import (
+        build_model, build_transform, embed_images, list_images,
+        model_fingerprint, DEFAULT_BACKBONE
+    )
+    backbone = backbone or DEFAULT_BACKBONE
+
+    identities = sorted(
+        d for d in os.listdir(celeba_dir)
+        if os.path.isdir(os.path.join(celeba_dir, d))
+    )
+    per_id = [sorted(list_images(os.path.join(celeba_dir, i)))
+              for i in identities]
+    paths = [p for imgs in per_id for p in imgs]
+
+    print(f"[INFO] Identities : {len(identities)}")
+    print(f"[INFO] Images     : {len(paths)}")
+
+    model = build_model(backbone=backbone)
+    embeddings, ok, stats = embed_images(
+        model, build_transform(), paths,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        cache=cache,
+        loader=loader
+    )
+
+    print(
+        f"[INFO] Embedded {stats['images']} images in "
+        f"{stats['seconds']:.1f}s ({stats['images_per_sec']:.1f} img/s)"
+    )
+
+    # ---------------- PACK ROWS (DROP UNREADABLE) ----------------
+    ranges, images = {}, []
+    offset = 0
+    for identity, imgs in zip(identities, per_id):
+        start = len(images)
+        for p in imgs:
+            if ok[offset]:
+                images.append(os.path.basename(p))
+            offset += 1
+        ranges[identity] = [start, len(images)]
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(
+        os.path.join(out_dir, EMBEDDINGS_FILE),
+        embeddings[ok].astype(dtype)
+    )
+
+    index = {
+        "fingerprint": model_fingerprint(backbone),
+        "backbone": backbone,
+        "dim": int(embeddings.shape[1]),
+        "dtype": dtype,
+        "num_images": len(images),
+        "identities": ranges,
+        "images": images
+    }
+    with open(os.path.join(out_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+
+    print(f"[INFO] Skipped unreadable images: {int((~ok).sum())}")
+    print(f"[INFO] Corpus embeddings saved to: {out_dir}")
+
+
+def main():
+    from embedding_cache import EmbeddingCache
+    from embedding_engine import (
+        model_fingerprint, BACKBONES, DEFAULT_BACKBONE,
+        DEFAULT_BATCH_SIZE, DEFAULT_NUM_WORKERS, DEFAULT_LOADER, LOADERS
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Embed every image of celeba_identities once"
+    )
+    parser.add_argument("--celeba-dir", default=CELEBA_DIR)
+    parser.add_argument("--out-dir", default=CORPUS_DIR)
+    parser.add_argument(
+        "--backbone", choices=sorted(BACKBONES), default=DEFAULT_BACKBONE
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "--num-workers", type=int, default=DEFAULT_NUM_WORKERS
+    )
+    parser.add_argument(
+        "--loader", choices=LOADERS, default=DEFAULT_LOADER
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float16"],
+        default="float32",
+        help="Storage dtype (float16 halves the file size)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Reuse/populate an embedding cache while building"
+    )
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_dir:
+        cache = EmbeddingCache(
+            args.cache_dir, model_fingerprint(args.backbone)
+        )
+
+    build_corpus(
+        args.celeba_dir, args.out_dir,
+        args.batch_size, args.num_workers,
+        dtype=args.dtype, cache=cache, backbone=args.backbone,
+        loader=args.loader
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# ================= CONFIG =================
+INDEX_FILE = "index.json"
+MATRIX_FILE = "embeddings.f32"
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3     # 2 GiB ~ 260k ResNet-50 rows
+GROW_ROWS = 4096
+# =========================================
+
+
+# ---------------- KEYS ----------------
+def content_hash(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bytes_hash(data):
+    # Same digest as content_hash() of a file holding ``data``.
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def fingerprint(*parts):
+    h = hashlib.blake2b(digest_size=8)
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# ---------------- STORE ----------------
+class EmbeddingCache:
+    """On-disk embedding store keyed by image content hash.
+
+    Each model/transform fingerprint gets its own sub-directory holding a
+    memory-mapped ``(rows, dim)`` float32 matrix and a JSON index mapping
+    content hash -> row. Rows are reused least-recently-used first once
+    ``max_bytes`` worth of rows is allocated. The store assumes a single
+    writer at a time; call ``flush()`` to persist the index. Concurrent
+    processes should open it with ``readonly=True``, which serves hits and
+    silently drops writes.
+
+    A ``base`` cache (typically the shared one, opened read-only) is
+    consulted for keys this one lacks: parallel workers each write a
+    private segment over it, which the single writer ``merge``s afterwards.
+    """
+
+    def __init__(self, cache_dir, model_fingerprint,
+                 max_bytes=DEFAULT_MAX_BYTES, readonly=False, base=None):
+        self.dir = os.path.join(cache_dir, model_fingerprint)
+        self.fingerprint = model_fingerprint
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self.base = base
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.index_path = os.path.join(self.dir, INDEX_FILE)
+        self.matrix_path = os.path.join(self.dir, MATRIX_FILE)
+
+        self.dim = None
+        self.rows = 0
+        self.tick = 0
+        self.entries = {}       # key -> [row, last_used]
+        self.free = []
+        self.matrix = None
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("fingerprint") == model_fingerprint:
+                self.dim = index["dim"]
+                self.rows = index["rows"]
+                self.tick = index["tick"]
+                self.entries = index["entries"]
+                self.free = index["free"]
+                self._open_matrix()
+
+    # ---------------- MATRIX ----------------
+    @property
+    def max_rows(self):
+        return max(1, self.max_bytes // (4 * self.dim))
+
+    def _open_matrix(self):
+        if self.rows == 0:
+            self.matrix = None
+            return
+        self.matrix = np.memmap(
+            self.matrix_path, dtype=np.float32,
+            mode="r" if self.readonly else "r+",
+            shape=(self.rows, self.dim)
+        )
+
+    def _grow(self, needed):
+        new_rows = min(self.max_rows, max(self.rows + GROW_ROWS, needed))
+        if new_rows <= self.rows:
+            return
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        with open(self.matrix_path, "ab") as f:
+            f.truncate(new_rows * self.dim * 4)
+        self.free.extend(range(self.rows, new_rows))
+        self.rows = new_rows
+        self._open_matrix()
+
+    def _evict(self, n):
+        victims = sorted(self.entries.items(), key=lambda kv: kv[1][1])[:n]
+        for key, (row, _) in victims:
+            del self.entries[key]
+            self.free.append(row)
+
+    def _allocate(self, n):
+        if len(self.free) < n:
+            self._grow(self.rows + n - len(self.free))
+        if len(self.free) < n:
+            self._evict(n - len(self.free))
+        rows, self.free = self.free[:n], self.free[n:]
+        return rows
+
+    # ---------------- API ----------------
+    def get_many(self, keys):
+        """Return ``(embeddings, hit_mask)`` for ``keys``.
+
+        Missing rows are zero; ``embeddings`` is ``None`` while the store
+        (and its ``base``) is still empty.
+        """
+        out, hit = self._get_own(keys)
+        if self.base is None or hit.all():
+            return out, hit
+
+        miss = np.flatnonzero(~hit)
+        base_out, base_hit = self.base.get_many([keys[i] for i in miss])
+        if base_hit.any():
+            if out is None:
+                out = np.zeros(
+                    (len(keys), base_out.shape[1]), dtype=np.float32
+                )
+            out[miss[base_hit]] = base_out[base_hit]
+            hit[miss[base_hit]] = True
+        return out, hit
+
+    def _get_own(self, keys):
+        hit = np.zeros(len(keys), dtype=bool)
+        if self.matrix is None:
+            self.misses += len(keys)
+            return None, hit
+
+        out = np.zeros((len(keys), self.dim), dtype=np.float32)
+        rows, pos = [], []
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            self.tick += 1
+            entry[1] = self.tick
+            rows.append(entry[0])
+            pos.append(i)
+
+        if rows:
+            order = np.argsort(rows)          # sequential mmap reads
+            rows = np.asarray(rows)[order]
+            pos = np.asarray(pos)[order]
+            out[pos] = self.matrix[rows]
+            hit[pos] = True
+
+        self.hits += int(hit.sum())
+        self.misses += int((~hit).sum())
+        return out, hit
+
+    def put_many(self, keys, embeddings):
+        if len(keys) == 0 or self.readonly:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dim {embeddings.shape[1]} != cache dim {self.dim}"
+            )
+
+        new_keys = [k for k in dict.fromkeys(keys) if k not in self.entries]
+        # Never evict more than the cache can hold in one call.
+        new_keys = new_keys[-self.max_rows:]
+        rows = self._allocate(len(new_keys))
+        first = {k: i for i, k in reversed(list(enumerate(keys)))}
+
+        for key, row in zip(new_keys, rows):
+            self.tick += 1
+            self.entries[key] = [row, self.tick]
+            self.matrix[row] = embeddings[first[key]]
+
+    def merge(self, other, chunk_rows=GROW_ROWS):
+        """Copy every row of ``other`` (a worker's segment) into this
+        cache; keys already here are kept. Returns the rows copied."""
+        keys = [k for k in other.entries if k not in self.entries]
+        if self.readonly or not keys:
+            return 0
+        for i in range(0, len(keys), chunk_rows):
+            part = keys[i:i + chunk_rows]
+            rows = [other.entries[k][0] for k in part]
+            self.put_many(part, other.matrix[rows])
+        return len(keys)
+
+    def flush(self):
+        if self.readonly:
+            return
+        if self.matrix is not None:
+            self.matrix.flush()
+        index = {
+            "fingerprint": self.fingerprint,
+            "dim": self.dim,
+            "rows": self.rows,
+            "tick": self.tick,
+            "entries": self.entries,
+            "free": self.free
+        }
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,58 +1,180 @@
 import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from array import array
+from collections import defaultdict
 import numpy as np
-from PIL import Image
-from sklearn.metrics import roc_curve, auc
-import torch
-from torchvision import models, transforms
-import matplotlib.pyplot as plt
+
+from embed_corpus import CorpusEmbeddings, CORPUS_DIR
+from embedding_cache import EmbeddingCache, fingerprint
+from image_shards import ShardReader, SHARD_DIR
+from score_ledger import ScoreLedger, sample_key
+from profiling import (
+    PROFILER, timer, save_report, format_report, PROFILE_FILE, CPROFILE_FILE
+)
+from streaming_eval import StreamingROC
+from identity_scorers import SCORERS, segment_score_table
+from render_reports import ReportPool
+from embedding_engine import (
+    build_model,
+    build_transform,
+    embed_image,
+    embed_images,
+    image_hashes,
+    list_images,
+    model_fingerprint,
+    random_init_supported,
+    BACKBONES,
+    DEFAULT_BACKBONE,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_NUM_WORKERS,
+    DEFAULT_LOADER,
+    LOADERS,
+    PREFETCH_DEPTH
+)
 
 # ================= CONFIG =================
-PROJECT_ROOT = r"D:\Face recogination project"
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
 BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
 
 ATTACK_DIR = os.path.join(BASE_DIR, "attack_dataset", "AttackPairs")
 NORMAL_DIR = os.path.join(BASE_DIR, "attack_dataset", "NormalPairs")
+ATTACK_META = os.path.join(BASE_DIR, "attack_dataset", "attack_metadata.json")
 
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "results")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# Shared across seeds/runs: attack folders are copies of celeba_identities,
+# so the same content hash is re-embedded only once.
+CACHE_DIR = os.path.join(BASE_DIR, "embedding_cache")
+CACHE_MAX_GB = 2.0
+
+# Per-identity scores of earlier runs; unchanged identities are not rescored.
+LEDGER_DIR = os.path.join(BASE_DIR, "score_ledger")
+
+# Operating points reported (and bootstrapped) besides ROC-AUC.
+TARGET_FPRS = (0.01, 0.001)
+N_BOOTSTRAP = 1000                 # 0: no confidence intervals (sweeps)
+ROC_STATE_FILE = "roc_state.npz"
+SCORES_FILE = "scores.npz"
+ROC_PLOT_FILE = "roc_embedding_detection.pdf"
+SCORE_PLOT_FILE = "score_distribution.pdf"
+
+# ----- STREAMING (--stream) -----
+RESULTS_FILE = "scores.jsonl"   # append-only, one record per identity
+STREAM_CHUNK = 2048             # identities embedded per step
+STREAM_FLUSH_CHUNKS = 8         # persist cache index and ledger this often
 
 # ----- ABLATION SWITCH -----
-SCORE_MODE = "max"   # "max" (ours) or "mean"
+# Every scorer in identity_scorers.SCORERS is computed and saved; this one
+# drives the reported metrics and plots (override with --score-mode).
+SCORE_MODE = "max"   # "max" (ours), "mean", "pairwise_min", ...
 # ==========================
 
 # ---------------- DEVICE ----------------
 device = "cpu"
 
 # ---------------- MODEL ----------------
-model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
-model.fc = torch.nn.Identity()
-model.eval().to(device)
+# Built on first use, so DataLoader workers (spawned on Windows) do not
+# reload the CNN when they re-import this module, and runs that never
+# embed an image (corpus index, fully cached, replotting) never import
+# torch at all.
+model = None
+backbone = DEFAULT_BACKBONE
+pretrained = True
+transform = None
+
 
-# ---------------- TRANSFORM ----------------
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225]
+def get_transform():
+    global transform
+    if transform is None:
+        transform = build_transform()
+    return transform
+
+
+def load_model(name=None, random_weights=False):
+    global model, backbone, pretrained
+    name = name or backbone
+    if model is None or (name, not random_weights) != (backbone, pretrained):
+        model = build_model(
+            device, backbone=name, pretrained=not random_weights
+        )
+        backbone, pretrained = name, not random_weights
+    return model
+
+
+def open_cache(cache_dir=CACHE_DIR, max_gb=CACHE_MAX_GB, readonly=False,
+               name=None, random_weights=False, base=None):
+    return EmbeddingCache(
+        cache_dir,
+        model_fingerprint(name or backbone, not random_weights),
+        max_bytes=int(max_gb * 1024 ** 3),
+        readonly=readonly,
+        base=base
     )
-])
+
+
+def open_ledger(ledger_dir=LEDGER_DIR, readonly=False, name=None,
+                random_weights=False, reader=None):
+    # Scores of shard-read images (``reader``) are kept apart per format
+    # and resize, since the same content hash can decode differently.
+    return ScoreLedger(
+        ledger_dir,
+        fingerprint(
+            model_fingerprint(name or backbone, not random_weights),
+            *sorted(SCORERS),
+            reader.fingerprint if reader is not None else "files"
+        ),
+        readonly=readonly
+    )
+
 
 # ---------------- EMBEDDING FUNCTION ----------------
-@torch.no_grad()
 def get_embedding(img_path):
-    img = Image.open(img_path).convert("RGB")
-    x = transform(img).unsqueeze(0).to(device)
-    emb = model(x).squeeze().cpu().numpy()
-    return emb / np.linalg.norm(emb)
+    return embed_image(load_model(), get_transform(), img_path, device=device)
+
 
 # ---------------- IDENTITY SCORE ----------------
+def segment_scores(embeddings, lengths, mode=None):
+    # One scorer over many identities; see identity_scorers for the kernel.
+    mode = mode or SCORE_MODE
+    return segment_score_table(embeddings, lengths, [mode])[mode]
+
+
+def score_embeddings(embeddings):
+    if len(embeddings) < 2:
+        return None
+    return segment_scores(embeddings, [len(embeddings)])[0]
+
+
+def _score_rows(table, n):
+    # Column table -> one {scorer: score} dict per identity (None when the
+    # identity had fewer than two readable images).
+    rows = []
+    for i in range(n):
+        if np.isnan(table[SCORE_MODE][i]):
+            rows.append(None)
+        else:
+            rows.append({name: float(v[i]) for name, v in table.items()})
+    return rows
+
+
+def _label_table(samples, rows):
+    # Keep scored identities only: labels plus one score array per scorer.
+    kept = [(label, r) for (label, _), r in zip(samples, rows) if r is not None]
+    y_true = [label for label, _ in kept]
+    table = {name: [r[name] for _, r in kept] for name in SCORERS}
+    return y_true, table
+
+
 def compute_identity_score(identity_dir):
-    imgs = [
-        os.path.join(identity_dir, f)
-        for f in os.listdir(identity_dir)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ]
+    imgs = list_images(identity_dir)
 
     if len(imgs) < 2:
         return None
@@ -67,111 +189,1179 @@ def compute_identity_score(identity_dir):
     if len(embeddings) < 2:
         return None
 
-    embeddings = np.vstack(embeddings)
+    return score_embeddings(np.vstack(embeddings))
 
-    center = embeddings.mean(axis=0)
-    center = center / np.linalg.norm(center)
 
-    distances = 1.0 - np.dot(embeddings, center)
+# ---------------- COLLECT SAMPLES ----------------
+def walk_identities(root_dir, label):
+    # Lazy walk: yields (label, images) per identity folder, one client
+    # listing at a time.
+    for client in os.listdir(root_dir):
+        client_path = os.path.join(root_dir, client)
+        if not os.path.isdir(client_path):
+            continue
 
-    if SCORE_MODE == "mean":
-        return distances.mean()
+        for identity in os.listdir(client_path):
+            id_path = os.path.join(client_path, identity)
+            if not os.path.isdir(id_path):
+                continue
 
-    # default: max
-    return distances.max()
+            imgs = list_images(id_path)
+            if len(imgs) >= 2:
+                yield label, imgs
 
-# ---------------- COLLECT SAMPLES ----------------
-y_true, y_score = [], []
 
-# ---- NORMAL ----
-for client in os.listdir(NORMAL_DIR):
-    client_path = os.path.join(NORMAL_DIR, client)
-    if not os.path.isdir(client_path):
-        continue
+def collect_identities(root_dir, label):
+    return list(walk_identities(root_dir, label))
 
-    for identity in os.listdir(client_path):
-        id_path = os.path.join(client_path, identity)
-        if not os.path.isdir(id_path):
-            continue
 
-        score = compute_identity_score(id_path)
-        if score is not None:
-            y_true.append(0)
-            y_score.append(score)
+def identity_scores(samples, batch_size, num_workers, cache=None, reader=None,
+                    name=None, random_weights=False, loader=DEFAULT_LOADER,
+                    prefetch_depth=PREFETCH_DEPTH, flush=True, hashes=None):
+    # Flatten every identity into one image list so the DataLoader can keep
+    # all workers busy, then slice the embedding matrix back per identity.
+    # The model is only loaded if the cache cannot serve every image.
+    # Returns one {scorer: score} dict per sample (None: fewer than 2
+    # readable images). ``hashes``: per-sample image hashes, if known.
+    paths = [p for _, imgs in samples for p in imgs]
+    if hashes is not None:
+        hashes = [h for sample in hashes for h in sample]
+    embeddings, ok, stats = embed_images(
+        None, transform, paths,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        device=device,
+        cache=cache,
+        reader=reader,
+        model_fn=lambda: load_model(name, random_weights),
+        loader=loader,
+        prefetch_depth=prefetch_depth,
+        flush=flush,
+        hashes=hashes
+    )
 
-# ---- ATTACK ----
-for client in os.listdir(ATTACK_DIR):
-    client_path = os.path.join(ATTACK_DIR, client)
-    if not os.path.isdir(client_path):
-        continue
+    with timer("centroid"):
+        # Drop unreadable rows and shrink each identity's segment to match.
+        owner = np.repeat(
+            np.arange(len(samples)), [len(imgs) for _, imgs in samples]
+        )
+        lengths = np.bincount(owner[ok], minlength=len(samples))
+        scores = _score_rows(
+            segment_score_table(embeddings[ok], lengths), len(samples)
+        )
+    PROFILER.count("identities_scored", len(samples))
+
+    return scores, stats
+
+
+def sample_hashes(samples, reader=None, num_workers=DEFAULT_NUM_WORKERS):
+    # Image content hashes per sample, hashed in one pass over all images.
+    flat = image_hashes(
+        [p for _, imgs in samples for p in imgs], reader, num_workers
+    )
+    bounds = np.cumsum([0] + [len(imgs) for _, imgs in samples])
+    return [flat[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def ledger_scores(samples, batch_size, num_workers, cache=None, reader=None,
+                  name=None, random_weights=False, ledger=None,
+                  loader=DEFAULT_LOADER, prefetch_depth=PREFETCH_DEPTH,
+                  keys=None, flush=True, hashes=None):
+    """Per-sample ``{scorer: score}`` dicts (``None``: fewer than two
+    readable images) and embedding stats. With a ``ScoreLedger`` only
+    identities whose ``sample_key`` (or precomputed ``keys``) is not in it
+    are embedded and scored; the image hashes behind the keys (or
+    precomputed per-sample ``hashes``) double as the cache keys.
+    ``flush=False`` leaves persisting the cache and ledger to the caller
+    (each flush rewrites their whole index)."""
+    todo = None
+    if ledger is not None:
+        if hashes is None:
+            hashes = sample_hashes(samples, reader, num_workers)
+        with timer("ledger"):
+            if keys is None:
+                keys = [sample_key(h) for h in hashes]
+            todo = [i for i, k in enumerate(keys) if k not in ledger]
+            scores = [ledger.get(k) for k in keys]
+    else:
+        todo = list(range(len(samples)))
+        scores = [None] * len(samples)
+
+    computed, stats = identity_scores(
+        [samples[i] for i in todo], batch_size, num_workers, cache, reader,
+        name=name, random_weights=random_weights, loader=loader,
+        prefetch_depth=prefetch_depth, flush=flush,
+        hashes=None if hashes is None else [hashes[i] for i in todo]
+    )
+    for i, score in zip(todo, computed):
+        scores[i] = score
+
+    if ledger is not None:
+        with timer("ledger"):
+            ledger.put_many([keys[i] for i in todo], computed)
+            if flush:
+                ledger.flush()
+    stats["ledger_hits"] = len(samples) - len(todo)
+    stats["rescored"] = len(todo)
+    return scores, stats
+
+
+def score_samples(samples, batch_size, num_workers, cache=None, reader=None,
+                  name=None, random_weights=False, ledger=None,
+                  loader=DEFAULT_LOADER, prefetch_depth=PREFETCH_DEPTH):
+    """Return ``(y_true, scores, stats)`` where ``scores`` maps every
+    scorer name to the scores of the kept identities (see
+    ``ledger_scores``)."""
+    scores, stats = ledger_scores(
+        samples, batch_size, num_workers, cache, reader, name=name,
+        random_weights=random_weights, ledger=ledger, loader=loader,
+        prefetch_depth=prefetch_depth
+    )
+    y_true, table = _label_table(samples, scores)
+    return y_true, table, stats
+
+
+# ---------------- SCORE FROM PRECOMPUTED CORPUS ----------------
+def metadata_samples(attack_meta):
+    # Rebuild each identity's image list from the generator's records
+    # instead of walking the copied NormalPairs/AttackPairs folders.
+    for c in attack_meta["clients"]:
+        if c["type"] == "normal":
+            if "identity_images" not in c:
+                raise RuntimeError(
+                    "attack_metadata.json has no image-level records; "
+                    "re-run generate_multiface_attack.py."
+                )
+            for identity, imgs in c["identity_images"].items():
+                yield 0, [(identity, img) for img in imgs]
+        else:
+            pairs = [
+                (c["target_identity"], img) for img in c["target_images"]
+            ]
+            for donor, imgs in c["donor_images"].items():
+                pairs.extend((donor, img) for img in imgs)
+            yield 1, pairs
 
-    for identity in os.listdir(client_path):
-        id_path = os.path.join(client_path, identity)
-        if not os.path.isdir(id_path):
-            continue
 
-        score = compute_identity_score(id_path)
-        if score is not None:
-            y_true.append(1)
-            y_score.append(score)
+def manifest_samples(manifest):
+    # Group attack_manifest.json records into registration folders, keeping
+    # the generator's order.
+    groups = {}
+    for r in manifest["records"]:
+        key = (r["client"], r["identity"])
+        if key not in groups:
+            groups[key] = (r["label"], [])
+        groups[key][1].append((r["source_identity"], r["source_image"]))
+    return list(groups.values())
 
-# ---------------- SANITY CHECK ----------------
-y_true = np.array(y_true)
-y_score = np.array(y_score)
 
-print(f"[INFO] Total samples : {len(y_true)}")
-print(f"[INFO] Attack samples: {(y_true == 1).sum()}")
-print(f"[INFO] Normal samples: {(y_true == 0).sum()}")
+def manifest_path_samples(manifest):
+    celeba_dir = manifest["celeba_dir"]
+    return [
+        (label, [os.path.join(celeba_dir, i, img) for i, img in pairs])
+        for label, pairs in manifest_samples(manifest)
+    ]
+
+
+def shard_key_samples(pair_samples):
+    # ShardReader keys are "<identity>/<image>".
+    return [
+        (label, [f"{i}/{img}" for i, img in pairs])
+        for label, pairs in pair_samples
+    ]
+
+
+def score_from_index(meta_path, corpus_dir, manifest=None):
+    corpus = CorpusEmbeddings(corpus_dir)
+    if manifest is not None:
+        samples = manifest_samples(manifest)
+    else:
+        with open(meta_path) as f:
+            samples = metadata_samples(json.load(f))
+
+    samples = list(samples)
+    with timer("index_lookup"):
+        emb, lengths = corpus.lookup_many([pairs for _, pairs in samples])
+    with timer("centroid"):
+        scores = _score_rows(segment_score_table(emb, lengths), len(samples))
+
+    y_true, table = _label_table(samples, scores)
+    return y_true, table, corpus
 
-if len(np.unique(y_true)) < 2:
-    raise RuntimeError("ROC cannot be computed: only one class present.")
 
 # ---------------- ROC + AUC ----------------
-fpr, tpr, _ = roc_curve(y_true, y_score)
-roc_auc = auc(fpr, tpr)
-
-plt.figure(figsize=(6, 6), dpi=300)
-plt.plot(fpr, tpr, label=f"AUC = {roc_auc:.3f}", linewidth=2)
-plt.plot([0, 1], [0, 1], "k--", linewidth=1)
-plt.xlabel("False Positive Rate")
-plt.ylabel("True Positive Rate")
-plt.title(f"ROC ({SCORE_MODE} cosine distance)")
-plt.legend(loc="lower right")
-plt.grid(True)
-
-roc_path = os.path.join(OUTPUT_DIR, "roc_embedding_detection.pdf")
-plt.savefig(roc_path, bbox_inches="tight")
-plt.close()
-
-# ---------------- METRICS ----------------
-def tpr_at_fpr(target_fpr):
-    idx = np.where(fpr <= target_fpr)[0]
-    return tpr[idx[-1]] if len(idx) else 0.0
-
-print("\n========== RESULTS ==========")
-print(f"SCORE_MODE        : {SCORE_MODE}")
-print(f"ROC-AUC          : {roc_auc:.4f}")
-print(f"TPR @ FPR = 1%   : {tpr_at_fpr(0.01):.4f}")
-print(f"TPR @ FPR = 0.1% : {tpr_at_fpr(0.001):.4f}")
-print(f"ROC curve saved  : {roc_path}")
-
-# ================= SCORE DISTRIBUTION =================
-normal_scores = y_score[y_true == 0]
-attack_scores = y_score[y_true == 1]
-
-plt.figure(figsize=(7, 5), dpi=300)
-
-plt.hist(normal_scores, bins=50, density=True, alpha=0.6, label="Normal")
-plt.hist(attack_scores, bins=50, density=True, alpha=0.7, label="Attack")
-
-plt.xlabel("Anomaly Score (Cosine Distance)")
-plt.ylabel("Density")
-plt.title(f"Score Distribution ({SCORE_MODE} cosine distance)")
-plt.legend()
-plt.grid(True)
-
-score_plot_path = os.path.join(OUTPUT_DIR, "score_distribution.pdf")
-plt.savefig(score_plot_path, bbox_inches="tight")
-plt.close()
-
-print(f"Score distribution plot saved to: {score_plot_path}")
\ No newline at end of file
+def summarize(evaluator, n_boot=N_BOOTSTRAP):
+    # The bootstrap dominates a small run (seconds over 2**16 bins); with
+    # n_boot=0 the *_ci95 keys are None.
+    tprs = evaluator.tpr_at_fpr(TARGET_FPRS)
+    ci = dict.fromkeys(("auc", "tpr@0.01", "tpr@0.001"))
+    if n_boot:
+        ci = evaluator.bootstrap(TARGET_FPRS, n_boot=n_boot)
+    return {
+        "roc_auc": evaluator.auc(),
+        "tpr_1pct": float(tprs[0]),
+        "tpr_0.1pct": float(tprs[1]),
+        "roc_auc_ci95": ci["auc"],
+        "tpr_1pct_ci95": ci["tpr@0.01"],
+        "tpr_0.1pct_ci95": ci["tpr@0.001"]
+    }
+
+
+def ablation_metrics(y_true, table):
+    # Cheap per-scorer comparison (no bootstrap) from the same identities.
+    out = {}
+    for name, scores in table.items():
+        ev = StreamingROC(score_range=SCORERS[name]["range"])
+        ev.update(y_true, scores)
+        out[name] = {
+            "roc_auc": ev.auc(),
+            "tpr_1pct": float(ev.tpr_at_fpr(TARGET_FPRS)[0])
+        }
+    return out
+
+
+def plot_paths(output_dir):
+    return {
+        "roc_path": os.path.join(output_dir, ROC_PLOT_FILE),
+        "score_plot_path": os.path.join(output_dir, SCORE_PLOT_FILE)
+    }
+
+
+def plot_roc(fpr, tpr, roc_auc, output_dir, mode=None):
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(6, 6), dpi=300)
+    plt.plot(fpr, tpr, label=f"AUC = {roc_auc:.3f}", linewidth=2)
+    plt.plot([0, 1], [0, 1], "k--", linewidth=1)
+    plt.xlabel("False Positive Rate")
+    plt.ylabel("True Positive Rate")
+    plt.title(f"ROC ({mode or SCORE_MODE} score)")
+    plt.legend(loc="lower right")
+    plt.grid(True)
+
+    roc_path = os.path.join(output_dir, ROC_PLOT_FILE)
+    plt.savefig(roc_path, bbox_inches="tight")
+    plt.close()
+    return roc_path
+
+
+def plot_score_distribution(y_true, y_score, output_dir, mode=None):
+    import matplotlib.pyplot as plt
+    normal_scores = y_score[y_true == 0]
+    attack_scores = y_score[y_true == 1]
+
+    plt.figure(figsize=(7, 5), dpi=300)
+
+    plt.hist(normal_scores, bins=50, density=True, alpha=0.6, label="Normal")
+    plt.hist(attack_scores, bins=50, density=True, alpha=0.7, label="Attack")
+
+    plt.xlabel(f"Anomaly Score ({mode or SCORE_MODE})")
+    plt.ylabel("Density")
+    plt.title(f"Score Distribution ({mode or SCORE_MODE} score)")
+    plt.legend()
+    plt.grid(True)
+
+    score_plot_path = os.path.join(output_dir, SCORE_PLOT_FILE)
+    plt.savefig(score_plot_path, bbox_inches="tight")
+    plt.close()
+    return score_plot_path
+
+
+def plot_score_histogram(evaluator, output_dir, mode=None, bins=50):
+    # Score distribution from the evaluator's class histograms (streaming
+    # runs keep no per-identity score arrays).
+    import matplotlib.pyplot as plt
+    occupied = np.flatnonzero(evaluator.pos + evaluator.neg)
+    lo, hi = occupied[0], occupied[-1] + 1
+    step = max(1, -(-(hi - lo) // bins))
+    edges = np.arange(lo, hi + step, step)
+    width = (evaluator.hi - evaluator.lo) / evaluator.bins
+
+    plt.figure(figsize=(7, 5), dpi=300)
+    for counts, label, alpha in ((evaluator.neg, "Normal", 0.6),
+                                 (evaluator.pos, "Attack", 0.7)):
+        hist = np.add.reduceat(counts[lo:edges[-1]], edges[:-1] - lo)
+        density = hist / max(hist.sum(), 1) / (step * width)
+        plt.stairs(
+            density, evaluator.lo + edges * width, fill=True, alpha=alpha,
+            label=label
+        )
+
+    plt.xlabel(f"Anomaly Score ({mode or SCORE_MODE})")
+    plt.ylabel("Density")
+    plt.title(f"Score Distribution ({mode or SCORE_MODE} score)")
+    plt.legend()
+    plt.grid(True)
+
+    score_plot_path = os.path.join(output_dir, SCORE_PLOT_FILE)
+    plt.savefig(score_plot_path, bbox_inches="tight")
+    plt.close()
+    return score_plot_path
+
+
+# ---------------- RUN ----------------
+def build_samples(manifest=None, metadata=ATTACK_META, shards=None,
+                  pairs_dir=None):
+    if shards is not None:
+        if manifest is not None:
+            pairs = manifest_samples(manifest)
+        else:
+            with open(metadata) as f:
+                pairs = list(metadata_samples(json.load(f)))
+        return shard_key_samples(pairs)
+    if manifest is not None:
+        return manifest_path_samples(manifest)
+
+    normal_dir, attack_dir = NORMAL_DIR, ATTACK_DIR
+    if pairs_dir is not None:
+        normal_dir = os.path.join(pairs_dir, "NormalPairs")
+        attack_dir = os.path.join(pairs_dir, "AttackPairs")
+    return (
+        collect_identities(normal_dir, 0) +
+        collect_identities(attack_dir, 1)
+    )
+
+
+def iter_samples(manifest=None, metadata=ATTACK_META, shards=None,
+                 pairs_dir=None):
+    # build_samples without materializing the folder walk.
+    if shards is not None or manifest is not None:
+        yield from build_samples(manifest, metadata, shards, pairs_dir)
+        return
+
+    normal_dir, attack_dir = NORMAL_DIR, ATTACK_DIR
+    if pairs_dir is not None:
+        normal_dir = os.path.join(pairs_dir, "NormalPairs")
+        attack_dir = os.path.join(pairs_dir, "AttackPairs")
+    yield from walk_identities(normal_dir, 0)
+    yield from walk_identities(attack_dir, 1)
+
+
+def flush_stores(cache=None, ledger=None):
+    with timer("flush"):
+        if cache is not None:
+            cache.flush()
+        if ledger is not None:
+            ledger.flush()
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ResumeIndex:
+    """Records an interrupted streaming run left in scores.jsonl, looked
+    up without holding them in memory.
+
+    One pass over the file keeps a 64-bit hash of each record's
+    ``(key, label)`` and its byte offset, sorted by hash, plus a bitmap of
+    the records taken; a record is parsed again only when the walk reaches
+    its identity. A torn last line (killed mid-write) is cut off so
+    appending continues from a clean record.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        hashes, offsets = array("q"), array("q")
+        good = 0
+        with open(path, "rb") as f:
+            for n, line in enumerate(f):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                if n == 0:
+                    if rec != {"header": header}:
+                        raise RuntimeError(
+                            f"{path} was written by a different model or "
+                            "scorer set; rerun with --no-resume"
+                        )
+                else:
+                    hashes.append(self._hash(rec["key"], rec["label"]))
+                    offsets.append(good)
+                good += len(line)
+        with open(path, "r+b") as f:
+            f.truncate(good)
+
+        self.end = good                 # appended records start here
+        hashes = np.frombuffer(hashes, dtype=np.int64)
+        order = np.argsort(hashes, kind="stable")
+        self.hashes = hashes[order]
+        self.offsets = np.frombuffer(offsets, dtype=np.int64)[order]
+        self.taken = np.zeros(len(order), dtype=bool)
+        self._file = open(path, "rb")
+
+    @staticmethod
+    def _hash(key, label):
+        # sample_key is a hex digest: 62 bits of it plus the label bit.
+        return (int(key[:16], 16) >> 2 << 1) | int(label)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def num_taken(self):
+        return int(self.taken.sum())
+
+    def _read(self, offset):
+        self._file.seek(offset)
+        return json.loads(self._file.readline())
+
+    def take(self, key, label):
+        """The earlier record of this identity (once per occurrence), or
+        ``None``."""
+        h = self._hash(key, label)
+        lo = np.searchsorted(self.hashes, h, "left")
+        hi = np.searchsorted(self.hashes, h, "right")
+        for row in range(lo, hi):
+            if self.taken[row]:
+                continue
+            rec = self._read(int(self.offsets[row]))
+            if rec["key"] == key and rec["label"] == label:
+                self.taken[row] = True
+                return rec
+        return None
+
+    def drop_untaken(self):
+        """Rewrite the file without the earlier records nothing took,
+        streaming it once. Returns how many were dropped."""
+        stale = len(self) - self.num_taken
+        if not stale:
+            return 0
+        keep = set(self.offsets[self.taken].tolist())
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            dst.write(src.readline())               # header
+            while src.tell() < self.end:
+                offset = src.tell()
+                line = src.readline()
+                if offset in keep:
+                    dst.write(line)
+            shutil.copyfileobj(src, dst)            # this run's records
+        os.replace(tmp, self.path)
+        return stale
+
+    def close(self):
+        self._file.close()
+
+
+def stream_detection(manifest=None,
+                     metadata=ATTACK_META,
+                     batch_size=DEFAULT_BATCH_SIZE,
+                     num_workers=DEFAULT_NUM_WORKERS,
+                     cache=None,
+                     shards=None,
+                     name=None,
+                     random_weights=False,
+                     output_dir=OUTPUT_DIR,
+                     pairs_dir=None,
+                     ledger=None,
+                     loader=DEFAULT_LOADER,
+                     prefetch_depth=PREFETCH_DEPTH,
+                     score_mode=SCORE_MODE,
+                     chunk_identities=STREAM_CHUNK,
+                     resume=True,
+                     n_boot=N_BOOTSTRAP,
+                     plots=True,
+                     plot_pool=None,
+                     verbose=True):
+    """Memory-bounded ``run_detection`` for very large federations.
+
+    Identities are pulled lazily from the folder walk (or manifest),
+    embedded ``chunk_identities`` at a time, and each one's record
+    (``sample_key``, label, every scorer's score) is appended to
+    scores.jsonl as its chunk completes. Metrics come from one
+    ``StreamingROC`` per scorer, so memory does not grow with the number
+    of clients. With ``resume`` an interrupted run skips the identities
+    already in scores.jsonl; only records whose key (and label) the
+    current walk produces are counted, and records of identities no longer
+    in the dataset are dropped from the file once the run completes
+    (see ``ResumeIndex``). The cache index and ledger are persisted every
+    ``STREAM_FLUSH_CHUNKS`` chunks and at the end; only scores.jsonl is
+    synced per chunk. ``plots`` and ``plot_pool`` as in ``run_detection``.
+    """
+    PROFILER.reset()
+    log = print if verbose else (lambda *a, **k: None)
+    os.makedirs(output_dir, exist_ok=True)
+
+    name = name or backbone
+    header = {
+        "backbone": name,
+        "pretrained": not random_weights,
+        "scorers": sorted(SCORERS)
+    }
+    evaluators = {
+        mode: StreamingROC(score_range=SCORERS[mode]["range"])
+        for mode in SCORERS
+    }
+
+    def account(records):
+        rows = [r for r in records if r["scores"] is not None]
+        labels = [r["label"] for r in rows]
+        for mode, ev in evaluators.items():
+            ev.update(labels, [r["scores"][mode] for r in rows])
+
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    previous = None     # records of an earlier run, top of the file
+    if resume and os.path.exists(results_path):
+        with timer("resume"):
+            previous = ResumeIndex(results_path, header)
+        log(f"[INFO] Resuming: {len(previous)} identities already scored")
+    elif os.path.exists(results_path):
+        os.remove(results_path)
+
+    reader = shards
+    totals = defaultdict(float)
+    with open(results_path, "a") as out:
+        if out.tell() == 0:
+            out.write(json.dumps({"header": header}) + "\n")
+
+        chunks = _chunks(
+            iter_samples(manifest, metadata, shards, pairs_dir),
+            chunk_identities
+        )
+        for i, chunk in enumerate(chunks):
+            hashes = sample_hashes(chunk, reader, num_workers)
+            with timer("ledger"):
+                keys = [sample_key(h) for h in hashes]
+
+            # An earlier record counts only when the walk reaches an
+            # identity with its key and label (once per occurrence), so
+            # scores of a different dataset in the same output dir never
+            # leak into the metrics.
+            todo, hits = [], []
+            with timer("resume"):
+                for j, ((label, _), key) in enumerate(zip(chunk, keys)):
+                    rec = None
+                    if previous is not None:
+                        rec = previous.take(key, label)
+                    if rec is not None:
+                        hits.append(rec)
+                    else:
+                        todo.append(j)
+            account(hits)
+            totals["resumed"] += len(hits)
+            if not todo:
+                continue
+
+            scores, stats = ledger_scores(
+                [chunk[j] for j in todo], batch_size, num_workers, cache,
+                reader, name=name, random_weights=random_weights,
+                ledger=ledger, loader=loader, prefetch_depth=prefetch_depth,
+                keys=[keys[j] for j in todo],
+                hashes=[hashes[j] for j in todo], flush=False
+            )
+            records = [
+                {"key": keys[j], "label": chunk[j][0], "scores": score}
+                for j, score in zip(todo, scores)
+            ]
+            with timer("write_results"):
+                out.writelines(json.dumps(r) + "\n" for r in records)
+                out.flush()
+                os.fsync(out.fileno())
+            account(records)
+            totals["written"] += len(records)
+
+            for key in ("images", "seconds", "cache_hits", "computed",
+                        "ledger_hits", "rescored"):
+                totals[key] += stats.get(key, 0)
+            totals["stall_seconds"] += stats["loader"].get("stall_seconds", 0)
+            log(
+                f"[INFO] Chunk {i}: {len(records)} identities, "
+                f"{stats['images']} images in {stats['seconds']:.1f}s "
+                f"({int(totals['resumed'] + totals['written'])} done)"
+            )
+            if (i + 1) % STREAM_FLUSH_CHUNKS == 0:
+                flush_stores(cache, ledger)
+    flush_stores(cache, ledger)
+
+    # Records of identities not in this walk (dataset changed, or label
+    # flipped) are dropped so scores.jsonl matches the metrics.
+    stale = 0
+    if previous is not None:
+        previous.close()
+        with timer("resume"):
+            stale = previous.drop_untaken()
+    if stale:
+        log(
+            f"[INFO] Dropped {stale} earlier records of identities not "
+            f"in the current dataset"
+        )
+
+    if ledger is not None:
+        log(
+            f"[INFO] Score ledger: {int(totals['ledger_hits'])} unchanged, "
+            f"{int(totals['rescored'])} rescored, {len(ledger)} stored"
+        )
+
+    # ---------------- METRICS ----------------
+    evaluator = evaluators[score_mode]
+    if evaluator.num_pos + evaluator.num_neg == 0:
+        raise RuntimeError("No identities with >= 2 images to score")
+    log(f"[INFO] Total samples : {evaluator.num_pos + evaluator.num_neg}")
+    log(f"[INFO] Attack samples: {evaluator.num_pos}")
+    log(f"[INFO] Normal samples: {evaluator.num_neg}")
+
+    results = {
+        "score_mode": score_mode,
+        "backbone": name,
+        "pretrained": not random_weights,
+        "results_path": results_path,
+        "resumed": int(totals.pop("resumed", 0)),
+        "dropped_stale": stale
+    }
+    with timer("roc"):
+        state_path = os.path.join(output_dir, ROC_STATE_FILE)
+        evaluator.save(state_path)
+        results.update(summarize(evaluator, n_boot=n_boot))
+        results["ablation"] = {
+            mode: {
+                "roc_auc": ev.auc(),
+                "tpr_1pct": float(ev.tpr_at_fpr(TARGET_FPRS)[0])
+            }
+            for mode, ev in evaluators.items()
+        }
+
+    seconds = totals["seconds"]
+    results["embedding"] = {
+        **{k: int(v) for k, v in totals.items()
+           if k not in ("seconds", "stall_seconds")},
+        "seconds": seconds,
+        "images_per_sec": totals["images"] / seconds if seconds > 0 else 0.0,
+        "loader": {"loader": loader, "stall_seconds": totals["stall_seconds"]}
+    }
+    results.update({
+        "num_samples": evaluator.num_pos + evaluator.num_neg,
+        "num_attack": evaluator.num_pos,
+        "num_normal": evaluator.num_neg,
+        "roc_state_path": state_path
+    })
+
+    if not plots:
+        pass
+    elif plot_pool is not None:
+        plot_pool.submit_run(output_dir, score_mode, histograms=True)
+        results.update(plot_paths(output_dir))
+    else:
+        with timer("plots"):
+            results.update(replot(
+                output_dir, evaluator, mode=score_mode, histograms=True
+            ))
+
+    results["profile"] = PROFILER.report()
+    results["profile_path"] = save_report(
+        os.path.join(output_dir, PROFILE_FILE), results["profile"]
+    )
+    return results
+
+
+def run_detection(manifest=None,
+                  from_index=False,
+                  metadata=ATTACK_META,
+                  corpus_dir=CORPUS_DIR,
+                  batch_size=DEFAULT_BATCH_SIZE,
+                  num_workers=DEFAULT_NUM_WORKERS,
+                  cache=None,
+                  shards=None,
+                  name=None,
+                  random_weights=False,
+                  output_dir=OUTPUT_DIR,
+                  pairs_dir=None,
+                  ledger=None,
+                  loader=DEFAULT_LOADER,
+                  prefetch_depth=PREFETCH_DEPTH,
+                  score_mode=SCORE_MODE,
+                  n_boot=N_BOOTSTRAP,
+                  plots=True,
+                  plot_pool=None,
+                  verbose=True):
+    """Score every registration and return a metrics dict.
+
+    ``manifest`` (an attack_manifest.json dict) replaces the folder walk;
+    ``from_index`` looks embeddings up in the embed_corpus.py output instead
+    of running the model; ``shards`` (a ``ShardReader``) reads the source
+    images from packed shards instead of individual files. Without any of
+    these the NormalPairs/AttackPairs folders under ``pairs_dir`` (default:
+    the configured attack_dataset) are walked. With a ``ScoreLedger`` only
+    new or changed identities are embedded and scored. ``loader`` picks
+    DataLoader processes or the threaded ``PrefetchReader``. The ``name``d
+    backbone is loaded on first use and kept in the module for later calls
+    in the same process.
+
+    Every scorer in ``SCORERS`` is computed in the same pass; ``score_mode``
+    picks the one behind the reported metrics and plots, the others are
+    summarized under ``"ablation"`` and saved as ``score_<name>`` in
+    ``scores.npz``. ``n_boot`` bootstrap resamples give the 95% intervals;
+    0 skips them (the ``*_ci95`` keys are then ``None``).
+
+    The figures are drawn from what the run saved: inline by default, in
+    the background when a ``render_reports.ReportPool`` is passed as
+    ``plot_pool`` (the returned paths are filled once it is waited on),
+    or not at all with ``plots=False``.
+
+    Per-stage timings and counters are written to ``profile.json`` in
+    ``output_dir`` and returned under ``"profile"``.
+    """
+    PROFILER.reset()
+    log = print if verbose else (lambda *a, **k: None)
+    os.makedirs(output_dir, exist_ok=True)
+
+    name = name or backbone
+    results = {
+        "score_mode": score_mode,
+        "backbone": name,
+        "pretrained": not random_weights
+    }
+
+    if from_index:
+        start = time.perf_counter()
+        y_true, table, corpus = score_from_index(
+            metadata, corpus_dir, manifest
+        )
+        log(
+            f"[INFO] Scored from corpus index in "
+            f"{(time.perf_counter() - start) * 1000:.1f} ms "
+            f"({corpus.embeddings.shape[0]} rows)"
+        )
+        if corpus.fingerprint != model_fingerprint(name, not random_weights):
+            log("[WARN] Corpus was embedded with a different model/transform")
+    else:
+        with timer("collect"):
+            samples = build_samples(manifest, metadata, shards, pairs_dir)
+
+        if not samples:
+            raise RuntimeError("No identities with >= 2 images to score")
+
+        y_true, table, stats = score_samples(
+            samples, batch_size, num_workers, cache, shards,
+            name=name, random_weights=random_weights, ledger=ledger,
+            loader=loader, prefetch_depth=prefetch_depth
+        )
+        stats["ms_per_identity"] = (
+            1000 * stats["seconds"] / len(samples) if samples else 0.0
+        )
+        results["embedding"] = stats
+
+        log(
+            f"[INFO] Embedded {stats['images']} images in "
+            f"{stats['seconds']:.1f}s ({stats['images_per_sec']:.1f} img/s, "
+            f"{stats['ms_per_identity']:.1f} ms/identity, "
+            f"backbone={name}, batch={batch_size}, workers={num_workers})"
+        )
+        io = stats["loader"]
+        if "stall_seconds" in io:
+            depth = ""
+            if "queue_depth_mean" in io:
+                depth = (
+                    f", queue depth mean {io['queue_depth_mean']:.1f} / "
+                    f"max {io['queue_depth_max']} of {io['queue_capacity']}"
+                )
+            log(
+                f"[INFO] Loader {io['loader']}: model waited "
+                f"{io['stall_seconds']:.2f}s for images{depth}"
+            )
+        if cache is not None:
+            log(
+                f"[INFO] Embedding cache: {stats['cache_hits']} hits, "
+                f"{stats['computed']} computed, {len(cache)} stored"
+            )
+        if ledger is not None:
+            log(
+                f"[INFO] Score ledger: {stats['ledger_hits']} unchanged, "
+                f"{stats['rescored']} rescored, {len(ledger)} stored"
+            )
+
+    # ---------------- SANITY CHECK ----------------
+    y_true = np.array(y_true)
+    table = {name: np.array(v) for name, v in table.items()}
+    y_score = table[score_mode]
+
+    log(f"[INFO] Total samples : {len(y_true)}")
+    log(f"[INFO] Attack samples: {(y_true == 1).sum()}")
+    log(f"[INFO] Normal samples: {(y_true == 0).sum()}")
+
+    # ---------------- METRICS ----------------
+    with timer("roc"):
+        evaluator = StreamingROC(
+            score_range=SCORERS[score_mode]["range"]
+        ).update(y_true, y_score)
+        state_path = os.path.join(output_dir, ROC_STATE_FILE)
+        evaluator.save(state_path)
+        np.savez(
+            os.path.join(output_dir, SCORES_FILE),
+            y_true=y_true, y_score=y_score, score_mode=score_mode,
+            **{f"score_{name}": v for name, v in table.items()}
+        )
+        results.update(summarize(evaluator, n_boot=n_boot))
+        results["ablation"] = ablation_metrics(y_true, table)
+
+    results.update({
+        "num_samples": int(len(y_true)),
+        "num_attack": int((y_true == 1).sum()),
+        "num_normal": int((y_true == 0).sum()),
+        "roc_state_path": state_path
+    })
+    if not plots:
+        pass
+    elif plot_pool is not None:
+        plot_pool.submit_run(output_dir, score_mode)
+        results.update(plot_paths(output_dir))
+    else:
+        with timer("plots"):
+            results.update(
+                replot(output_dir, evaluator, y_true, y_score, score_mode)
+            )
+
+    results["profile"] = PROFILER.report()
+    results["profile_path"] = save_report(
+        os.path.join(output_dir, PROFILE_FILE), results["profile"]
+    )
+    return results
+
+
+def replot(output_dir, evaluator=None, y_true=None, y_score=None,
+           mode=None, histograms=False):
+    """Redraw both figures, by default from the roc_state.npz and
+    scores.npz a previous run left in ``output_dir`` (``histograms``:
+    ignore scores.npz, as for a streaming run)."""
+    if evaluator is None:
+        evaluator = StreamingROC.load(os.path.join(output_dir, ROC_STATE_FILE))
+    scores_path = os.path.join(output_dir, SCORES_FILE)
+    if histograms or (y_true is None and not os.path.exists(scores_path)):
+        # Streaming run: only the histograms were kept.
+        fpr, tpr, _ = evaluator.roc_curve()
+        return {
+            "roc_path": plot_roc(fpr, tpr, evaluator.auc(), output_dir, mode),
+            "score_plot_path": plot_score_histogram(
+                evaluator, output_dir, mode
+            )
+        }
+    if y_true is None:
+        saved = np.load(scores_path)
+        y_true, y_score = saved["y_true"], saved["y_score"]
+        if "score_mode" in saved:
+            mode = str(saved["score_mode"])
+
+    fpr, tpr, _ = evaluator.roc_curve()
+    return {
+        "roc_path": plot_roc(fpr, tpr, evaluator.auc(), output_dir, mode),
+        "score_plot_path": plot_score_distribution(
+            y_true, y_score, output_dir, mode
+        )
+    }
+
+
+# ---------------- STARTUP PROFILE ----------------
+IMPORTTIME_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def profile_startup(argv, top=15):
+    """Re-run this script with ``-X importtime`` and report the import
+    cost per top-level package, including the lazy imports the run
+    actually triggers."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__)] + argv,
+        stderr=subprocess.PIPE, text=True
+    )
+    wall = time.perf_counter() - start
+
+    per_package = defaultdict(float)
+    other = []
+    for line in proc.stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if m is None:
+            if not line.startswith("import time:"):
+                other.append(line)
+        elif not m.group(2):
+            # Only outermost imports: their cumulative time includes
+            # everything they pulled in.
+            per_package[m.group(3).split(".")[0]] += int(m.group(1)) / 1e6
+    if other:
+        print("\n".join(other), file=sys.stderr)
+
+    total = sum(per_package.values())
+    print("\n===== STARTUP PROFILE =====")
+    print(f"Wall time         : {wall:.2f}s")
+    print(f"Imports (total)   : {total:.2f}s")
+    for pkg, seconds in sorted(per_package.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {pkg:24s}: {seconds:6.3f}s")
+    return proc.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Embedding-based multi-face registration detection"
+    )
+    parser.add_argument(
+        "--backbone",
+        choices=sorted(BACKBONES),
+        default=DEFAULT_BACKBONE,
+        help="Embedding network (*_int8 = statically quantized)"
+    )
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="Seeded random init instead of pretrained weights (offline "
+             "benchmarks; scores are meaningless)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Images per forward pass"
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=DEFAULT_NUM_WORKERS,
+        help="DataLoader workers for JPEG decode + resize (0 = main thread)"
+    )
+    parser.add_argument(
+        "--loader",
+        choices=LOADERS,
+        default=DEFAULT_LOADER,
+        help="dataloader: worker processes; threads: prefetching decode "
+             "threads (good for slow/network storage)"
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=PREFETCH_DEPTH,
+        help="Batches decoded ahead of the model (per worker process for "
+             "the dataloader)"
+    )
+    parser.add_argument(
+        "--score-mode",
+        choices=sorted(SCORERS),
+        default=SCORE_MODE,
+        help="Scorer behind the reported metrics and plots (all scorers "
+             "are computed and saved for ablation)"
+    )
+    parser.add_argument(
+        "--n-boot",
+        type=int,
+        default=N_BOOTSTRAP,
+        help="Bootstrap resamples for the 95%% confidence intervals "
+             "(0: skip them, e.g. for sweeps)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        help="Persistent embedding cache directory"
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=CACHE_MAX_GB,
+        help="Embedding cache size cap (least recently used rows evicted)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always recompute embeddings"
+    )
+    parser.add_argument(
+        "--ledger-dir",
+        default=LEDGER_DIR,
+        help="Per-identity score ledger directory"
+    )
+    parser.add_argument(
+        "--no-ledger",
+        action="store_true",
+        help="Rescore every identity"
+    )
+    parser.add_argument(
+        "--from-index",
+        action="store_true",
+        help="Score from precomputed corpus embeddings (see embed_corpus.py)"
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        default=CORPUS_DIR,
+        help="Output directory of embed_corpus.py"
+    )
+    parser.add_argument(
+        "--metadata",
+        default=ATTACK_META,
+        help="attack_metadata.json written by generate_multiface_attack.py"
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="attack_manifest.json to score instead of the "
+             "NormalPairs/AttackPairs folders"
+    )
+    parser.add_argument(
+        "--shards",
+        nargs="?",
+        const=SHARD_DIR,
+        default=None,
+        help="Read source images from image_shards.py output "
+             "(uses --manifest or --metadata)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=OUTPUT_DIR,
+        help="Where to write the ROC / score distribution PDFs"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=f"Memory-bounded run: identities are embedded in chunks and "
+             f"appended to {RESULTS_FILE} in --output-dir as they complete"
+    )
+    parser.add_argument(
+        "--stream-chunk",
+        type=int,
+        default=STREAM_CHUNK,
+        help="Identities per chunk with --stream"
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help=f"With --stream, start over instead of skipping identities "
+             f"already in {RESULTS_FILE}"
+    )
+    parser.add_argument(
+        "--no-plots",
+        action="store_true",
+        help="Skip the figures (render later with --plots-only or "
+             "render_reports.py)"
+    )
+    parser.add_argument(
+        "--plots-only",
+        action="store_true",
+        help="Redraw the figures from the state saved in --output-dir"
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help=f"Run under cProfile and write {CPROFILE_FILE} to --output-dir "
+             "(open with pstats/snakeviz)"
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Run the command under -X importtime and report import cost "
+             "per package"
+    )
+    args = parser.parse_args()
+
+    if args.n_boot < 0:
+        parser.error("--n-boot must be >= 0")
+    if args.stream and args.from_index:
+        parser.error("--stream scores images; it cannot use --from-index")
+    if args.no_plots and args.plots_only:
+        parser.error("--no-plots and --plots-only are mutually exclusive")
+    if args.random_weights and not random_init_supported(args.backbone):
+        parser.error(f"--random-weights is not supported for {args.backbone}")
+
+    if args.profile_startup:
+        argv = [a for a in sys.argv[1:] if a != "--profile-startup"]
+        sys.exit(profile_startup(argv))
+
+    if args.plots_only:
+        paths = replot(args.output_dir)
+        print(f"ROC curve saved  : {paths['roc_path']}")
+        print(f"Score distribution plot saved to: {paths['score_plot_path']}")
+        return
+
+    manifest = None
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+
+    cache = None
+    if not args.no_cache and not args.from_index:
+        cache = open_cache(
+            args.cache_dir, args.cache_max_gb, name=args.backbone,
+            random_weights=args.random_weights
+        )
+
+    shards = ShardReader(args.shards) if args.shards else None
+    ledger = None
+    if not args.no_ledger and not args.from_index:
+        ledger = open_ledger(
+            args.ledger_dir, name=args.backbone,
+            random_weights=args.random_weights, reader=shards
+        )
+
+    profiler = None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    common = dict(
+        manifest=manifest,
+        metadata=args.metadata,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        cache=cache,
+        shards=shards,
+        name=args.backbone,
+        random_weights=args.random_weights,
+        output_dir=args.output_dir,
+        ledger=ledger,
+        loader=args.loader,
+        prefetch_depth=args.prefetch_depth,
+        score_mode=args.score_mode,
+        n_boot=args.n_boot,
+        plots=not args.no_plots,
+        # Figures render while the results are reported.
+        plot_pool=None if args.no_plots else ReportPool(1)
+    )
+    if args.stream:
+        results = stream_detection(
+            chunk_identities=args.stream_chunk,
+            resume=not args.no_resume,
+            **common
+        )
+    else:
+        results = run_detection(
+            from_index=args.from_index, corpus_dir=args.corpus_dir, **common
+        )
+
+    if profiler is not None:
+        import pstats
+        profiler.disable()
+        prof_path = os.path.join(args.output_dir, CPROFILE_FILE)
+        profiler.dump_stats(prof_path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        print(f"cProfile stats saved: {prof_path}")
+
+    print("\n========== RESULTS ==========")
+    print(f"SCORE_MODE        : {results['score_mode']}")
+    print(f"BACKBONE          : {results['backbone']}")
+    print(f"ROC-AUC          : {results['roc_auc']:.4f}")
+    print(f"TPR @ FPR = 1%   : {results['tpr_1pct']:.4f}")
+    print(f"TPR @ FPR = 0.1% : {results['tpr_0.1pct']:.4f}")
+    if results["roc_auc_ci95"] is not None:
+        lo, hi = results["roc_auc_ci95"]
+        print(f"ROC-AUC 95% CI   : [{lo:.4f}, {hi:.4f}]")
+    print("\n---------- ABLATION ----------")
+    print(f"{'scorer':16s} {'ROC-AUC':>8s} {'TPR@1%':>8s}")
+    for mode, m in results["ablation"].items():
+        print(f"{mode:16s} {m['roc_auc']:8.4f} {m['tpr_1pct']:8.4f}")
+    print("\n---------- PROFILE ----------")
+    print(format_report(results["profile"]))
+    print(f"Profile saved    : {results['profile_path']}")
+    if common["plot_pool"] is not None:
+        common["plot_pool"].wait()
+        print(f"ROC curve saved  : {results['roc_path']}")
+        print(
+            f"Score distribution plot saved to: {results['score_plot_path']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+import os
+import time
+import queue
+import threading
+from importlib import metadata
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from embedding_cache import content_hash, bytes_hash, fingerprint
+from profiling import PROFILER, timer
+
+# torch / torchvision / PIL are imported inside the functions that need
+# them: scoring from cached or precomputed embeddings never pays for them.
+
+# ================= CONFIG =================
+IMG_SIZE = 224
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_NUM_WORKERS = min(8, os.cpu_count() or 1)
+
+# "dataloader": torch DataLoader worker processes; "threads": PrefetchReader
+# (decode threads feeding a bounded queue, no process start-up or pickling).
+LOADERS = ("dataloader", "threads")
+DEFAULT_LOADER = "dataloader"
+PREFETCH_DEPTH = 4              # ready batches buffered ahead of the model
+# =========================================
+
+
+# ---------------- BACKBONES ----------------
+# name -> torchvision builder, pinned pretrained weights and the classifier
+# head that is replaced by Identity to expose the pooled embedding. Both are
+# given by name and resolved when the model is built. The *_int8 entries
+# are torchvision's statically quantized (fbgemm/qnnpack) models.
+BACKBONES = {
+    "resnet50": {
+        "builder": "resnet50",
+        "weights": "ResNet50_Weights.IMAGENET1K_V2",
+        "head": "fc"
+    },
+    "resnet18": {
+        "builder": "resnet18",
+        "weights": "ResNet18_Weights.IMAGENET1K_V1",
+        "head": "fc"
+    },
+    "mobilenet_v3_large": {
+        "builder": "mobilenet_v3_large",
+        "weights": "MobileNet_V3_Large_Weights.IMAGENET1K_V2",
+        "head": "classifier"
+    },
+    "resnet50_int8": {
+        "builder": "resnet50",
+        "weights": "ResNet50_QuantizedWeights.IMAGENET1K_FBGEMM_V2",
+        "head": "fc",
+        "quantized": True
+    },
+    "resnet18_int8": {
+        "builder": "resnet18",
+        "weights": "ResNet18_QuantizedWeights.IMAGENET1K_FBGEMM_V1",
+        "head": "fc",
+        "quantized": True
+    },
+    "mobilenet_v3_large_int8": {
+        "builder": "mobilenet_v3_large",
+        "weights": "MobileNet_V3_Large_QuantizedWeights.IMAGENET1K_QNNPACK_V1",
+        "head": "classifier",
+        "quantized": True
+    }
+}
+
+DEFAULT_BACKBONE = "resnet50"
+
+
+# ---------------- MODEL ----------------
+def build_model(device="cpu", backbone=DEFAULT_BACKBONE, channels_last=True,
+                pretrained=True):
+    # pretrained=False gives seeded random weights: no download needed, so
+    # benchmarks and smoke tests run offline.
+    import torch
+    from torchvision import models
+    from torchvision.models import quantization as qmodels
+
+    spec = BACKBONES[backbone]
+    if not pretrained and not random_init_supported(backbone):
+        raise ValueError(
+            f"{backbone} has no random-init variant; use its pretrained "
+            f"weights or a float backbone"
+        )
+    zoo = qmodels if spec.get("quantized") else models
+    builder = getattr(zoo, spec["builder"])
+
+    weights = None
+    if pretrained:
+        enum, member = spec["weights"].split(".")
+        weights = getattr(getattr(zoo, enum), member)
+    else:
+        torch.manual_seed(0)
+
+    if spec.get("quantized"):
+        # The engine must match the one the int8 weights were calibrated
+        # for (e.g. QNNPACK for mobilenet_v3_large).
+        engines = torch.backends.quantized.supported_engines
+        engine = weights.meta["backend"]
+        if engine not in engines:
+            raise RuntimeError(
+                f"{backbone} needs the {engine} quantized engine; "
+                f"this torch build supports {engines}"
+            )
+        torch.backends.quantized.engine = engine
+        model = builder(weights=weights, quantize=True)
+    else:
+        model = builder(weights=weights)
+
+    setattr(model, spec["head"], torch.nn.Identity())
+    model.eval().to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    model.channels_last = channels_last
+    return model
+
+
+def random_init_supported(backbone):
+    # Random-init int8 models get their observers calibrated on a single
+    # dummy input: activations collapse (mobilenet_v3_large_int8 embeds
+    # everything as zeros), so only the float backbones have a random-init
+    # variant.
+    return not BACKBONES[backbone].get("quantized")
+
+
+def model_fingerprint(backbone=DEFAULT_BACKBONE, pretrained=True):
+    # Anything that changes the embedding must change the fingerprint so
+    # cached vectors from another model/transform are never reused.
+    # The torchvision version stands in for the transform's repr (resize
+    # defaults such as antialias changed between releases) without
+    # importing it.
+    weights = BACKBONES[backbone]["weights"] if pretrained else "random-init"
+    return fingerprint(
+        backbone, weights, TRANSFORM_SPEC,
+        f"torchvision {_dist_version('torchvision')}"
+    )
+
+
+def _dist_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "missing"
+
+
+# ---------------- TRANSFORM ----------------
+TRANSFORM_SPEC = (
+    f"Resize({IMG_SIZE}, {IMG_SIZE}) ToTensor "
+    f"Normalize({IMAGENET_MEAN}, {IMAGENET_STD})"
+)
+
+
+def build_transform():
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.Resize((IMG_SIZE, IMG_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+
+
+def list_images(identity_dir):
+    return [
+        os.path.join(identity_dir, f)
+        for f in os.listdir(identity_dir)
+        if f.lower().endswith(IMAGE_EXTS)
+    ]
+
+
+# ---------------- DATASET ----------------
+class ImageFileDataset:
+    """Decodes and transforms images inside DataLoader workers.
+
+    Unreadable files yield ``ok=False`` instead of raising, so a single
+    corrupt JPEG is skipped exactly like the per-image path skips it.
+    With a ``reader`` (e.g. ``image_shards.ShardReader``) the paths are
+    reader keys instead of file names. A plain map-style dataset, so
+    defining it does not import torch.
+    """
+
+    def __init__(self, paths, transform, reader=None):
+        self.paths = list(paths)
+        self.transform = transform
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.paths)
+
+    def open(self, path):
+        if self.reader is not None:
+            return self.reader.open(path)
+        from PIL import Image
+        return Image.open(path)
+
+    def __getitem__(self, idx):
+        # Decode/transform seconds travel with the item so the main process
+        # can account for them even when they ran in a worker process.
+        start = time.perf_counter()
+        try:
+            img = self.open(self.paths[idx]).convert("RGB")
+            decoded = time.perf_counter()
+            x = self.transform(img)
+            done = time.perf_counter()
+            return idx, x, True, decoded - start, done - decoded
+        except Exception:
+            import torch
+            return (
+                idx, torch.zeros(3, IMG_SIZE, IMG_SIZE), False,
+                time.perf_counter() - start, 0.0
+            )
+
+
+# ---------------- PREFETCH READER ----------------
+class PrefetchReader:
+    """Iterates dataset batches like a DataLoader, but decodes and
+    transforms on a thread pool in a producer thread.
+
+    At most ``depth`` collated batches wait in a bounded queue, so reading
+    (slow or network-mounted storage) overlaps inference while memory
+    stays bounded. ``metrics()`` reports how long the consumer stalled
+    waiting for data and how full the queue was when it asked.
+    """
+
+    _DONE = object()
+
+    def __init__(self, dataset, batch_size, num_threads=DEFAULT_NUM_WORKERS,
+                 depth=PREFETCH_DEPTH):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.num_threads = max(1, num_threads)
+        self.depth = max(1, depth)
+
+        self.batches = 0
+        self.stall_seconds = 0.0
+        self.depth_sum = 0
+        self.depth_max = 0
+
+    def _produce(self, q, stop):
+        import torch
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        try:
+            with ThreadPoolExecutor(
+                self.num_threads, thread_name_prefix="prefetch-decode"
+            ) as pool:
+                n = len(self.dataset)
+                for start in range(0, n, self.batch_size):
+                    if stop.is_set():
+                        return
+                    items = list(pool.map(
+                        self.dataset.__getitem__,
+                        range(start, min(start + self.batch_size, n))
+                    ))
+                    idx, x, ok, decode_s, transform_s = zip(*items)
+                    put((
+                        torch.tensor(idx), torch.stack(x), torch.tensor(ok),
+                        torch.tensor(decode_s), torch.tensor(transform_s)
+                    ))
+        except BaseException as e:
+            put(e)
+        put(self._DONE)
+
+    def __iter__(self):
+        q = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(q, stop), daemon=True,
+            name="prefetch-producer"
+        )
+        producer.start()
+        try:
+            while True:
+                depth = q.qsize()
+                start = time.perf_counter()
+                item = q.get()
+                self.stall_seconds += time.perf_counter() - start
+
+                if item is self._DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+
+                self.batches += 1
+                self.depth_sum += depth
+                self.depth_max = max(self.depth_max, depth)
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def metrics(self):
+        return {
+            "loader": "threads",
+            "batches": self.batches,
+            "stall_seconds": self.stall_seconds,
+            "queue_depth_mean": (
+                self.depth_sum / self.batches if self.batches else 0.0
+            ),
+            "queue_depth_max": self.depth_max,
+            "queue_capacity": self.depth
+        }
+
+
+# ---------------- EMBEDDING ----------------
+def l2_normalize(emb):
+    # All-zero features (e.g. a dead int8 model) stay zero instead of NaN.
+    norm = np.linalg.norm(emb, axis=-1, keepdims=True)
+    return emb / np.maximum(norm, 1e-12)
+
+
+def _prepare(model, x, device):
+    import torch
+    x = x.to(device)
+    if getattr(model, "channels_last", False):
+        x = x.contiguous(memory_format=torch.channels_last)
+    return x
+
+
+def embed_image(model, transform, img_path, device="cpu"):
+    import torch
+    from PIL import Image
+    img = Image.open(img_path).convert("RGB")
+    with torch.inference_mode():
+        x = _prepare(model, transform(img).unsqueeze(0), device)
+        emb = model(x).squeeze().cpu().numpy()
+    return l2_normalize(emb)
+
+
+def embed_tensors(model, x, device="cpu"):
+    # One forward pass over an already transformed (N, 3, H, W) batch.
+    import torch
+    with torch.inference_mode():
+        emb = model(_prepare(model, x, device)).cpu().numpy()
+    return l2_normalize(emb.reshape(len(emb), -1))
+
+
+def embed_images(model, transform, paths,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 num_workers=DEFAULT_NUM_WORKERS,
+                 device="cpu",
+                 cache=None,
+                 reader=None,
+                 model_fn=None,
+                 loader=DEFAULT_LOADER,
+                 prefetch_depth=PREFETCH_DEPTH,
+                 flush=True,
+                 hashes=None):
+    """Embed ``paths`` in fixed-size batches.
+
+    Returns ``(embeddings, ok, stats)``: an ``(N, D)`` float32 matrix of
+    L2-normalised embeddings in input order (rows of unreadable images are
+    zero), a boolean mask of successfully decoded images, and a dict with
+    the image count, wall time and images/sec. With an ``EmbeddingCache``
+    only cache misses go through the model (new rows are persisted unless
+    ``flush=False``); ``hashes`` are the cache keys when the caller already
+    has them (``image_hashes``). ``reader`` switches ``paths`` to reader
+    keys (see ``ImageFileDataset``).
+
+    ``model`` may be None when ``model_fn`` is given: it is called (and
+    torch imported) only if some image is not cached. ``transform=None``
+    means ``build_transform()``, built on the same condition.
+
+    ``loader`` picks how images are decoded (see ``LOADERS``);
+    ``num_workers`` is the process or thread count. Its stall/queue
+    metrics are returned under ``stats["loader"]``.
+    """
+    paths = list(paths)
+    n = len(paths)
+    ok = np.zeros(n, dtype=bool)
+    stats = {
+        "images": n, "seconds": 0.0, "images_per_sec": 0.0,
+        "cache_hits": 0, "computed": 0, "loader": {"loader": loader}
+    }
+
+    if n == 0:
+        return np.zeros((0, 0), dtype=np.float32), ok, stats
+
+    start = time.perf_counter()
+    embeddings = None
+    todo = np.arange(n)
+
+    if cache is not None:
+        keys = hashes
+        if keys is None:
+            keys = image_hashes(paths, reader, num_workers)
+        known = [i for i, k in enumerate(keys) if k is not None]
+        with timer("cache_get"):
+            cached, hit = cache.get_many([keys[i] for i in known])
+        if hit.any():
+            embeddings = np.zeros((n, cached.shape[1]), dtype=np.float32)
+            rows = np.asarray(known)[hit]
+            embeddings[rows] = cached[hit]
+            ok[rows] = True
+        todo = np.flatnonzero(~ok)
+        stats["cache_hits"] = int(ok.sum())
+
+    if len(todo) and model is None:
+        with timer("model_load"):
+            model = model_fn()
+    if len(todo) and transform is None:
+        transform = build_transform()
+
+    computed, computed_ok, stats["loader"] = _embed_batches(
+        model, transform, [paths[i] for i in todo],
+        batch_size, num_workers, device, reader, loader, prefetch_depth
+    )
+    if computed_ok.any():
+        if embeddings is None:
+            embeddings = np.zeros((n, computed.shape[1]), dtype=np.float32)
+        embeddings[todo[computed_ok]] = computed[computed_ok]
+        ok[todo[computed_ok]] = True
+        if cache is not None:
+            with timer("cache_put"):
+                cache.put_many(
+                    [keys[i] for i in todo[computed_ok]],
+                    computed[computed_ok]
+                )
+                if flush:
+                    cache.flush()
+
+    elapsed = time.perf_counter() - start
+    if embeddings is None:
+        embeddings = np.zeros((n, 0), dtype=np.float32)
+
+    stats["computed"] = int(computed_ok.sum())
+    stats["seconds"] = elapsed
+    stats["images_per_sec"] = ok.sum() / elapsed if elapsed > 0 else 0.0
+    return embeddings, ok, stats
+
+
+def image_hashes(paths, reader=None, num_workers=DEFAULT_NUM_WORKERS):
+    """Content hash of every image (``None`` when unreadable): the
+    ``EmbeddingCache`` key and what ledger ``sample_key``s are made of."""
+    with timer("hash"), ThreadPoolExecutor(max(1, num_workers)) as pool:
+        return list(pool.map(lambda p: _safe_hash(p, reader), paths))
+
+
+def _safe_hash(path, reader=None):
+    try:
+        if reader is not None:
+            return bytes_hash(reader.read_bytes(path))
+        return content_hash(path)
+    except (OSError, KeyError):
+        return None
+
+
+def _embed_batches(model, transform, paths, batch_size, num_workers, device,
+                   reader=None, loader=DEFAULT_LOADER,
+                   prefetch_depth=PREFETCH_DEPTH):
+    n = len(paths)
+    ok = np.zeros(n, dtype=bool)
+    if n == 0:
+        return np.zeros((0, 0), dtype=np.float32), ok, {"loader": loader}
+
+    import torch
+    dataset = ImageFileDataset(paths, transform, reader)
+
+    if loader == "threads":
+        batches = PrefetchReader(
+            dataset, batch_size, num_threads=num_workers, depth=prefetch_depth
+        )
+    else:
+        from torch.utils.data import DataLoader
+        batches = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=num_workers,
+            persistent_workers=False,
+            prefetch_factor=prefetch_depth if num_workers > 0 else None
+        )
+
+    embeddings = None
+    stall = 0.0
+    with torch.inference_mode():
+        it = iter(batches)
+        while True:
+            start = time.perf_counter()
+            batch = next(it, None)
+            waited = time.perf_counter() - start
+            stall += waited
+            if batch is None:
+                break
+
+            idx, x, valid, decode_s, transform_s = batch
+            PROFILER.add("wait_for_images", waited)
+            PROFILER.add("decode", float(decode_s.sum()), len(idx))
+            PROFILER.add("transform", float(transform_s.sum()), len(idx))
+            PROFILER.count("images_decoded", len(idx))
+
+            idx = idx.numpy()
+            valid = valid.numpy().astype(bool)
+            if not valid.any():
+                continue
+
+            with timer("forward"):
+                emb = model(_prepare(model, x[valid], device)).cpu().numpy()
+            emb = emb.reshape(len(emb), -1)
+            PROFILER.count("batches")
+
+            if embeddings is None:
+                embeddings = np.zeros((n, emb.shape[1]), dtype=np.float32)
+
+            embeddings[idx[valid]] = l2_normalize(emb)
+            ok[idx[valid]] = True
+
+    if embeddings is None:
+        embeddings = np.zeros((n, 0), dtype=np.float32)
+
+    if loader == "threads":
+        metrics = batches.metrics()
+    else:
+        metrics = {"loader": loader, "stall_seconds": stall}
+    return embeddings, ok, metrics
@@ -0,0 +1,491 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from embed_corpus import CorpusEmbeddings, CORPUS_DIR
+
+# ================= CONFIG =================
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
+BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
+
+GALLERY_FILE = os.path.join(BASE_DIR, "gallery_index.npz")
+ATTACK_MANIFEST = os.path.join(
+    BASE_DIR, "attack_dataset", "attack_manifest.json"
+)
+
+# "ivf": inverted lists over a spherical k-means coarse quantizer (NumPy);
+# "faiss": the same layout in FAISS if installed; "exact": brute force.
+BACKENDS = ("ivf", "faiss", "exact")
+DEFAULT_BACKEND = "ivf"
+NPROBE = 8                    # inverted lists scanned per query
+KMEANS_ITERS = 10
+EXACT_BELOW = 2048            # smaller galleries are always searched exactly
+TOP_K = 5
+QUERY_CHUNK = 1024            # queries per matmul in exact search
+# ==========================================
+
+
+# ---------------- GALLERY ----------------
+def identity_centroids(corpus):
+    """One L2-normalised centroid per identity of an embed_corpus.py
+    corpus (identities without readable images are left out)."""
+    names, starts = [], []
+    for identity, (start, end) in sorted(
+        corpus.ranges.items(), key=lambda kv: kv[1][0]
+    ):
+        if end > start:
+            names.append(identity)
+            starts.append(start)
+
+    emb = np.asarray(corpus.embeddings, dtype=np.float32)
+    sums = np.add.reduceat(emb, starts, axis=0)
+    return names, sums / np.linalg.norm(sums, axis=1, keepdims=True)
+
+
+def default_nlist(n):
+    return max(1, int(4 * np.sqrt(n)))
+
+
+def spherical_kmeans(x, k, iters=KMEANS_ITERS, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = (x @ centers.T).argmax(axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assign, x)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Re-seed empty lists from random points instead of dropping them.
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        norms[empty] = 1.0
+        centers = sums / norms
+    return centers
+
+
+def _top_k(sims, k):
+    # Row-wise top-k (descending) of a (m, n) similarity matrix.
+    k = min(k, sims.shape[1])
+    part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    part_sims = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-part_sims, axis=1)
+    return (
+        np.take_along_axis(part, order, axis=1),
+        np.take_along_axis(part_sims, order, axis=1)
+    )
+
+
+class GalleryIndex:
+    """Top-k gallery identities for query embeddings.
+
+    ``vectors`` are L2-normalised identity centroids, so the inner product
+    is the cosine similarity. The "ivf" backend stores the vectors grouped
+    by their nearest coarse centroid and scans only the ``nprobe`` closest
+    lists per query; galleries below ``EXACT_BELOW`` identities, or
+    ``search(exact=True)``, fall back to brute force.
+    """
+
+    def __init__(self, names, vectors, backend=DEFAULT_BACKEND, nlist=None,
+                 nprobe=NPROBE, seed=0, fingerprint=None):
+        self.names = list(names)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.backend = backend
+        self.nprobe = nprobe
+        self.fingerprint = fingerprint
+        self.centers = self.order = self.offsets = self.lists = None
+        self.faiss_index = None
+        self._positions = None
+
+        n = len(self.vectors)
+        if backend == "exact" or n < EXACT_BELOW:
+            self.backend = "exact"
+        elif backend == "faiss":
+            self._build_faiss(nlist or default_nlist(n))
+        else:
+            self._build_ivf(nlist or default_nlist(n), seed)
+
+    # ---------------- BUILD ----------------
+    def _build_ivf(self, nlist, seed):
+        self.centers = spherical_kmeans(self.vectors, nlist, seed=seed)
+        self._set_lists((self.vectors @ self.centers.T).argmax(axis=1))
+
+    def _set_lists(self, assign):
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(assign, minlength=len(self.centers))))
+        )
+        self.lists = self.vectors[self.order]
+
+    def _build_faiss(self, nlist):
+        try:
+            import faiss
+        except ImportError:
+            raise RuntimeError(
+                "The faiss backend needs faiss-cpu (pip install faiss-cpu); "
+                "use --backend ivf instead"
+            )
+        quantizer = faiss.IndexFlatIP(self.vectors.shape[1])
+        index = faiss.IndexIVFFlat(
+            quantizer, self.vectors.shape[1], nlist,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(self.vectors)
+        index.add(self.vectors)
+        index.nprobe = self.nprobe
+        self.quantizer = quantizer
+        self.faiss_index = index
+
+    # ---------------- SEARCH ----------------
+    def position(self, name):
+        """Row of identity ``name``; ``KeyError`` if it is not indexed."""
+        if self._positions is None:
+            self._positions = {n: i for i, n in enumerate(self.names)}
+        if name not in self._positions:
+            raise KeyError(f"{name} is not in the gallery index")
+        return self._positions[name]
+
+    def search(self, queries, k=TOP_K, nprobe=None, exact=False):
+        """Return ``(indices, similarities)``, both ``(m, k)`` and best
+        first; map indices to identities with ``self.names``. The ivf and
+        faiss backends pad rows with index -1 when the probed lists hold
+        fewer than ``k`` identities."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if exact or self.backend == "exact":
+            return self._search_exact(queries, k)
+        if self.backend == "faiss":
+            self.faiss_index.nprobe = nprobe or self.nprobe
+            sims, idx = self.faiss_index.search(queries, k)
+            return idx, sims
+        return self._search_ivf(queries, k, nprobe or self.nprobe)
+
+    def _search_exact(self, queries, k):
+        out = [
+            _top_k(queries[i:i + QUERY_CHUNK] @ self.vectors.T, k)
+            for i in range(0, len(queries), QUERY_CHUNK)
+        ]
+        return (
+            np.concatenate([idx for idx, _ in out]),
+            np.concatenate([sims for _, sims in out])
+        )
+
+    def _search_ivf(self, queries, k, nprobe):
+        nprobe = min(nprobe, len(self.centers))
+        probe = _top_k(queries @ self.centers.T, nprobe)[0]
+
+        idx = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, q in enumerate(queries):
+            # Lists are contiguous in self.lists: one small matvec each.
+            spans = [(self.offsets[c], self.offsets[c + 1]) for c in probe[i]]
+            rows = np.concatenate([np.arange(a, b) for a, b in spans])
+            if len(rows) == 0:
+                continue
+            s = np.concatenate([self.lists[a:b] @ q for a, b in spans])
+            top, top_sims = _top_k(s[None], k)
+            idx[i, :top.shape[1]] = self.order[rows[top[0]]]
+            sims[i, :top.shape[1]] = top_sims[0]
+        return idx, sims
+
+    # ---------------- PERSISTENCE ----------------
+    def save(self, path):
+        if self.backend == "faiss":
+            raise RuntimeError("Save the ivf or exact backend instead")
+        arrays = {
+            "names": np.array(self.names),
+            "vectors": self.vectors,
+            "backend": self.backend,
+            "nprobe": self.nprobe,
+            "fingerprint": json.dumps(self.fingerprint)
+        }
+        if self.backend == "ivf":
+            arrays.update(
+                centers=self.centers, order=self.order, offsets=self.offsets
+            )
+        np.savez(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path, backend=None, nlist=None, nprobe=None):
+        """Load a saved index. A ``backend`` other than the saved one is
+        rebuilt from the saved vectors (the faiss backend is never saved);
+        ``nprobe`` overrides the saved default."""
+        data = np.load(path)
+        names = data["names"].tolist()
+        fingerprint = json.loads(str(data["fingerprint"]))
+        nprobe = nprobe or int(data["nprobe"])
+        saved = str(data["backend"])
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown backend {backend!r}; choose from {BACKENDS}"
+            )
+        if backend is not None and backend != saved:
+            return cls(
+                names, data["vectors"], backend, nlist, nprobe,
+                fingerprint=fingerprint
+            )
+
+        index = cls.__new__(cls)
+        index.names = names
+        index.vectors = data["vectors"]
+        index.backend = saved
+        index.nprobe = nprobe
+        index.fingerprint = fingerprint
+        index.centers = index.order = index.offsets = index.lists = None
+        index.faiss_index = None
+        index._positions = None
+        if index.backend == "ivf":
+            index.centers = data["centers"]
+            index.order = data["order"]
+            index.offsets = data["offsets"]
+            index.lists = index.vectors[index.order]
+        return index
+
+
+def build_gallery(corpus_dir=CORPUS_DIR, backend=DEFAULT_BACKEND, nlist=None,
+                  nprobe=NPROBE):
+    corpus = CorpusEmbeddings(corpus_dir)
+    names, vectors = identity_centroids(corpus)
+    return GalleryIndex(
+        names, vectors, backend, nlist, nprobe, fingerprint=corpus.fingerprint
+    )
+
+
+# ---------------- DONOR ATTRIBUTION ----------------
+def attribute_donors(index, embeddings, k=TOP_K, nprobe=None, claimed=None):
+    """Explain one flagged registration folder.
+
+    Every image is matched to the gallery. ``claimed`` is the identity the
+    folder is registered under (the manifest and the folder name record
+    it); images whose top-1 is someone else are the outliers. Returns,
+    per outlier image (row of ``embeddings``), its top-``k`` candidate
+    source identities other than the claimed one.
+
+    ``majority`` is the most common top-1 identity, or ``None`` when
+    several tie (``tied``): a target with as many images as each donor
+    cannot be told apart by votes. Without ``claimed`` the majority is
+    used, and a tie is reported with no outliers rather than broken.
+    """
+    idx, sims = index.search(embeddings, k + 1, nprobe=nprobe)
+    top1 = idx[:, 0]
+    # -1 pads probes that found fewer than k + 1 identities.
+    values, counts = np.unique(top1[top1 >= 0], return_counts=True)
+    tied = values[counts == counts.max()] if len(values) else values
+    majority = int(tied[0]) if len(tied) == 1 else None
+
+    result = {
+        "claimed": claimed,
+        "majority": None if majority is None else index.names[majority],
+        "tied": [index.names[i] for i in tied] if len(tied) > 1 else [],
+        "outliers": []
+    }
+    if claimed is not None:
+        claimed_pos = index.position(claimed)
+    elif majority is not None:
+        claimed_pos = majority
+        result["claimed"] = index.names[majority]
+    else:
+        return result
+
+    for row in np.flatnonzero((top1 >= 0) & (top1 != claimed_pos)):
+        keep = (idx[row] >= 0) & (idx[row] != claimed_pos)
+        result["outliers"].append({
+            "image": int(row),
+            "candidates": [
+                (index.names[i], float(s))
+                for i, s in zip(idx[row][keep][:k], sims[row][keep][:k])
+            ]
+        })
+    return result
+
+
+def evaluate_attribution(index, corpus, manifest, k=TOP_K, nprobe=None):
+    """Attribute the donors of every attack folder in an attack manifest
+    (scored from the corpus, claimed identity from the manifest) and
+    report how many true donors appear among the outlier candidates, and
+    how often a top-1 vote alone would have named the target."""
+    folders = {}
+    for r in manifest["records"]:
+        if r["label"] == 1:
+            folders.setdefault((r["client"], r["identity"]), []).append(r)
+
+    found = total = majority_ok = ties = 0
+    start = time.perf_counter()
+    for (_, target), records in folders.items():
+        donors = {
+            r["source_identity"] for r in records if r["role"] == "donor"
+        }
+        emb = corpus.lookup(
+            [(r["source_identity"], r["source_image"]) for r in records]
+        )
+        result = attribute_donors(index, emb, k, nprobe, claimed=target)
+        candidates = {
+            name for o in result["outliers"] for name, _ in o["candidates"]
+        }
+        found += len(donors & candidates)
+        total += len(donors)
+        majority_ok += result["majority"] == target
+        ties += bool(result["tied"])
+    seconds = time.perf_counter() - start
+
+    return {
+        "attack_folders": len(folders),
+        "majority_vote_accuracy": majority_ok / max(len(folders), 1),
+        "majority_vote_ties": ties,
+        f"donor_recall@{k}": found / max(total, 1),
+        "ms_per_folder": 1000 * seconds / max(len(folders), 1)
+    }
+
+
+# ---------------- BENCHMARK ----------------
+def synthetic_gallery(n, dim, clusters=256, noise=0.5, seed=0):
+    # Clustered unit vectors standing in for a large real gallery.
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, n)]
+    x += noise * rng.normal(size=(n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def benchmark(index, queries, k=TOP_K, nprobes=(1, 2, 4, 8, 16, 32)):
+    """Recall@k against exact search and per-query latency (one query at a
+    time, as in the service) for every ``nprobe``."""
+    def latency(fn):
+        times = []
+        for q in queries:
+            t = time.perf_counter()
+            fn(q)
+            times.append((time.perf_counter() - t) * 1000)
+        return np.percentile(times, [50, 99])
+
+    exact_idx, _ = index.search(queries, k, exact=True)
+    p50, p99 = latency(lambda q: index.search(q, k, exact=True))
+    rows = [{"nprobe": "exact", "recall": 1.0, "p50_ms": p50, "p99_ms": p99}]
+
+    if index.backend != "exact":
+        for nprobe in nprobes:
+            idx, _ = index.search(queries, k, nprobe=nprobe)
+            recall = np.mean([
+                len(set(a) & set(b)) / k for a, b in zip(idx, exact_idx)
+            ])
+            p50, p99 = latency(lambda q: index.search(q, k, nprobe=nprobe))
+            rows.append({
+                "nprobe": nprobe, "recall": float(recall),
+                "p50_ms": p50, "p99_ms": p99
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Gallery index over celeba_identities embeddings for "
+                    "donor attribution"
+    )
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    parser.add_argument("--index", default=GALLERY_FILE)
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default=DEFAULT_BACKEND
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="Inverted lists (default: 4 * sqrt(identities))"
+    )
+    parser.add_argument("--nprobe", type=int, default=NPROBE)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument(
+        "--attribute",
+        nargs="?",
+        const=ATTACK_MANIFEST,
+        default=None,
+        metavar="MANIFEST",
+        help="Attribute the donors of every attack folder and report "
+             "donor recall"
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Recall-vs-latency of the index against exact search"
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Benchmark on N synthetic clustered identities instead of "
+             "the corpus"
+    )
+    parser.add_argument("--dim", type=int, default=2048)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    if args.synthetic and args.attribute:
+        parser.error("--attribute needs the real corpus, not --synthetic")
+
+    # ---------------- SYNTHETIC BENCHMARK ----------------
+    if args.synthetic:
+        x = synthetic_gallery(args.synthetic + args.queries, args.dim)
+        start = time.perf_counter()
+        index = GalleryIndex(
+            [str(i) for i in range(args.synthetic)], x[:args.synthetic],
+            args.backend, args.nlist, args.nprobe
+        )
+        print(
+            f"[INFO] Built {index.backend} index over {args.synthetic} "
+            f"identities in {time.perf_counter() - start:.1f}s"
+        )
+        queries = x[args.synthetic:]
+    else:
+        corpus = CorpusEmbeddings(args.corpus_dir)
+        if os.path.exists(args.index):
+            index = GalleryIndex.load(
+                args.index, args.backend, args.nlist, args.nprobe
+            )
+            if index.fingerprint != corpus.fingerprint:
+                print("[WARN] Gallery index is older than the corpus; rebuild")
+        else:
+            start = time.perf_counter()
+            index = build_gallery(
+                args.corpus_dir, args.backend, args.nlist, args.nprobe
+            )
+            print(
+                f"[INFO] Built {index.backend} index over "
+                f"{len(index.names)} identities in "
+                f"{time.perf_counter() - start:.1f}s"
+            )
+            if index.backend != "faiss":
+                index.save(args.index)
+                print(f"[INFO] Gallery index saved to: {args.index}")
+        queries = np.asarray(corpus.embeddings[
+            np.random.default_rng(0).choice(
+                len(corpus.embeddings),
+                min(args.queries, len(corpus.embeddings)),
+                replace=False
+            )
+        ], dtype=np.float32)
+
+    if args.attribute:
+        with open(args.attribute) as f:
+            manifest = json.load(f)
+        report = evaluate_attribution(
+            index, corpus, manifest, args.k, args.nprobe
+        )
+        print("\n===== DONOR ATTRIBUTION =====")
+        for key, value in report.items():
+            print(f"{key:26s}: {value:.4f}" if isinstance(value, float)
+                  else f"{key:26s}: {value}")
+
+    if args.benchmark or args.synthetic:
+        print(f"\n===== RECALL@{args.k} vs LATENCY ({index.backend}) =====")
+        print(f"{'nprobe':>8s} {'recall':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+        for r in benchmark(index, queries, args.k):
+            print(
+                f"{str(r['nprobe']):>8s} {r['recall']:8.3f} "
+                f"{r['p50_ms']:8.3f} {r['p99_ms']:8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,18 @@ import os
 import random
 import shutil
 import json
+import hashlib
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-# ================= ARGUMENTS =================
-parser = argparse.ArgumentParser(
-    description="Generate multi-face registration attacks"
-)
-parser.add_argument(
-    "--seed",
-    type=int,
-    default=42,
-    help="Random seed for reproducibility"
-)
-args = parser.parse_args()
-
-RANDOM_SEED = args.seed
-random.seed(RANDOM_SEED)
-# ============================================
+from image_shards import ShardReader, SHARD_DIR
+from create_federated_clients import load_clients
+from metadata_index import load_index
 
 # ================= CONFIG ====================
-PROJECT_ROOT = r"D:\Face recogination project"
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
 
 BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
 CELEBA_DIR = os.path.join(BASE_DIR, "celeba_identities")
@@ -32,148 +24,403 @@ ATTACK_FRACTION = 0.25              # 25% malicious clients
 IMAGES_PER_ID = 3
 NUM_ATTACK_IDS_PER_CLIENT = 10      # realistic (10–20)
 DONORS_PER_ATTACK = 2
+
+# Scenario knobs as one dict, overridable per call / campaign grid point.
+DEFAULT_PARAMS = {
+    "attack_fraction": ATTACK_FRACTION,
+    "num_attack_ids_per_client": NUM_ATTACK_IDS_PER_CLIENT,
+    "donors_per_attack": DONORS_PER_ATTACK,
+    "images_per_id": IMAGES_PER_ID
+}
+
+WORKERS = 1                         # processes generating clients
 # ============================================
 
-# ---------------- OUTPUT DIRS ----------------
-NORMAL_DIR = os.path.join(OUTPUT_DIR, "NormalPairs")
-ATTACK_DIR = os.path.join(OUTPUT_DIR, "AttackPairs")
-os.makedirs(NORMAL_DIR, exist_ok=True)
-os.makedirs(ATTACK_DIR, exist_ok=True)
 
-# ---------------- LOAD CLIENT FILES ----------------
-clients = sorted([
-    f for f in os.listdir(FEDERATED_DIR)
-    if f.endswith(".txt")
-])
+def make_record(client_name, identity, source_identity, img, role, label):
+    # One record per registered image: which client/identity folder it lands
+    # in, where it comes from in celeba_identities and what role it plays.
+    name = img if role != "donor" else f"attack_{source_identity}_{img}"
+    return {
+        "client": client_name,
+        "identity": identity,
+        "label": label,
+        "role": role,
+        "source_identity": source_identity,
+        "source_image": img,
+        "file": name
+    }
 
-num_clients = len(clients)
-assert num_clients > 0, "No client files found!"
 
-num_attack_clients = max(1, int(num_clients * ATTACK_FRACTION))
-malicious_clients = sorted(
-    random.sample(clients, num_attack_clients)
-)
+# ---------------- PER-CLIENT WORK ----------------
+# Source of identity listings for generate_client(), set once per process
+# (pool initializer or in-process). Folder checks, listings and per-seed
+# image orders are cached per identity and reused by every client, seed
+# and campaign grid point the process generates.
+_source = {}
 
-print(f"Random seed          : {RANDOM_SEED}")
-print(f"Total clients        : {num_clients}")
-print(f"Malicious clients ({num_attack_clients}): {malicious_clients}")
 
-# ---------------- METADATA ----------------
-attack_metadata = {
-    "random_seed": RANDOM_SEED,
-    "attack_fraction": ATTACK_FRACTION,
-    "num_attack_ids_per_client": NUM_ATTACK_IDS_PER_CLIENT,
-    "donors_per_attack": DONORS_PER_ATTACK,
-    "malicious_clients": malicious_clients,
-    "clients": []
-}
+def init_source(celeba_dir, shards=None):
+    if _source.get("key") == (celeba_dir, shards):
+        return
+    _source.clear()
+    _source.update(
+        key=(celeba_dir, shards), celeba_dir=celeba_dir, shards=shards,
+        index=load_index(celeba_dir) if shards is None else None,
+        exists={}, listings={}, orders={}
+    )
+
 
-# ---------------- PROCESS CLIENTS ----------------
-for client in clients:
-    client_path = os.path.join(FEDERATED_DIR, client)
+def has_identity(identity):
+    exists = _source["exists"]
+    if identity not in exists:
+        if _source["shards"] is not None:
+            exists[identity] = _source["shards"].has_identity(identity)
+        elif _source["index"] is not None:
+            exists[identity] = identity in _source["index"].identity_set
+        else:
+            exists[identity] = os.path.isdir(
+                os.path.join(_source["celeba_dir"], identity)
+            )
+    return exists[identity]
 
-    with open(client_path, "r") as f:
-        identities = [line.strip() for line in f if line.strip()]
 
-    valid = [
-        i for i in identities
-        if os.path.isdir(os.path.join(CELEBA_DIR, i))
-    ]
+def list_identity(identity):
+    listings = _source["listings"]
+    if identity not in listings:
+        if _source["shards"] is not None:
+            listings[identity] = _source["shards"].list_images(identity)
+        elif _source["index"] is not None:
+            listings[identity] = _source["index"].images_of(identity)
+        else:
+            listings[identity] = os.listdir(
+                os.path.join(_source["celeba_dir"], identity)
+            )
+    return listings[identity]
+
+
+def derived_seed(seed, key):
+    # Stable across processes and runs (unlike hash() of a str).
+    digest = hashlib.blake2b(
+        f"{seed}:{key}".encode("utf-8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big")
+
+
+def nested_sample(rng, n, k):
+    # k distinct positions in range(n); the draws for a smaller k are a
+    # prefix of those for a larger one, so grid points share selections.
+    picks, seen = [], set()
+    while len(picks) < min(k, n):
+        j = rng.randrange(n)
+        if j not in seen:
+            seen.add(j)
+            picks.append(j)
+    return picks
 
-    print(f"{client}: raw={len(identities)}, valid={len(valid)}")
+
+def image_order(seed, identity):
+    # Per-seed shuffled listing of one identity: every role and grid point
+    # takes its images from the front, whatever client holds the identity.
+    orders = _source["orders"]
+    if (seed, identity) not in orders:
+        # Sorted first: the same draw from folders, shards or the index.
+        imgs = sorted(list_identity(identity))
+        random.Random(derived_seed(seed, identity)).shuffle(imgs)
+        orders[seed, identity] = imgs
+    return orders[seed, identity]
+
+
+def generate_client(unit):
+    """One client's registrations. ``unit`` is ``(client, identities,
+    malicious, seed, params)`` with ``params`` as in ``DEFAULT_PARAMS``;
+    returns ``(log_lines, metadata_entries, records)`` and depends only on
+    ``unit``, so clients can run in any process."""
+    client, identities, malicious, seed, params = unit
+    images_per_id = params["images_per_id"]
+    rng = random.Random(derived_seed(seed, client))
+    lines, entries, records = [], [], []
+
+    valid = [i for i in identities if has_identity(i)]
+    lines.append(f"{client}: raw={len(identities)}, valid={len(valid)}")
 
     if len(valid) < 3:
-        print(f"Skipping {client} (not enough valid identities)")
-        continue
+        lines.append(f"Skipping {client} (not enough valid identities)")
+        return lines, entries, records
 
     client_name = client.replace(".txt", "")
 
     # ===================== ATTACK CLIENT =====================
-    if client in malicious_clients:
-        out_client = os.path.join(ATTACK_DIR, client_name)
-        os.makedirs(out_client, exist_ok=True)
+    if malicious:
+        n = len(valid)
+        targets = nested_sample(rng, n, params["num_attack_ids_per_client"])
 
-        attack_targets = random.sample(
-            valid,
-            min(NUM_ATTACK_IDS_PER_CLIENT, len(valid))
-        )
-
-        for target_id in attack_targets:
-            donors = random.sample(
-                [i for i in valid if i != target_id],
-                k=min(DONORS_PER_ATTACK, len(valid) - 1)
+        for t in targets:
+            target_id = valid[t]
+            # Donors from every other identity: sample n - 1 positions and
+            # skip over the target instead of rebuilding the list.
+            donor_rng = random.Random(derived_seed(seed, f"{client}/{t}"))
+            picks = nested_sample(
+                donor_rng, n - 1, params["donors_per_attack"]
             )
-
-            tgt_dir = os.path.join(out_client, target_id)
-            os.makedirs(tgt_dir, exist_ok=True)
+            donors = [valid[j + (j >= t)] for j in picks]
 
             # ----- target images -----
-            tgt_imgs = os.listdir(
-                os.path.join(CELEBA_DIR, target_id)
-            )
-            for img in random.sample(
-                tgt_imgs, min(IMAGES_PER_ID, len(tgt_imgs))
-            ):
-                shutil.copy(
-                    os.path.join(CELEBA_DIR, target_id, img),
-                    os.path.join(tgt_dir, img)
-                )
+            tgt_sel = image_order(seed, target_id)[:images_per_id]
+            for img in tgt_sel:
+                records.append(make_record(
+                    client_name, target_id, target_id, img, "target", 1
+                ))
 
             # ----- donor injections -----
+            donor_sel = {}
             for donor in donors:
-                donor_imgs = os.listdir(
-                    os.path.join(CELEBA_DIR, donor)
-                )
-                for img in random.sample(
-                    donor_imgs, min(IMAGES_PER_ID, len(donor_imgs))
-                ):
-                    shutil.copy(
-                        os.path.join(CELEBA_DIR, donor, img),
-                        os.path.join(
-                            tgt_dir,
-                            f"attack_{donor}_{img}"
-                        )
-                    )
-
-            attack_metadata["clients"].append({
+                donor_sel[donor] = image_order(seed, donor)[:images_per_id]
+                for img in donor_sel[donor]:
+                    records.append(make_record(
+                        client_name, target_id, donor, img, "donor", 1
+                    ))
+
+            entries.append({
                 "client": client_name,
                 "type": "attack",
                 "target_identity": target_id,
-                "donor_identities": donors
+                "donor_identities": donors,
+                "target_images": tgt_sel,
+                "donor_images": donor_sel
             })
 
     # ===================== NORMAL CLIENT =====================
     else:
-        out_client = os.path.join(NORMAL_DIR, client_name)
-        os.makedirs(out_client, exist_ok=True)
-
+        normal_sel = {}
         for identity in valid:
-            id_dir = os.path.join(out_client, identity)
-            os.makedirs(id_dir, exist_ok=True)
+            normal_sel[identity] = image_order(seed, identity)[:images_per_id]
+            for img in normal_sel[identity]:
+                records.append(make_record(
+                    client_name, identity, identity, img, "normal", 0
+                ))
 
-            imgs = os.listdir(
-                os.path.join(CELEBA_DIR, identity)
-            )
-            for img in random.sample(
-                imgs, min(IMAGES_PER_ID, len(imgs))
-            ):
-                shutil.copy(
-                    os.path.join(CELEBA_DIR, identity, img),
-                    os.path.join(id_dir, img)
-                )
-
-        attack_metadata["clients"].append({
+        entries.append({
             "client": client_name,
-            "type": "normal"
+            "type": "normal",
+            "identity_images": normal_sel
         })
 
-# ---------------- SAVE METADATA ----------------
-attack_meta_path = os.path.join(
-    OUTPUT_DIR, "attack_metadata.json"
-)
-with open(attack_meta_path, "w") as f:
-    json.dump(attack_metadata, f, indent=2)
+    return lines, entries, records
+
+
+# ---------------- GENERATE ----------------
+def generate_attacks(seed, celeba_dir=CELEBA_DIR, federated_dir=FEDERATED_DIR,
+                     verbose=True, shards=None, clients=None,
+                     workers=WORKERS, params=None):
+    """Select attack/normal registrations for ``seed`` without touching
+    the output tree. Returns ``(attack_metadata, manifest)``.
+
+    Identity listings come from ``shards`` (an
+    ``image_shards.ShardReader``), else the metadata index written by
+    separate_celeba_identities.py, else the celeba_identities folders;
+    listings are sorted before shuffling, so the selection is the same.
+    ``clients`` (``{"client_00.txt": [identity, ...]}``, as returned by
+    create_federated_clients) replaces reading ``federated_dir``.
+    ``params`` overrides any of ``DEFAULT_PARAMS``.
+
+    Every client is generated by ``generate_client`` with its own seed
+    derived from ``(seed, client)``, over ``workers`` processes; results
+    are collected in client order, so the output does not depend on
+    ``workers``. All draws are prefix-nested, so a larger attack fraction,
+    target count, donor count or images per identity extends the
+    selection of a smaller one (see attack_campaign.py).
+    """
+    log = print if verbose else (lambda *a, **k: None)
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+
+    # ---------------- LOAD CLIENT FILES ----------------
+    if clients is None:
+        client_ids = load_clients(federated_dir)
+    else:
+        client_ids = clients
+
+    clients = sorted(client_ids)
+
+    num_clients = len(clients)
+    assert num_clients > 0, "No client files found!"
+
+    num_attack_clients = max(
+        1, int(num_clients * params["attack_fraction"])
+    )
+    malicious_clients = sorted(
+        clients[j]
+        for j in nested_sample(
+            random.Random(seed), num_clients, num_attack_clients
+        )
+    )
+
+    log(f"Random seed          : {seed}")
+    log(f"Total clients        : {num_clients}")
+    log(f"Malicious clients ({num_attack_clients}): {malicious_clients}")
+
+    # ---------------- METADATA ----------------
+    attack_metadata = {
+        "random_seed": seed,
+        "attack_fraction": params["attack_fraction"],
+        "num_attack_ids_per_client": params["num_attack_ids_per_client"],
+        "donors_per_attack": params["donors_per_attack"],
+        "images_per_id": params["images_per_id"],
+        "malicious_clients": malicious_clients,
+        "clients": []
+    }
+    records = []
+
+    # ---------------- PROCESS CLIENTS ----------------
+    malicious = set(malicious_clients)
+    units = [
+        (client, client_ids[client], client in malicious, seed, params)
+        for client in clients
+    ]
+
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_source,
+            initargs=(celeba_dir, shards)
+        )
+        results = pool.map(
+            generate_client, units,
+            chunksize=max(1, len(units) // (4 * workers))
+        )
+    else:
+        pool = None
+        init_source(celeba_dir, shards)
+        results = map(generate_client, units)
+
+    try:
+        for lines, entries, client_records in results:
+            for line in lines:
+                log(line)
+            attack_metadata["clients"].extend(entries)
+            records.extend(client_records)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    manifest = {
+        "random_seed": seed,
+        "celeba_dir": os.path.abspath(celeba_dir),
+        "images_per_id": params["images_per_id"],
+        "records": records
+    }
+    return attack_metadata, manifest
+
+
+# ---------------- MATERIALIZE ----------------
+def materialize(manifest, output_dir, mode="copy"):
+    normal_dir = os.path.join(output_dir, "NormalPairs")
+    attack_dir = os.path.join(output_dir, "AttackPairs")
+
+    # Start from a clean tree so files from a previous seed never leak
+    # into this seed's NormalPairs/AttackPairs.
+    for d in (normal_dir, attack_dir):
+        if os.path.isdir(d):
+            shutil.rmtree(d)
+
+    place = {
+        "copy": shutil.copy,
+        "hardlink": os.link,
+        "symlink": lambda src, dst: os.symlink(os.path.abspath(src), dst)
+    }[mode]
+
+    celeba_dir = manifest["celeba_dir"]
+    for r in manifest["records"]:
+        root = attack_dir if r["label"] == 1 else normal_dir
+        dst_dir = os.path.join(root, r["client"], r["identity"])
+        os.makedirs(dst_dir, exist_ok=True)
+        place(
+            os.path.join(celeba_dir, r["source_identity"], r["source_image"]),
+            os.path.join(dst_dir, r["file"])
+        )
+
+
+def save_outputs(output_dir, attack_metadata, manifest):
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest_path = os.path.join(output_dir, "attack_manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    attack_meta_path = os.path.join(output_dir, "attack_metadata.json")
+    with open(attack_meta_path, "w") as f:
+        json.dump(attack_metadata, f, indent=2)
+
+    return manifest_path, attack_meta_path
+
+
+def main():
+    # ================= ARGUMENTS =================
+    parser = argparse.ArgumentParser(
+        description="Generate multi-face registration attacks"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed for reproducibility"
+    )
+    parser.add_argument(
+        "--manifest-only",
+        action="store_true",
+        help="Only write attack_manifest.json (no NormalPairs/AttackPairs)"
+    )
+    parser.add_argument(
+        "--materialize",
+        choices=["copy", "hardlink", "symlink"],
+        default="copy",
+        help="How to create the NormalPairs/AttackPairs files"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=OUTPUT_DIR,
+        help="Output directory (default: data_processed/attack_dataset)"
+    )
+    parser.add_argument(
+        "--shards",
+        nargs="?",
+        const=SHARD_DIR,
+        default=None,
+        help="List identities from image_shards.py output instead of folders"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="Processes generating clients (output does not depend on it)"
+    )
+    args = parser.parse_args()
+    # ============================================
+
+    shards = ShardReader(args.shards) if args.shards else None
+    attack_metadata, manifest = generate_attacks(
+        args.seed, shards=shards, workers=args.workers
+    )
+
+    manifest_path, attack_meta_path = save_outputs(
+        args.output_dir, attack_metadata, manifest
+    )
+    print(
+        f"\n[INFO] attack_manifest.json saved "
+        f"({len(manifest['records'])} images)"
+    )
+
+    if not args.manifest_only:
+        materialize(manifest, args.output_dir, args.materialize)
+        print(
+            f"[INFO] Materialized folders ({args.materialize}) "
+            f"in {args.output_dir}"
+        )
+
+    print("\n[INFO] attack_metadata.json saved to:")
+    print(attack_meta_path)
+    print("\nMulti-face registration attack generation COMPLETE.")
+
 
-print("\n[INFO] attack_metadata.json saved to:")
-print(attack_meta_path)
-print("\nMulti-face registration attack generation COMPLETE.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import numpy as np
+
+# ================= CONFIG =================
+SEGMENT_CHUNK_ROWS = 1 << 16    # rows gathered at once per length bucket
+# =========================================
+
+
+# ---------------- SCORERS ----------------
+# Every scorer maps the Gram matrices ``G`` (k, L, L) of k identities with
+# L L2-normalised embeddings each to k anomaly scores; higher means more
+# likely a multi-face registration. All of them derive from ``G``, so one
+# batched matmul per bucket feeds the whole set.
+def _centroid_distances(G):
+    # <x_i, c> with c = sum_j x_j / |sum_j x_j|, written in terms of G.
+    row_sums = G.sum(axis=2)
+    norm = np.sqrt(np.maximum(row_sums.sum(axis=1), 1e-12))
+    return 1.0 - row_sums / norm[:, None]
+
+
+def centroid_max(G):
+    return _centroid_distances(G).max(axis=1)
+
+
+def centroid_mean(G):
+    return _centroid_distances(G).mean(axis=1)
+
+
+def _off_diagonal(G, fill):
+    G = G.copy()
+    idx = np.arange(G.shape[1])
+    G[:, idx, idx] = fill
+    return G
+
+
+def pairwise_min(G):
+    # Least similar pair: donors stay far apart even when they drag the
+    # centroid towards themselves.
+    return 1.0 - _off_diagonal(G, np.inf).min(axis=(1, 2))
+
+
+def medoid_max(G):
+    # Robust centroid: the member most similar to all others.
+    medoid = G.sum(axis=2).argmax(axis=1)
+    return 1.0 - G[np.arange(len(G)), medoid].min(axis=1)
+
+
+def spectral_gap(G):
+    # Share of the second principal direction: ~0 for one face, grows as
+    # a second face takes up a real part of the set.
+    w = np.linalg.eigvalsh(G.astype(np.float64))
+    return w[:, -2] / np.maximum(w[:, -1], 1e-12)
+
+
+def split_silhouette(G):
+    # Mean silhouette of the k=2 split seeded by the least similar pair.
+    k, L, _ = G.shape
+    rows = np.arange(k)
+    flat = _off_diagonal(G, np.inf).reshape(k, -1).argmin(axis=1)
+    a, b = flat // L, flat % L
+
+    in_a = G[rows, :, a] >= G[rows, :, b]
+    same = in_a[:, :, None] == in_a[:, None, :]
+    same = _off_diagonal(same, False)
+    other = in_a[:, :, None] != in_a[:, None, :]
+
+    D = 1.0 - G
+    n_same = same.sum(axis=2)
+    n_other = other.sum(axis=2)
+    intra = (D * same).sum(axis=2) / np.maximum(n_same, 1)
+    inter = (D * other).sum(axis=2) / np.maximum(n_other, 1)
+
+    s = (inter - intra) / np.maximum(np.maximum(intra, inter), 1e-12)
+    s[(n_same == 0) | (n_other == 0)] = 0.0       # singleton / no split
+    return s.mean(axis=1)
+
+
+# name -> scorer and the range its scores fall in (for histogram ROC).
+SCORERS = {
+    "max": {"fn": centroid_max, "range": (0.0, 2.0)},
+    "mean": {"fn": centroid_mean, "range": (0.0, 2.0)},
+    "pairwise_min": {"fn": pairwise_min, "range": (0.0, 2.0)},
+    "medoid": {"fn": medoid_max, "range": (0.0, 2.0)},
+    "spectral_gap": {"fn": spectral_gap, "range": (0.0, 1.0)},
+    "split_gap": {"fn": split_silhouette, "range": (-1.0, 1.0)}
+}
+
+
+# ---------------- SEGMENTED KERNEL ----------------
+def segment_score_table(embeddings, lengths, names=None):
+    """Run the ``names``d scorers (default: all) over many identities.
+
+    ``embeddings`` stacks every identity's L2-normalised rows back to back
+    and ``lengths[i]`` is the row count of identity ``i``. Identities are
+    bucketed by length so each bucket is a dense ``(k, L, D)`` block: one
+    gather and one batched matmul for its Gram matrices, looping only over
+    distinct lengths (and ``SEGMENT_CHUNK_ROWS``-sized chunks). Returns
+    ``{name: (n,) scores}``; identities with fewer than two rows are NaN.
+    """
+    names = list(names or SCORERS)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    table = {name: np.full(len(lengths), np.nan) for name in names}
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    for length in np.unique(lengths[lengths >= 2]):
+        segs = np.flatnonzero(lengths == length)
+        step = max(1, SEGMENT_CHUNK_ROWS // length)
+        for i in range(0, len(segs), step):
+            chunk = segs[i:i + step]
+            block = embeddings[starts[chunk, None] + np.arange(length)]
+            G = np.matmul(block, block.transpose(0, 2, 1))
+            for name in names:
+                table[name][chunk] = SCORERS[name]["fn"](G)
+
+    return table
@@ -0,0 +1,211 @@
+import os
+import io
+import json
+import mmap
+import argparse
+import numpy as np
+from PIL import Image
+
+# ================= CONFIG =================
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
+BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
+
+CELEBA_DIR = os.path.join(BASE_DIR, "celeba_identities")
+SHARD_DIR = os.path.join(BASE_DIR, "celeba_shards")
+
+INDEX_FILE = "shards_index.json"
+SHARD_BYTES = 1024 ** 3          # start a new shard after ~1 GiB
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+RAW_SIZE = 224
+# =========================================
+
+
+# ---------------- WRITER ----------------
+def write_shards(celeba_dir, out_dir, shard_bytes=SHARD_BYTES, raw=False):
+    """Pack every identity folder into a few large shard files.
+
+    Images of one identity are stored contiguously (never split across
+    shards) in ``os.listdir`` order, so readers see exactly the listing
+    the folder tree would give. ``raw=True`` stores pre-resized
+    224x224 RGB uint8 pixels instead of the original JPEG bytes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    identities = sorted(
+        d for d in os.listdir(celeba_dir)
+        if os.path.isdir(os.path.join(celeba_dir, d))
+    )
+
+    index = {
+        "format": f"rgb{RAW_SIZE}" if raw else "encoded",
+        "resize": "bilinear" if raw else None,
+        "shards": [],
+        "identities": {}
+    }
+
+    shard_id, shard, written = -1, None, shard_bytes
+    for identity in identities:
+        id_dir = os.path.join(celeba_dir, identity)
+        names = [
+            f for f in os.listdir(id_dir)
+            if f.lower().endswith(IMAGE_EXTS)
+        ]
+
+        blobs = []
+        for name in names:
+            path = os.path.join(id_dir, name)
+            if raw:
+                img = Image.open(path).convert("RGB").resize(
+                    (RAW_SIZE, RAW_SIZE), Image.BILINEAR
+                )
+                blobs.append(np.asarray(img, dtype=np.uint8).tobytes())
+            else:
+                with open(path, "rb") as f:
+                    blobs.append(f.read())
+
+        if written >= shard_bytes:
+            if shard is not None:
+                shard.close()
+            shard_id += 1
+            shard_name = f"shard_{shard_id:05d}.bin"
+            index["shards"].append(shard_name)
+            shard = open(os.path.join(out_dir, shard_name), "wb")
+            written = 0
+
+        start = written
+        entries = []
+        for name, blob in zip(names, blobs):
+            entries.append([name, written, len(blob)])
+            shard.write(blob)
+            written += len(blob)
+
+        index["identities"][identity] = {
+            "shard": shard_id,
+            "offset": start,
+            "length": written - start,
+            "images": entries
+        }
+
+    if shard is not None:
+        shard.close()
+
+    with open(os.path.join(out_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+
+    return index
+
+
+# ---------------- READER ----------------
+class ShardReader:
+    """Memory-mapped random access to a shard directory.
+
+    Image keys are ``"<identity>/<image name>"``. Shards are mapped lazily
+    and the maps are dropped on pickling, so a reader can be handed to
+    DataLoader worker processes.
+    """
+
+    def __init__(self, shard_dir=SHARD_DIR):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        self.format = index["format"]
+        # Indexes written before "resize" was recorded: raw was bilinear.
+        self.resize = index.get(
+            "resize", None if self.format == "encoded" else "bilinear"
+        )
+        self.shards = index["shards"]
+        self.ranges = index["identities"]
+        self.entries = {
+            (identity, name): (r["shard"], offset, length)
+            for identity, r in self.ranges.items()
+            for name, offset, length in r["images"]
+        }
+        self._maps = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def _map(self, shard):
+        m = self._maps.get(shard)
+        if m is None:
+            with open(os.path.join(self.shard_dir, self.shards[shard]),
+                      "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = m
+        return m
+
+    @property
+    def fingerprint(self):
+        # What the pixels went through before the model: the same content
+        # hash can decode differently in another format.
+        return f"shards:{self.format}:{self.resize}"
+
+    # ---------------- LISTING ----------------
+    def identities(self):
+        return list(self.ranges)
+
+    def has_identity(self, identity):
+        return identity in self.ranges
+
+    def list_images(self, identity):
+        return [name for name, _, _ in self.ranges[identity]["images"]]
+
+    # ---------------- READING ----------------
+    def read_bytes(self, key):
+        identity, name = key.split("/", 1)
+        shard, offset, length = self.entries[(identity, name)]
+        return self._map(shard)[offset:offset + length]
+
+    def open(self, key):
+        data = self.read_bytes(key)
+        if self.format == "encoded":
+            return Image.open(io.BytesIO(data))
+        pixels = np.frombuffer(data, dtype=np.uint8)
+        return Image.fromarray(pixels.reshape(RAW_SIZE, RAW_SIZE, 3))
+
+    def identity_bytes(self, identity):
+        # One sequential read covering every image of ``identity``.
+        r = self.ranges[identity]
+        return self._map(r["shard"])[r["offset"]:r["offset"] + r["length"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack celeba_identities into mmap-friendly shards"
+    )
+    parser.add_argument("--celeba-dir", default=CELEBA_DIR)
+    parser.add_argument("--out-dir", default=SHARD_DIR)
+    parser.add_argument(
+        "--shard-mb",
+        type=int,
+        default=SHARD_BYTES // 1024 ** 2,
+        help="Approximate shard size in MiB"
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help=f"Store pre-resized {RAW_SIZE}x{RAW_SIZE} uint8 RGB pixels"
+    )
+    args = parser.parse_args()
+
+    index = write_shards(
+        args.celeba_dir, args.out_dir,
+        shard_bytes=args.shard_mb * 1024 ** 2,
+        raw=args.raw
+    )
+
+    n_images = sum(len(r["images"]) for r in index["identities"].values())
+    print(f"[INFO] Identities : {len(index['identities'])}")
+    print(f"[INFO] Images     : {n_images}")
+    print(f"[INFO] Shards     : {len(index['shards'])} ({index['format']})")
+    print(f"[INFO] Saved to   : {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
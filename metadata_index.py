@@ -0,0 +1,242 @@
+import os
+import json
+import numpy as np
+
+# ================= CONFIG =================
+INDEX_FILE = "metadata_index.npz"      # next to celeba_identities
+SPLITS = ("train", "val", "test")
+# =========================================
+
+
+def index_path(celeba_dir):
+    return os.path.join(
+        os.path.dirname(os.path.abspath(celeba_dir)), INDEX_FILE
+    )
+
+
+def stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def stamps(files):
+    return {os.path.abspath(f): stamp(f) for f in files}
+
+
+# ---------------- PARSING ----------------
+def parse_identity_file(path):
+    """``identity_CelebA.txt`` as two arrays ``(images, pids)``; one read
+    and one split instead of a Python loop per line."""
+    with open(path) as f:
+        tokens = f.read().split()
+    return np.array(tokens[0::2]), np.array(tokens[1::2], dtype=np.int64)
+
+
+def group_identities(images, pids, available=None, min_images=1):
+    """Group the mapping by identity the way separate_celeba_identities.py
+    lays out folders: images missing from ``available`` are dropped,
+    identities with fewer than ``min_images`` left are dropped, names are
+    ``id_<pid:06d>`` and each identity keeps its file order.
+    ``available`` is a set of image names. Returns
+    ``(identities, images, offsets, num_pids)``."""
+    num_pids = len(np.unique(pids))
+    if available is not None:
+        # Set lookups: np.isin on strings sorts both sides and is slower.
+        keep = np.fromiter(
+            (img in available for img in images.tolist()), bool, len(images)
+        )
+        images, pids = images[keep], pids[keep]
+
+    order = np.argsort(pids, kind="stable")
+    images, pids = images[order], pids[order]
+    uniq, counts = np.unique(pids, return_counts=True)
+
+    kept = counts >= min_images
+    images = images[np.repeat(kept, counts)]
+    identities = np.char.add(
+        "id_", np.char.zfill(uniq[kept].astype(str), 6)
+    )
+    offsets = np.concatenate(([0], np.cumsum(counts[kept])))
+    return identities, images, offsets, num_pids
+
+
+# ---------------- INDEX ----------------
+class MetadataIndex:
+    """identity -> image range, image -> identity, identity -> split and
+    identity -> client of every federation, in one .npz.
+
+    ``identities`` is sorted and ``images[offsets[i]:offsets[i + 1]]`` are
+    the images of identity ``i``. Splits and federations keep their list
+    order through a rank column. Each section remembers the size and mtime
+    of the files it was built from; ``load`` drops sections whose files
+    changed and returns ``None`` when the identity section itself is
+    stale, so callers fall back to scanning.
+    """
+
+    def __init__(self, identities, images, offsets, sources=None):
+        self.identities = np.asarray(identities)
+        self.images = np.asarray(images)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.split = np.full(len(self.identities), -1, dtype=np.int8)
+        self.split_rank = np.zeros(len(self.identities), dtype=np.int32)
+        self.federations = {}      # n -> (client names, client, rank)
+        self.sources = sources or {}
+        self._identity_set = None
+
+    # ---------------- LOOKUPS ----------------
+    @property
+    def identity_set(self):
+        if self._identity_set is None:
+            self._identity_set = set(self.identities.tolist())
+        return self._identity_set
+
+    @staticmethod
+    def _lookup(table, keys, sorter=None):
+        # searchsorted returns the insertion point, not a match: clip it
+        # into range and compare, so unknown keys never alias a neighbour.
+        keys = np.asarray(keys)
+        if len(table) == 0 or keys.size == 0:
+            return (
+                np.zeros(keys.size, dtype=np.int64),
+                np.zeros(keys.size, dtype=bool)
+            )
+        pos = np.clip(
+            np.searchsorted(table, keys, sorter=sorter), 0, len(table) - 1
+        )
+        if sorter is not None:
+            pos = sorter[pos]
+        return pos, table[pos] == keys
+
+    def positions(self, identities):
+        """Row of each identity; ``KeyError`` naming any not indexed."""
+        identities = np.asarray(list(identities))
+        pos, found = self._lookup(self.identities, identities)
+        if not found.all():
+            missing = identities[~found]
+            raise KeyError(
+                f"{len(missing)} identities not in the metadata index: "
+                f"{missing[:10].tolist()}"
+            )
+        return pos
+
+    def images_of(self, identity):
+        i = self.positions([identity])[0]
+        return self.images[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def identity_of(self, images):
+        """Identity of each image name (``None`` when unknown)."""
+        images = list(images)
+        owner = np.repeat(self.identities, np.diff(self.offsets))
+        pos, found = self._lookup(
+            self.images, images, sorter=np.argsort(self.images)
+        )
+        return [
+            owner[p].item() if f else None
+            for p, f in zip(pos.tolist(), found.tolist())
+        ]
+
+    def has_source(self, section, path):
+        return os.path.abspath(path) in self.sources.get(section, {})
+
+    def image_counts(self, identities):
+        pos = self.positions(identities)
+        return self.offsets[pos + 1] - self.offsets[pos]
+
+    def split_ids(self, name):
+        members = np.flatnonzero(self.split == SPLITS.index(name))
+        members = members[np.argsort(self.split_rank[members])]
+        return self.identities[members].tolist()
+
+    def clients(self, num_clients):
+        names, client, rank = self.federations[num_clients]
+        members = np.flatnonzero(client >= 0)
+        members = members[np.lexsort((rank[members], client[members]))]
+        bounds = np.cumsum(np.bincount(client[members], minlength=len(names)))
+        ids = self.identities[members]
+        return {
+            name: ids[start:end].tolist()
+            for name, start, end in zip(
+                names, np.concatenate(([0], bounds[:-1])), bounds
+            )
+        }
+
+    # ---------------- UPDATES ----------------
+    def set_splits(self, splits, files=()):
+        # Resolve every id first so an unknown one leaves the index as is.
+        rows = [self.positions(splits[name]) for name in SPLITS]
+        self.split[:] = -1
+        for code, pos in enumerate(rows):
+            self.split[pos] = code
+            self.split_rank[pos] = np.arange(len(pos))
+        self.sources["splits"] = stamps(files)
+
+    def set_clients(self, num_clients, clients, files=()):
+        names = sorted(clients)
+        client = np.full(len(self.identities), -1, dtype=np.int32)
+        rank = np.zeros(len(self.identities), dtype=np.int32)
+        for cid, name in enumerate(names):
+            pos = self.positions(clients[name])
+            client[pos] = cid
+            rank[pos] = np.arange(len(pos))
+        self.federations[num_clients] = (names, client, rank)
+        self.sources[f"clients_{num_clients}"] = stamps(files)
+
+    # ---------------- PERSISTENCE ----------------
+    def save(self, path):
+        arrays = {
+            "identities": self.identities,
+            "images": self.images,
+            "offsets": self.offsets,
+            "split": self.split,
+            "split_rank": self.split_rank,
+            "sources": json.dumps(self.sources)
+        }
+        for n, (names, client, rank) in self.federations.items():
+            arrays[f"client_names_{n}"] = np.array(names)
+            arrays[f"client_{n}"] = client
+            arrays[f"client_rank_{n}"] = rank
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        sources = json.loads(str(data["sources"]))
+
+        def fresh(section):
+            try:
+                return all(
+                    stamp(f) == s for f, s in sources.get(section, {}).items()
+                )
+            except OSError:
+                return False
+
+        if "identities" not in sources or not fresh("identities"):
+            return None
+
+        index = cls(data["identities"], data["images"], data["offsets"])
+        index.sources = {"identities": sources["identities"]}
+        if "splits" in sources and fresh("splits"):
+            index.split = data["split"]
+            index.split_rank = data["split_rank"]
+            index.sources["splits"] = sources["splits"]
+        for section in sources:
+            if section.startswith("clients_") and fresh(section):
+                n = int(section.split("_")[1])
+                index.federations[n] = (
+                    data[f"client_names_{n}"].tolist(),
+                    data[f"client_{n}"],
+                    data[f"client_rank_{n}"]
+                )
+                index.sources[section] = sources[section]
+        return index
+
+
+def load_index(celeba_dir):
+    return MetadataIndex.load(index_path(celeba_dir))
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import argparse
+from dataclasses import dataclass, field, fields, asdict
+
+# ================= CONFIG =================
+STAGES = ["separate", "split", "federate", "attack", "detect"]
+# =========================================
+
+
+@dataclass
+class PipelineConfig:
+    """Every knob of the pipeline in one place.
+
+    Directory layout is derived from ``project_root`` exactly as the
+    individual scripts derive it from ``FACE_PROJECT_ROOT``. Load one from
+    JSON with ``PipelineConfig.from_file`` (``--dump-config`` prints the
+    defaults to start from).
+    """
+    project_root: str = os.environ.get(
+        "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+    )
+
+    # separate
+    link: str = "auto"
+    link_workers: int = 16
+    incremental: bool = False
+
+    # split
+    split_seed: int = 42
+
+    # federate
+    federate_seed: int = 42
+    client_settings: list = field(default_factory=lambda: [10, 20, 50])
+    min_ids_per_client: int = 50
+    max_ids_per_client: int = 150
+    partition: str = "uniform"       # or "dirichlet" / "powerlaw" (non-IID)
+    dirichlet_alpha: float = 0.5
+    powerlaw_exponent: float = 1.2
+    image_skew: float = 0.0
+
+    # attack
+    seed: int = 42
+    num_clients: int = 20
+    attack_workers: int = 1
+    materialize: str = None          # None: manifest only
+
+    # detect
+    backbone: str = "resnet50"
+    random_weights: bool = False
+    batch_size: int = 64
+    num_workers: int = 0
+    loader: str = "dataloader"
+    prefetch_depth: int = 4
+    score_mode: str = "max"
+    use_cache: bool = True
+    use_ledger: bool = True
+    cache_max_gb: float = 2.0
+    stream: bool = False             # memory-bounded, resumable detection
+    resume: bool = True              # stream: keep scores.jsonl records
+    plots: bool = True               # False: metrics only (render later)
+    n_boot: int = 1000               # CI resamples; 0 skips the CIs
+
+    # ---------------- DERIVED PATHS ----------------
+    @property
+    def celeba_root(self):
+        return os.path.join(self.project_root, "Celeba")
+
+    @property
+    def image_dir(self):
+        return os.path.join(
+            self.celeba_root, "img_align_celeba", "img_align_celeba"
+        )
+
+    @property
+    def identity_file(self):
+        return os.path.join(self.celeba_root, "identity_CelebA.txt")
+
+    @property
+    def data_dir(self):
+        return os.path.join(self.project_root, "data_processed")
+
+    @property
+    def celeba_dir(self):
+        return os.path.join(self.data_dir, "celeba_identities")
+
+    @property
+    def splits_dir(self):
+        return os.path.join(self.data_dir, "splits")
+
+    @property
+    def federated_dir(self):
+        return os.path.join(self.data_dir, "federated")
+
+    @property
+    def attack_dir(self):
+        return os.path.join(self.data_dir, "attack_dataset")
+
+    @property
+    def cache_dir(self):
+        return os.path.join(self.data_dir, "embedding_cache")
+
+    @property
+    def ledger_dir(self):
+        return os.path.join(self.data_dir, "score_ledger")
+
+    @property
+    def results_dir(self):
+        return os.path.join(self.project_root, "results")
+
+    # ---------------- SERIALIZATION ----------------
+    @classmethod
+    def from_dict(cls, values):
+        known = {f.name for f in fields(cls)}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown config keys: {sorted(unknown)}")
+        return cls(**values)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        return asdict(self)
+
+
+# ---------------- PIPELINE ----------------
+class Pipeline:
+    """Runs the stages in one process.
+
+    Results of earlier stages (split lists, client assignments, the attack
+    manifest) are kept on the instance and handed to later stages in
+    memory; the embedding model and cache are loaded once and reused by
+    every ``detect`` call.
+    """
+
+    def __init__(self, config=None, verbose=True):
+        self.config = config or PipelineConfig()
+        self.verbose = verbose
+
+        self.preprocess_meta = None
+        self.splits = None
+        self.federations = {}
+        self.attack_metadata = None
+        self.manifest = None
+        self.cache = None
+        self.ledger = None
+        self.timings = {}
+
+    def _timed(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.timings[stage] = time.perf_counter() - start
+        return out
+
+    # ---------------- STAGES ----------------
+    def separate(self):
+        from separate_celeba_identities import separate_identities
+        c = self.config
+        self.preprocess_meta = self._timed(
+            "separate", separate_identities,
+            image_dir=c.image_dir, identity_file=c.identity_file,
+            output_dir=c.celeba_dir, link=c.link, workers=c.link_workers,
+            incremental=c.incremental, verbose=self.verbose
+        )
+        return self.preprocess_meta
+
+    def split(self):
+        from rebuild_train_ids import split_identities
+        c = self.config
+        self.splits = self._timed(
+            "split", split_identities,
+            celeba_dir=c.celeba_dir, splits_dir=c.splits_dir,
+            seed=c.split_seed, verbose=self.verbose
+        )
+        return self.splits
+
+    def federate(self):
+        from create_federated_clients import create_federated_clients
+        c = self.config
+        train_ids = (
+            self.splits["train"] if self.splits is not None
+            else os.path.join(c.splits_dir, "train_ids.txt")
+        )
+        self.federations = self._timed(
+            "federate", create_federated_clients,
+            train_ids=train_ids, celeba_dir=c.celeba_dir,
+            output_dir=c.federated_dir,
+            client_settings=c.client_settings,
+            base_seed=c.federate_seed,
+            min_ids=c.min_ids_per_client,
+            max_ids=c.max_ids_per_client,
+            partition=c.partition,
+            alpha=c.dirichlet_alpha,
+            exponent=c.powerlaw_exponent,
+            image_skew=c.image_skew,
+            verbose=self.verbose
+        )
+        return self.federations
+
+    def attack(self, seed=None, output_dir=None):
+        from generate_multiface_attack import (
+            generate_attacks, save_outputs, materialize
+        )
+        c = self.config
+        seed = c.seed if seed is None else seed
+        output_dir = output_dir or c.attack_dir
+
+        start = time.perf_counter()
+        self.attack_metadata, self.manifest = generate_attacks(
+            seed,
+            celeba_dir=c.celeba_dir,
+            federated_dir=os.path.join(
+                c.federated_dir, f"clients_{c.num_clients}"
+            ),
+            verbose=self.verbose,
+            clients=self.federations.get(c.num_clients),
+            workers=c.attack_workers
+        )
+        save_outputs(output_dir, self.attack_metadata, self.manifest)
+        if c.materialize:
+            materialize(self.manifest, output_dir, c.materialize)
+        self.timings["attack"] = time.perf_counter() - start
+
+        return self.attack_metadata, self.manifest
+
+    def detect(self, output_dir=None):
+        import embedding_detection
+        c = self.config
+
+        manifest = self.manifest
+        manifest_path = os.path.join(c.attack_dir, "attack_manifest.json")
+        if manifest is None and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        if c.use_cache and self.cache is None:
+            self.cache = embedding_detection.open_cache(
+                c.cache_dir, c.cache_max_gb, name=c.backbone,
+                random_weights=c.random_weights
+            )
+        if c.use_ledger and self.ledger is None:
+            self.ledger = embedding_detection.open_ledger(
+                c.ledger_dir, name=c.backbone,
+                random_weights=c.random_weights
+            )
+
+        detect = embedding_detection.run_detection
+        extra = {}
+        if c.stream:
+            detect = embedding_detection.stream_detection
+            extra["resume"] = c.resume
+        return self._timed(
+            "detect", detect,
+            manifest=manifest,
+            metadata=os.path.join(c.attack_dir, "attack_metadata.json"),
+            batch_size=c.batch_size,
+            num_workers=c.num_workers,
+            cache=self.cache,
+            name=c.backbone,
+            random_weights=c.random_weights,
+            output_dir=output_dir or c.results_dir,
+            pairs_dir=c.attack_dir,
+            ledger=self.ledger,
+            loader=c.loader,
+            prefetch_depth=c.prefetch_depth,
+            score_mode=c.score_mode,
+            n_boot=c.n_boot,
+            plots=c.plots,
+            verbose=self.verbose,
+            **extra
+        )
+
+    def run(self, stages=STAGES):
+        results = {}
+        for stage in STAGES:
+            if stage in stages:
+                results[stage] = getattr(self, stage)()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run pipeline stages in a single process"
+    )
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        help=f"Stages to run, in pipeline order (default: all of "
+             f"{' '.join(STAGES)})"
+    )
+    parser.add_argument(
+        "--config",
+        default=None,
+        help="JSON file with PipelineConfig fields"
+    )
+    parser.add_argument(
+        "--set",
+        nargs="+",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Override config fields (VALUE parsed as JSON when possible)"
+    )
+    parser.add_argument(
+        "--dump-config",
+        action="store_true",
+        help="Print the resolved config as JSON and exit"
+    )
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)}")
+
+    values = PipelineConfig().to_dict()
+    if args.config:
+        values.update(PipelineConfig.from_file(args.config).to_dict())
+    for item in args.set:
+        key, _, raw = item.partition("=")
+        try:
+            values[key] = json.loads(raw)
+        except json.JSONDecodeError:
+            values[key] = raw
+    config = PipelineConfig.from_dict(values)
+
+    if args.dump_config:
+        print(json.dumps(config.to_dict(), indent=2))
+        return
+
+    pipe = Pipeline(config, verbose=not args.quiet)
+    results = pipe.run(args.stages or STAGES)
+
+    print("\n===== PIPELINE COMPLETE =====")
+    for stage, seconds in pipe.timings.items():
+        print(f"{stage:9s}: {seconds:8.2f}s")
+    if "detect" in results:
+        r = results["detect"]
+        ci = r["roc_auc_ci95"]
+        ci = f" [{ci[0]:.4f}, {ci[1]:.4f}]" if ci is not None else ""
+        print(f"ROC-AUC  : {r['roc_auc']:.4f}{ci}")
+        print(f"TPR @ 1% : {r['tpr_1pct']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import time
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# ================= CONFIG =================
+PROFILE_FILE = "profile.json"
+CPROFILE_FILE = "profile.prof"
+# =========================================
+
+
+class Profiler:
+    """Accumulates wall time and call counts per named stage, plus plain
+    counters. Thread-safe, cheap enough to stay on permanently (two
+    ``perf_counter`` calls per timed block).
+
+    Stages may overlap (e.g. ``decode`` runs in loader threads or worker
+    processes while ``forward`` runs in the main thread), so stage times
+    can add up to more than ``wall_seconds``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.seconds = defaultdict(float)
+            self.calls = defaultdict(int)
+            self.counters = defaultdict(int)
+            self.started = time.perf_counter()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds, calls=1):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += calls
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def report(self):
+        with self._lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.started,
+                "stages": {
+                    stage: {"seconds": s, "calls": self.calls[stage]}
+                    for stage, s in sorted(
+                        self.seconds.items(), key=lambda kv: -kv[1]
+                    )
+                },
+                "counters": dict(self.counters)
+            }
+
+
+# Process-wide profiler used by the instrumented hot paths.
+PROFILER = Profiler()
+
+
+def timer(stage):
+    return PROFILER.timer(stage)
+
+
+def save_report(path, report):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+# ---------------- AGGREGATION ----------------
+def aggregate(reports):
+    """Combine per-run reports (e.g. one per seed): totals plus mean/std of
+    each stage's seconds and its share of the summed wall time."""
+    stages = sorted({s for r in reports for s in r["stages"]})
+    counters = sorted({c for r in reports for c in r["counters"]})
+    wall = sum(r["wall_seconds"] for r in reports)
+
+    out = {
+        "runs": len(reports),
+        "wall_seconds": wall,
+        "stages": {},
+        "counters": {
+            c: sum(r["counters"].get(c, 0) for r in reports) for c in counters
+        }
+    }
+    for stage in stages:
+        secs = np.array([
+            r["stages"].get(stage, {}).get("seconds", 0.0) for r in reports
+        ])
+        out["stages"][stage] = {
+            "seconds": float(secs.sum()),
+            "mean_seconds": float(secs.mean()),
+            "std_seconds": float(secs.std()),
+            "calls": sum(
+                r["stages"].get(stage, {}).get("calls", 0) for r in reports
+            ),
+            "share_of_wall": float(secs.sum() / wall) if wall > 0 else 0.0
+        }
+    out["stages"] = dict(sorted(
+        out["stages"].items(), key=lambda kv: -kv[1]["seconds"]
+    ))
+    return out
+
+
+def format_report(report, top=12):
+    lines = [f"{'stage':16s} {'seconds':>9s} {'calls':>8s}"]
+    for stage, s in list(report["stages"].items())[:top]:
+        lines.append(f"{stage:16s} {s['seconds']:9.3f} {s['calls']:8d}")
+    return "\n".join(lines)
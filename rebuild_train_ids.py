@@ -1,8 +1,12 @@
 import os
 import random
 
+from metadata_index import index_path, load_index
+
 # ================= CONFIG =================
-PROJECT_ROOT = r"D:\Face recogination project"
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
 BASE_DIR = os.path.join(PROJECT_ROOT, "data_processed")
 
 CELEBA_DIR = os.path.join(BASE_DIR, "celeba_identities")
@@ -16,73 +20,110 @@ TEST_RATIO  = 0.15
 RANDOM_SEED = 42
 # ========================================
 
-os.makedirs(SPLITS_DIR, exist_ok=True)
-
-train_file = os.path.join(SPLITS_DIR, "train_ids.txt")
-val_file   = os.path.join(SPLITS_DIR, "val_ids.txt")
-test_file  = os.path.join(SPLITS_DIR, "test_ids.txt")
-
-# =====================================================
-# LOAD EXISTING SPLITS (DO NOT REBUILD)
-# =====================================================
-if all(os.path.exists(f) for f in [train_file, val_file, test_file]):
-    print("[INFO] Existing splits found. Loading (LOCKED).")
-
-    with open(train_file) as f:
-        train = [l.strip() for l in f if l.strip()]
-    with open(val_file) as f:
-        val = [l.strip() for l in f if l.strip()]
-    with open(test_file) as f:
-        test = [l.strip() for l in f if l.strip()]
-
-else:
-    # ---------------- LOAD IDENTITIES ----------------
-    ids = sorted([
-        d for d in os.listdir(CELEBA_DIR)
-        if os.path.isdir(os.path.join(CELEBA_DIR, d))
-    ])
-
-    print(f"[INFO] Total identities found: {len(ids)}")
-
-    if len(ids) == 0:
-        raise RuntimeError("No identities found in celeba_identities!")
-
-    # ---------------- SHUFFLE (ONCE ONLY) ----------------
-    random.seed(RANDOM_SEED)
-    random.shuffle(ids)
-
-    # ---------------- SPLIT ----------------
-    n = len(ids)
-    n_train = int(TRAIN_RATIO * n)
-    n_val   = int(VAL_RATIO * n)
-
-    train = ids[:n_train]
-    val   = ids[n_train:n_train + n_val]
-    test  = ids[n_train + n_val:]
-
-    # ---------------- SAVE SPLITS ----------------
-    with open(train_file, "w") as f:
-        f.write("\n".join(train))
-    with open(val_file, "w") as f:
-        f.write("\n".join(val))
-    with open(test_file, "w") as f:
-        f.write("\n".join(test))
-
-    print("[INFO] New identity splits created and LOCKED.")
-
-# ---------------- SANITY CHECK (MANDATORY) ----------------
-assert len(train) > 0, "Train split empty!"
-assert len(val) > 0, "Validation split empty!"
-assert len(test) > 0, "Test split empty!"
-
-assert len(set(train) & set(val)) == 0, "Train/Val identity leakage!"
-assert len(set(train) & set(test)) == 0, "Train/Test identity leakage!"
-assert len(set(val) & set(test)) == 0, "Val/Test identity leakage!"
-
-# ---------------- SUMMARY ----------------
-print("\nSplit summary (IDENTITY-DISJOINT):")
-print(f"  Train: {len(train)} identities")
-print(f"  Val  : {len(val)} identities")
-print(f"  Test : {len(test)} identities")
-
-print("\nSplits are fixed, reproducible, and reviewer-safe.")
+assert abs(TRAIN_RATIO + VAL_RATIO + TEST_RATIO - 1.0) < 1e-6
+
+
+def read_ids(path):
+    with open(path) as f:
+        return [l.strip() for l in f if l.strip()]
+
+
+# ---------------- SPLIT ----------------
+def split_identities(celeba_dir=CELEBA_DIR, splits_dir=SPLITS_DIR,
+                     seed=RANDOM_SEED, verbose=True):
+    """Return ``{"train", "val", "test"}`` identity lists, loading the
+    locked split files from ``splits_dir`` or creating them once."""
+    log = print if verbose else (lambda *a, **k: None)
+    os.makedirs(splits_dir, exist_ok=True)
+
+    train_file = os.path.join(splits_dir, "train_ids.txt")
+    val_file   = os.path.join(splits_dir, "val_ids.txt")
+    test_file  = os.path.join(splits_dir, "test_ids.txt")
+    files = [train_file, val_file, test_file]
+    index = load_index(celeba_dir)
+
+    # =====================================================
+    # LOAD EXISTING SPLITS (DO NOT REBUILD)
+    # =====================================================
+    if all(os.path.exists(f) for f in files):
+        log("[INFO] Existing splits found. Loading (LOCKED).")
+
+        if index is not None and index.has_source("splits", train_file):
+            train, val, test = (
+                index.split_ids(name) for name in ("train", "val", "test")
+            )
+        else:
+            train = read_ids(train_file)
+            val = read_ids(val_file)
+            test = read_ids(test_file)
+
+    else:
+        # ---------------- LOAD IDENTITIES ----------------
+        # From the metadata index when one matches the build, else a scan.
+        if index is not None:
+            ids = index.identities.tolist()
+        else:
+            ids = sorted([
+                d for d in os.listdir(celeba_dir)
+                if os.path.isdir(os.path.join(celeba_dir, d))
+            ])
+
+        log(f"[INFO] Total identities found: {len(ids)}")
+
+        if len(ids) == 0:
+            raise RuntimeError("No identities found in celeba_identities!")
+
+        # ---------------- SHUFFLE (ONCE ONLY) ----------------
+        random.Random(seed).shuffle(ids)
+
+        # ---------------- SPLIT ----------------
+        n = len(ids)
+        n_train = int(TRAIN_RATIO * n)
+        n_val   = int(VAL_RATIO * n)
+
+        train = ids[:n_train]
+        val   = ids[n_train:n_train + n_val]
+        test  = ids[n_train + n_val:]
+
+        # ---------------- SAVE SPLITS ----------------
+        with open(train_file, "w") as f:
+            f.write("\n".join(train))
+        with open(val_file, "w") as f:
+            f.write("\n".join(val))
+        with open(test_file, "w") as f:
+            f.write("\n".join(test))
+
+        log("[INFO] New identity splits created and LOCKED.")
+
+    # ---------------- SANITY CHECK (MANDATORY) ----------------
+    assert len(train) > 0, "Train split empty!"
+    assert len(val) > 0, "Validation split empty!"
+    assert len(test) > 0, "Test split empty!"
+
+    assert len(set(train) & set(val)) == 0, "Train/Val identity leakage!"
+    assert len(set(train) & set(test)) == 0, "Train/Test identity leakage!"
+    assert len(set(val) & set(test)) == 0, "Val/Test identity leakage!"
+
+    # ---------------- RECORD IN METADATA INDEX ----------------
+    if index is not None and not index.has_source("splits", train_file):
+        known = index.identity_set
+        if all(i in known for i in train + val + test):
+            index.set_splits({"train": train, "val": val, "test": test}, files)
+            index.save(index_path(celeba_dir))
+
+    # ---------------- SUMMARY ----------------
+    log("\nSplit summary (IDENTITY-DISJOINT):")
+    log(f"  Train: {len(train)} identities")
+    log(f"  Val  : {len(val)} identities")
+    log(f"  Test : {len(test)} identities")
+
+    return {"train": train, "val": val, "test": test}
+
+
+def main():
+    split_identities()
+    print("\nSplits are fixed, reproducible, and reviewer-safe.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from streaming_eval import StreamingROC
+
+# ================= CONFIG =================
+PLOT_WORKERS = 2                   # background rendering processes
+OVERLAY_FILE = "multiseed_roc.pdf"
+FPR_GRID = 201                     # common FPR points for the mean curve
+# =========================================
+
+
+# ---------------- RENDERING ----------------
+def render_run(output_dir, mode=None, histograms=False):
+    """Both figures of one detection run, from the roc_state.npz /
+    scores.npz it saved (``histograms``: streaming run, no score arrays)."""
+    from embedding_detection import replot
+    return replot(output_dir, mode=mode, histograms=histograms)
+
+
+def render_overlay(run_dirs, output_path, mode=None, grid=FPR_GRID):
+    """One figure for several runs (seeds): every run's ROC curve, their
+    mean on a common FPR grid and a mean ± std band."""
+    import matplotlib.pyplot as plt
+    from embedding_detection import ROC_STATE_FILE
+
+    fpr_grid = np.linspace(0, 1, grid)
+    curves, aucs = [], []
+
+    plt.figure(figsize=(6, 6), dpi=300)
+    for run_dir in run_dirs:
+        ev = StreamingROC.load(os.path.join(run_dir, ROC_STATE_FILE))
+        fpr, tpr, _ = ev.roc_curve()
+        curves.append(np.interp(fpr_grid, fpr, tpr))
+        aucs.append(ev.auc())
+        plt.plot(fpr, tpr, color="0.6", linewidth=0.8, alpha=0.6)
+
+    curves, aucs = np.array(curves), np.array(aucs)
+    mean, std = curves.mean(axis=0), curves.std(axis=0)
+    plt.fill_between(
+        fpr_grid, np.clip(mean - std, 0, 1), np.clip(mean + std, 0, 1),
+        color="C0", alpha=0.25, label="± 1 std"
+    )
+    plt.plot(
+        fpr_grid, mean, color="C0", linewidth=2,
+        label=f"Mean (AUC = {aucs.mean():.3f} ± {aucs.std():.3f})"
+    )
+    plt.plot([0, 1], [0, 1], "k--", linewidth=1)
+    plt.xlabel("False Positive Rate")
+    plt.ylabel("True Positive Rate")
+    title = f"ROC over {len(run_dirs)} runs"
+    plt.title(f"{title} ({mode} score)" if mode else title)
+    plt.legend(loc="lower right")
+    plt.grid(True)
+
+    plt.savefig(output_path, bbox_inches="tight")
+    plt.close()
+    return output_path
+
+
+# ---------------- BACKGROUND POOL ----------------
+class ReportPool:
+    """Renders figures in background processes so scoring never waits on
+    matplotlib. Jobs read only what the runs saved to disk; ``wait``
+    collects every result (and re-raises the first rendering error).
+
+    Processes are spawned, not forked, so they do not inherit the
+    parent's torch threads, and are only started on the first submit.
+    """
+
+    def __init__(self, workers=PLOT_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._pending = []
+
+    def _submit(self, fn, *args, **kwargs):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        future = self._pool.submit(fn, *args, **kwargs)
+        self._pending.append(future)
+        return future
+
+    def submit_run(self, output_dir, mode=None, histograms=False):
+        return self._submit(
+            render_run, output_dir, mode=mode, histograms=histograms
+        )
+
+    def submit_overlay(self, run_dirs, output_path, mode=None):
+        return self._submit(render_overlay, run_dirs, output_path, mode=mode)
+
+    def wait(self):
+        pending, self._pending = self._pending, []
+        try:
+            return [f.result() for f in pending]
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render detection figures from saved run outputs"
+    )
+    parser.add_argument(
+        "run_dirs",
+        nargs="+",
+        help="--output-dir of embedding_detection.py runs (e.g. seed_<n>)"
+    )
+    parser.add_argument(
+        "--overlay",
+        default=None,
+        help=f"Also write a combined ROC of all runs to this path "
+             f"(e.g. results/{OVERLAY_FILE})"
+    )
+    parser.add_argument(
+        "--overlay-only",
+        action="store_true",
+        help="Skip the per-run figures"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PLOT_WORKERS,
+        help="Rendering processes"
+    )
+    args = parser.parse_args()
+
+    with ReportPool(args.workers) as pool:
+        if not args.overlay_only:
+            for run_dir in args.run_dirs:
+                pool.submit_run(run_dir)
+        if args.overlay:
+            pool.submit_overlay(args.run_dirs, args.overlay)
+        for out in pool.wait():
+            for path in (out.values() if isinstance(out, dict) else [out]):
+                print(f"[INFO] Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,95 +1,602 @@
-import subprocess
+import os
 import json
+import time
+import shutil
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import re
-import os
-
-# ================= CONFIG =================
-PYTHON_EXE = "python"
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ATTACK_SCRIPT = os.path.join(BASE_DIR, "generate_multiface_attack.py")
-DETECT_SCRIPT = os.path.join(BASE_DIR, "embedding_detection.py")
+import embedding_detection
+from embedding_engine import embed_images
+from score_ledger import sample_key
+from generate_multiface_attack import generate_attacks, save_outputs
+from streaming_eval import StreamingROC
+from render_reports import ReportPool, OVERLAY_FILE, PLOT_WORKERS
+from profiling import aggregate, format_report, save_report, PROFILE_FILE
 
+# ================= CONFIG =================
 SEEDS = [0, 1, 2, 3, 4]
-OUTPUT_JSON = os.path.join("results", "multiseed_results.json")
+RESULTS_DIR = "results"
+OUTPUT_JSON = os.path.join(RESULTS_DIR, "multiseed_results.json")
+POOLED_JSON = "multiseed_pooled.json"
+PROFILE_JSON = "multiseed_profile.json"
+WARM_CHUNK = 4096          # images per embedding call when warming
+SEGMENT_DIR = "segments"   # per-worker cache/ledger segments while warming
 # =========================================
 
-os.makedirs("results", exist_ok=True)
+# ---------------- WORKER STATE ----------------
+# Populated once per process by init_worker() and reused for every seed the
+# process runs. The model is loaded by the first seed with an image to
+# embed (embed_images' model_fn), then kept for the process's later seeds.
+_worker = {}
 
-results = []
 
-print("===== MULTI-SEED EXPERIMENTS START =====")
+def init_worker(options):
+    _worker.update(options)
 
-for seed in SEEDS:
-    print(f"\n>>> Running experiment with seed = {seed}")
+    if options["threads"]:
+        import torch
+        torch.set_num_threads(options["threads"])
 
-    # ---------------- STEP 1: Generate attacks ----------------
-    print("[1/2] Generating multi-face registration attacks...")
-    subprocess.run(
-        [PYTHON_EXE, ATTACK_SCRIPT, "--seed", str(seed)],
-        check=True
+
+def store_kwargs():
+    return {
+        "name": _worker["backbone"],
+        "random_weights": _worker["random_weights"]
+    }
+
+
+def open_stores():
+    # Several processes share one cache directory: only a lone process may
+    # write to it. Opened on the first seed, so parallel workers see what
+    # warm_shared_state merged.
+    _worker["stores_open"] = True
+    if _worker["from_index"]:
+        return
+    readonly = _worker["jobs"] > 1
+    if not _worker["no_cache"]:
+        _worker["cache"] = embedding_detection.open_cache(
+            _worker["cache_dir"], readonly=readonly, **store_kwargs()
+        )
+    if not _worker["no_ledger"]:
+        _worker["ledger"] = embedding_detection.open_ledger(
+            _worker["ledger_dir"], readonly=readonly, **store_kwargs()
+        )
+
+
+# ---------------- WARM-UP ----------------
+def prepare_seed(seed):
+    """Generate and save ``seed``'s attacks; returns them for run_seed,
+    plus the seed's registrations, their image hashes and ``sample_key``s
+    for warm_shared_state."""
+    start = time.perf_counter()
+    attack_meta, manifest = generate_attacks(seed, verbose=False)
+    attack_seconds = time.perf_counter() - start
+    save_outputs(run_dir(_worker["results_dir"], seed), attack_meta, manifest)
+
+    samples = hashes = keys = None
+    if not _worker["from_index"]:
+        samples = embedding_detection.build_samples(manifest)
+        hashes = embedding_detection.sample_hashes(
+            samples, num_workers=_worker["num_workers"]
+        )
+        keys = [sample_key(h) for h in hashes]
+    return {
+        "seed": seed,
+        "attack_meta": attack_meta,
+        "manifest": manifest,
+        "attack_seconds": attack_seconds,
+        "samples": samples,
+        "hashes": hashes,
+        "keys": keys
+    }
+
+
+def segment_dir(shard):
+    root = _worker["cache_dir"]
+    if _worker["no_cache"]:
+        root = _worker["ledger_dir"]
+    return os.path.join(root, SEGMENT_DIR, f"shard_{shard}")
+
+
+def warm_embed(shard, paths, hashes):
+    """Embed one shard of the sweep's images into a private cache
+    segment. The segment reads through to the shared cache, so images
+    already there are not embedded again."""
+    root = segment_dir(shard)
+    shutil.rmtree(root, ignore_errors=True)
+    cache = embedding_detection.open_cache(
+        os.path.join(root, "cache"),
+        base=embedding_detection.open_cache(
+            _worker["cache_dir"], readonly=True, **store_kwargs()
+        ),
+        **store_kwargs()
     )
+    computed = 0
+    for i in range(0, len(paths), WARM_CHUNK):
+        _, _, stats = embed_images(
+            None, None, paths[i:i + WARM_CHUNK],
+            batch_size=_worker["batch_size"],
+            num_workers=_worker["num_workers"],
+            cache=cache,
+            hashes=hashes[i:i + WARM_CHUNK],
+            model_fn=lambda: embedding_detection.load_model(
+                _worker["backbone"], _worker["random_weights"]
+            ),
+            loader=_worker["loader"],
+            flush=False
+        )
+        computed += stats["computed"]
+    cache.flush()
+    return {"root": root, "computed": computed}
 
-    # Load attack metadata
-    meta_path = os.path.join(
-        "data_processed", "attack_dataset", "attack_metadata.json"
+
+def warm_score(shard, samples, hashes, keys):
+    """Score one shard of the sweep's registrations into a private ledger
+    segment, from the (already warmed) shared cache when there is one."""
+    root = segment_dir(shard)
+    shutil.rmtree(root, ignore_errors=True)
+    cache = None
+    if not _worker["no_cache"]:
+        cache = embedding_detection.open_cache(
+            _worker["cache_dir"], readonly=True, **store_kwargs()
+        )
+    ledger = embedding_detection.open_ledger(
+        os.path.join(root, "ledger"), **store_kwargs()
+    )
+    _, stats = embedding_detection.ledger_scores(
+        samples, _worker["batch_size"], _worker["num_workers"], cache,
+        ledger=ledger, loader=_worker["loader"], keys=keys, hashes=hashes,
+        **store_kwargs()
     )
-    with open(meta_path) as f:
-        attack_meta = json.load(f)
+    return {"root": root, "computed": stats["computed"]}
+
+
+def drop_segment(root):
+    shutil.rmtree(root, ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(root))     # SEGMENT_DIR once empty
+    except OSError:
+        pass
+
+
+def _shards(items, n):
+    return [items[i::n] for i in range(n) if items[i::n]]
+
+
+def warm_shared_state(pool, options, prepared):
+    """Fill the shared embedding cache and score ledger for every seed
+    before detection fans out: parallel workers open both read-only, so
+    without this a cold sweep re-embeds shared images once per seed and
+    stores nothing.
+
+    Registrations are deduplicated by ``sample_key`` (and skipped when
+    already in the ledger). Their distinct images are split across the
+    pool and embedded into private cache segments; once those are merged
+    here by the single writer, the registrations are split across the
+    pool again and scored into private ledger segments from the shared
+    cache."""
+    if options["no_cache"] and options["no_ledger"]:
+        return None
+    start = time.perf_counter()
+    kwargs = {
+        "name": options["backbone"],
+        "random_weights": options["random_weights"]
+    }
+    jobs = options["jobs"]
+
+    ledger = None
+    if not options["no_ledger"]:
+        ledger = embedding_detection.open_ledger(
+            options["ledger_dir"], **kwargs
+        )
+    samples, hashes, keys, seen = [], [], [], set()
+    for p in prepared:
+        for sample, h, key in zip(
+            p.pop("samples"), p.pop("hashes"), p.pop("keys")
+        ):
+            if key in seen or (ledger is not None and key in ledger):
+                continue
+            seen.add(key)
+            samples.append(sample)
+            hashes.append(h)
+            keys.append(key)
+
+    computed = 0
+    if not options["no_cache"]:
+        path_hash = {
+            p: h
+            for (_, imgs), hs in zip(samples, hashes)
+            for p, h in zip(imgs, hs)
+        }
+        paths = sorted(path_hash)
+        shards = _shards(paths, jobs)
+        segments = list(pool.map(
+            warm_embed, range(len(shards)), shards,
+            [[path_hash[p] for p in shard] for shard in shards]
+        ))
+        cache = embedding_detection.open_cache(options["cache_dir"], **kwargs)
+        for seg in segments:
+            cache.merge(embedding_detection.open_cache(
+                os.path.join(seg["root"], "cache"), readonly=True, **kwargs
+            ))
+            computed += seg["computed"]
+            drop_segment(seg["root"])
+        cache.flush()
+
+    if ledger is not None:
+        order = _shards(list(range(len(samples))), jobs)
+        segments = list(pool.map(
+            warm_score, range(len(order)),
+            [[samples[i] for i in rows] for rows in order],
+            [[hashes[i] for i in rows] for rows in order],
+            [[keys[i] for i in rows] for rows in order]
+        ))
+        for seg in segments:
+            ledger.merge(embedding_detection.open_ledger(
+                os.path.join(seg["root"], "ledger"), readonly=True, **kwargs
+            ))
+            computed += seg["computed"]
+            drop_segment(seg["root"])
+        ledger.flush()
+
+    return {
+        "identities": len(samples),
+        "computed": computed,
+        "seconds": time.perf_counter() - start
+    }
+
+
+# ---------------- SEED ----------------
+def run_seed(seed, prepared=None):
+    # Seeds generated by prepare_seed count their generation time too.
+    start = time.perf_counter() - (prepared or {}).get("attack_seconds", 0)
+    if not _worker.get("stores_open"):
+        open_stores()
+
+    # ---------------- STEP 1: Generate attacks ----------------
+    if prepared is None:
+        prepared = prepare_seed(seed)
+    attack_meta = prepared["attack_meta"]
+    manifest = prepared["manifest"]
+    attack_seconds = prepared["attack_seconds"]
+    seed_dir = run_dir(_worker["results_dir"], seed)
 
     num_attack_ids = sum(
         1 for c in attack_meta["clients"] if c["type"] == "attack"
     )
 
     # ---------------- STEP 2: Run detection ----------------
-    print("[2/2] Running embedding-based detection...")
-    proc = subprocess.run(
-        [PYTHON_EXE, DETECT_SCRIPT],
-        capture_output=True,
-        text=True,
-        check=True
-    )
-
-    stdout = proc.stdout
-    print(stdout)
-
-    # ---------------- PARSE METRICS ----------------
-    roc_auc = None
-    tpr_1 = None
-    tpr_01 = None
-
-    for line in stdout.splitlines():
-        if "ROC-AUC" in line:
-            roc_auc = float(re.search(r"([0-9]*\.[0-9]+)", line).group(1))
-        elif "TPR @ FPR = 1%" in line:
-            tpr_1 = float(re.search(r"([0-9]*\.[0-9]+)", line).group(1))
-        elif "TPR @ FPR = 0.1%" in line:
-            tpr_01 = float(re.search(r"([0-9]*\.[0-9]+)", line).group(1))
-
-    if roc_auc is None or tpr_1 is None:
-        raise RuntimeError(f"Failed to parse metrics for seed {seed}")
-
-    results.append({
+    metrics = embedding_detection.run_detection(
+        manifest=manifest,
+        from_index=_worker["from_index"],
+        corpus_dir=_worker["corpus_dir"],
+        batch_size=_worker["batch_size"],
+        num_workers=_worker["num_workers"],
+        cache=_worker.get("cache"),
+        ledger=_worker.get("ledger"),
+        loader=_worker["loader"],
+        score_mode=_worker["score_mode"],
+        n_boot=_worker["n_boot"],
+        name=_worker["backbone"],
+        random_weights=_worker["random_weights"],
+        output_dir=seed_dir,
+        plots=False,        # rendered by the parent's ReportPool
+        verbose=False
+    )
+
+    # Attack generation ran before run_detection reset the profiler.
+    profile = metrics["profile"]
+    profile["stages"]["generate_attacks"] = {
+        "seconds": attack_seconds, "calls": 1
+    }
+    profile["wall_seconds"] += attack_seconds
+    save_report(os.path.join(seed_dir, PROFILE_FILE), profile)
+
+    embedding = metrics.get("embedding", {})
+    return {
         "seed": seed,
+        "backbone": metrics["backbone"],
         "num_attack_identities": num_attack_ids,
-        "roc_auc": roc_auc,
-        "tpr_1pct": tpr_1,
-        "tpr_0.1pct": tpr_01
-    })
-
-# ---------------- SAVE RESULTS ----------------
-with open(OUTPUT_JSON, "w") as f:
-    json.dump(results, f, indent=2)
-
-# ---------------- SUMMARY ----------------
-roc_vals = np.array([r["roc_auc"] for r in results])
-tpr1_vals = np.array([r["tpr_1pct"] for r in results])
-
-print("\n===== MULTI-SEED SUMMARY =====")
-print(f"Seeds           : {SEEDS}")
-print(f"ROC-AUC         : {roc_vals.mean():.3f} ± {roc_vals.std():.3f}")
-print(f"TPR @ 1% FPR    : {tpr1_vals.mean():.3f} ± {tpr1_vals.std():.3f}")
-print(f"Saved results → {OUTPUT_JSON}")
-
-print("\n===== MULTI-SEED EXPERIMENTS COMPLETE =====")
\ No newline at end of file
+        "roc_auc": metrics["roc_auc"],
+        "tpr_1pct": metrics["tpr_1pct"],
+        "tpr_0.1pct": metrics["tpr_0.1pct"],
+        "roc_auc_ci95": metrics["roc_auc_ci95"],
+        "score_mode": metrics["score_mode"],
+        "ablation": metrics["ablation"],
+        "num_samples": metrics["num_samples"],
+        "images_per_sec": embedding.get("images_per_sec"),
+        "ms_per_identity": embedding.get("ms_per_identity"),
+        "loader_stall_seconds": embedding.get("loader", {}).get(
+            "stall_seconds"
+        ),
+        "seconds": time.perf_counter() - start,
+        "pid": os.getpid(),
+        "profile": profile
+    }
+
+
+# ---------------- AGGREGATION ----------------
+def run_dir(results_dir, seed):
+    return os.path.join(results_dir, f"seed_{seed}")
+
+
+def seed_state_path(results_dir, seed):
+    return os.path.join(
+        run_dir(results_dir, seed), embedding_detection.ROC_STATE_FILE
+    )
+
+
+def results_from_states(results_dir, seeds, backbone,
+                        n_boot=embedding_detection.N_BOOTSTRAP):
+    # Re-evaluate saved per-seed histograms without re-running detection.
+    results = []
+    for seed in seeds:
+        ev = StreamingROC.load(seed_state_path(results_dir, seed))
+        r = {"seed": seed, "backbone": backbone}
+        r.update(embedding_detection.summarize(ev, n_boot=n_boot))
+        r["num_samples"] = ev.num_pos + ev.num_neg
+        results.append(r)
+    return results
+
+
+def pooled_metrics(results_dir, seeds, backbone,
+                   n_boot=embedding_detection.N_BOOTSTRAP):
+    pooled = None
+    for seed in seeds:
+        ev = StreamingROC.load(seed_state_path(results_dir, seed))
+        pooled = ev if pooled is None else pooled.merge(ev)
+    metrics = {"seeds": list(seeds), "backbone": backbone}
+    metrics.update(embedding_detection.summarize(pooled, n_boot=n_boot))
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run attack generation + detection over several seeds"
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=SEEDS,
+        help="Seeds to run"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Seeds run concurrently (one process each)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="torch threads per process (default: cores / jobs)"
+    )
+    parser.add_argument(
+        "--backbone",
+        choices=sorted(embedding_detection.BACKBONES),
+        default=embedding_detection.DEFAULT_BACKBONE
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=embedding_detection.DEFAULT_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=0,
+        help="DataLoader workers / decode threads inside each seed process"
+    )
+    parser.add_argument(
+        "--loader",
+        choices=embedding_detection.LOADERS,
+        default=embedding_detection.DEFAULT_LOADER
+    )
+    parser.add_argument(
+        "--score-mode",
+        choices=sorted(embedding_detection.SCORERS),
+        default=embedding_detection.SCORE_MODE
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=embedding_detection.CACHE_DIR
+    )
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--ledger-dir",
+        default=embedding_detection.LEDGER_DIR
+    )
+    parser.add_argument(
+        "--no-ledger",
+        action="store_true",
+        help="Rescore every identity of every seed"
+    )
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="Seeded random init instead of pretrained weights (offline "
+             "runs and CI; scores are meaningless)"
+    )
+    parser.add_argument(
+        "--from-index",
+        action="store_true",
+        help="Score from embed_corpus.py output (no model in workers)"
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        default=embedding_detection.CORPUS_DIR
+    )
+    parser.add_argument("--output", default=OUTPUT_JSON)
+    parser.add_argument(
+        "--no-plots",
+        action="store_true",
+        help="Skip per-seed figures and the combined ROC (metrics only)"
+    )
+    parser.add_argument(
+        "--plot-workers",
+        type=int,
+        default=PLOT_WORKERS,
+        help="Background processes rendering figures while seeds run"
+    )
+    parser.add_argument(
+        "--n-boot",
+        type=int,
+        default=embedding_detection.N_BOOTSTRAP,
+        help="Bootstrap resamples for the per-seed and pooled 95%% CIs "
+             "(0: skip them)"
+    )
+    parser.add_argument(
+        "--from-results",
+        action="store_true",
+        help="Recompute metrics from saved seed_<n>/roc_state.npz only"
+    )
+    args = parser.parse_args()
+    if args.n_boot < 0:
+        parser.error("--n-boot must be >= 0")
+    if args.random_weights and \
+            not embedding_detection.random_init_supported(args.backbone):
+        parser.error(f"--random-weights is not supported for {args.backbone}")
+
+    jobs = max(1, min(args.jobs, len(args.seeds)))
+    options = {
+        "jobs": jobs,
+        "threads": args.threads or max(1, (os.cpu_count() or 1) // jobs),
+        "backbone": args.backbone,
+        "batch_size": args.batch_size,
+        "num_workers": args.num_workers,
+        "loader": args.loader,
+        "score_mode": args.score_mode,
+        "n_boot": args.n_boot,
+        "cache_dir": args.cache_dir,
+        "no_cache": args.no_cache,
+        "ledger_dir": args.ledger_dir,
+        "no_ledger": args.no_ledger,
+        "random_weights": args.random_weights,
+        "from_index": args.from_index,
+        "corpus_dir": args.corpus_dir,
+        "results_dir": os.path.dirname(os.path.abspath(args.output))
+    }
+
+    os.makedirs(options["results_dir"], exist_ok=True)
+
+    print("===== MULTI-SEED EXPERIMENTS START =====")
+    print(f"Seeds : {args.seeds}")
+    print(f"Jobs  : {jobs} (torch threads/job: {options['threads']})")
+
+    start = time.perf_counter()
+
+    # Figures are drawn from each seed's saved scores in background
+    # processes as soon as the seed finishes; seed workers never plot.
+    reports = None if args.no_plots else ReportPool(args.plot_workers)
+
+    def seed_done(result):
+        if reports is not None:
+            reports.submit_run(
+                run_dir(options["results_dir"], result["seed"]),
+                result["score_mode"]
+            )
+        return result
+
+    if args.from_results:
+        results = results_from_states(
+            options["results_dir"], args.seeds, args.backbone, args.n_boot
+        )
+    elif jobs == 1:
+        init_worker(options)
+        results = []
+        for seed in args.seeds:
+            print(f"\n>>> Running experiment with seed = {seed}")
+            results.append(seed_done(run_seed(seed)))
+            print(f"    ROC-AUC = {results[-1]['roc_auc']:.4f}")
+    else:
+        # Spawned, not forked, so workers never inherit the parent's torch
+        # thread pools. The same workers generate every seed's attacks,
+        # warm the shared stores, then run detection.
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(options,)
+        ) as pool:
+            prepared = list(pool.map(prepare_seed, args.seeds))
+            if not options["from_index"]:
+                warm = warm_shared_state(pool, options, prepared)
+                if warm is not None:
+                    print(
+                        f"[INFO] Warmed shared state: {warm['identities']} "
+                        f"new registrations, {warm['computed']} images "
+                        f"embedded ({warm['seconds']:.1f}s)"
+                    )
+            results = [
+                seed_done(r)
+                for r in pool.map(run_seed, args.seeds, prepared)
+            ]
+        for r in results:
+            print(
+                f">>> seed {r['seed']}: ROC-AUC = {r['roc_auc']:.4f} "
+                f"({r['seconds']:.1f}s, pid {r['pid']})"
+            )
+
+    wall = time.perf_counter() - start
+
+    # ---------------- PROFILE ----------------
+    profiles = [r.pop("profile") for r in results if "profile" in r]
+    profile_path = None
+    if profiles:
+        profile = aggregate(profiles)
+        profile_path = save_report(
+            os.path.join(options["results_dir"], PROFILE_JSON), profile
+        )
+
+    # ---------------- SAVE RESULTS ----------------
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    pooled = pooled_metrics(
+        options["results_dir"], args.seeds, args.backbone, args.n_boot
+    )
+    pooled_path = os.path.join(options["results_dir"], POOLED_JSON)
+    with open(pooled_path, "w") as f:
+        json.dump(pooled, f, indent=2)
+
+    overlay_path = None
+    if reports is not None:
+        overlay_path = os.path.join(options["results_dir"], OVERLAY_FILE)
+        reports.submit_overlay(
+            [run_dir(options["results_dir"], s) for s in args.seeds],
+            overlay_path,
+            mode=None if args.from_results else args.score_mode
+        )
+
+    # ---------------- SUMMARY ----------------
+    roc_vals = np.array([r["roc_auc"] for r in results])
+    tpr1_vals = np.array([r["tpr_1pct"] for r in results])
+    ci = pooled["roc_auc_ci95"]
+    ci = f" [{ci[0]:.3f}, {ci[1]:.3f}]" if ci is not None else ""
+
+    print("\n===== MULTI-SEED SUMMARY =====")
+    print(f"Seeds           : {args.seeds}")
+    print(f"Backbone        : {args.backbone}")
+    print(f"ROC-AUC         : {roc_vals.mean():.3f} ± {roc_vals.std():.3f}")
+    print(f"TPR @ 1% FPR    : {tpr1_vals.mean():.3f} ± {tpr1_vals.std():.3f}")
+    print(f"Pooled ROC-AUC  : {pooled['roc_auc']:.3f}{ci}")
+    print(f"Wall time       : {wall:.1f}s")
+    print(f"Saved results → {args.output}")
+    print(f"Pooled metrics → {pooled_path}")
+    if reports is not None:
+        reports.wait()
+        print(f"Combined ROC → {overlay_path}")
+    if profile_path:
+        print("\n----- PROFILE (summed over seeds) -----")
+        print(format_report(profile))
+        print(f"Profile → {profile_path}")
+
+    print("\n===== MULTI-SEED EXPERIMENTS COMPLETE =====")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+
+# ================= CONFIG =================
+LEDGER_FILE = "ledger.json"
+# =========================================
+
+
+# ---------------- KEYS ----------------
+def sample_key(hashes):
+    """Key of one registration folder from the content hashes of its
+    images (``embedding_engine.image_hashes``, the same keys as the
+    embedding cache; ``None`` for an unreadable image). Order-insensitive:
+    re-materialized copies and renamed files keep the key; an added,
+    removed or replaced image changes it, even at the same size."""
+    items = sorted(h or "unreadable" for h in hashes)
+    h = hashlib.blake2b(digest_size=16)
+    for item in items:
+        h.update(item.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+# ---------------- LEDGER ----------------
+class ScoreLedger:
+    """Per-identity anomaly scores from earlier runs.
+
+    One JSON file per fingerprint (model, transform, scorer set and image
+    source, see ``embedding_detection.open_ledger``) maps
+    ``sample_key`` -> ``{scorer: score}``; ``None`` records identities with
+    fewer than two readable images so they are not re-embedded either. Like
+    ``EmbeddingCache`` it assumes a single writer: call ``flush()`` to
+    persist, and open it ``readonly=True`` from concurrent processes.
+    """
+
+    def __init__(self, ledger_dir, fingerprint, readonly=False):
+        self.dir = os.path.join(ledger_dir, fingerprint)
+        self.fingerprint = fingerprint
+        self.readonly = readonly
+        self.path = os.path.join(self.dir, LEDGER_FILE)
+        self.scores = {}
+        self.dirty = False
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("fingerprint") == fingerprint:
+                self.scores = data["scores"]
+
+    def __contains__(self, key):
+        return key in self.scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def get(self, key):
+        return self.scores.get(key)
+
+    def put_many(self, keys, scores):
+        if self.readonly:
+            return
+        for key, score in zip(keys, scores):
+            self.scores[key] = None if score is None else {
+                name: float(v) for name, v in score.items()
+            }
+        self.dirty = True
+
+    def merge(self, other):
+        """Take every score of ``other`` (a worker's segment)."""
+        if self.readonly or not other.scores:
+            return
+        self.scores.update(other.scores)
+        self.dirty = True
+
+    def flush(self):
+        if self.readonly or not self.dirty:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "scores": self.scores}, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
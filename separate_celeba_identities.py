@@ -1,11 +1,20 @@
 import os
 import shutil
+import hashlib
+import argparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import json
-import sys
+
+from metadata_index import (
+    MetadataIndex, index_path, load_index, parse_identity_file,
+    group_identities, stamps
+)
 
 # ================= CONFIG =================
-PROJECT_ROOT = r"D:\Face recogination project"
+PROJECT_ROOT = os.environ.get(
+    "FACE_PROJECT_ROOT", r"D:\Face recogination project"
+)
 CELEBA_ROOT = os.path.join(PROJECT_ROOT, "Celeba")
 
 IMAGE_DIR = os.path.join(
@@ -18,90 +27,265 @@ IDENTITY_FILE = os.path.join(CELEBA_ROOT, "identity_CelebA.txt")
 
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "data_processed", "celeba_identities")
 META_FILE = os.path.join(OUTPUT_DIR, "preprocess_meta.json")
+STATE_FILE = os.path.join(OUTPUT_DIR, "preprocess_state.json")
 
 MIN_IMAGES_PER_ID = 5
 # =========================================
 
-# --------------------------------------------------
-# DO NOT REBUILD IF ALREADY EXISTS (REPRODUCIBILITY)
-# --------------------------------------------------
-if os.path.exists(META_FILE):
-    print("[INFO] celeba_identities already built. Skipping rebuild.")
-    with open(META_FILE) as f:
-        meta = json.load(f)
-    print(f"[INFO] Loaded metadata: {meta}")
-    sys.exit(0)
-
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# ---------------- READ IDENTITY MAPPING ----------------
-id_map = defaultdict(list)
-
-with open(IDENTITY_FILE, "r") as f:
-    for line in f:
-        img, pid = line.strip().split()
-        id_map[pid].append(img)
-
-print(f"[INFO] Total identities in mapping file: {len(id_map)}")
-print(f"[INFO] Image source directory: {IMAGE_DIR}")
-
-if not os.path.isdir(IMAGE_DIR):
-    raise FileNotFoundError(
-        f"Image directory not found: {IMAGE_DIR}\n"
-        "Check CelebA extraction path."
-    )
 
-# ---------------- PROCESS IDENTITIES ----------------
-kept = 0
-dropped = 0
-total_images_copied = 0
+# ---------------- FILE PLACEMENT ----------------
+FICLONE = 0x40049409      # Linux ioctl: share extents (btrfs/xfs reflink)
+
+
+def reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
 
-for pid, images in id_map.items():
-    if len(images) < MIN_IMAGES_PER_ID:
-        dropped += 1
-        continue
+def place_file(src, dst, mode):
+    """Create ``dst`` from ``src``; ``auto`` tries reflink, then hardlink,
+    then falls back to a plain copy (e.g. across devices). Whole builds
+    resolve ``auto`` once with ``probe_link`` instead."""
+    if os.path.lexists(dst):
+        os.remove(dst)
 
-    person_id = f"id_{int(pid):06d}"
-    person_dir = os.path.join(OUTPUT_DIR, person_id)
+    if mode in ("auto", "reflink"):
+        try:
+            reflink(src, dst)
+            return "reflink"
+        except (ImportError, OSError):
+            if os.path.lexists(dst):
+                os.remove(dst)
+            if mode == "reflink":
+                raise
+    if mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            if mode == "hardlink":
+                raise
+    shutil.copy(src, dst)
+    return "copy"
+
+
+def probe_link(src, output_dir):
+    """The placement ``auto`` settles on for ``output_dir``: every identity
+    folder lives on the same filesystem, so one probe file stands in for
+    all of them instead of a failed reflink per image."""
+    probe = os.path.join(output_dir, f".link_probe_{os.getpid()}")
+    try:
+        return place_file(src, probe, "auto")
+    finally:
+        if os.path.lexists(probe):
+            os.remove(probe)
+
+
+def identity_signature(images):
+    h = hashlib.blake2b(digest_size=8)
+    for img in sorted(images):
+        h.update(img.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def build_identity(image_dir, person_dir, images, mode):
     os.makedirs(person_dir, exist_ok=True)
 
-    copied = 0
+    # Drop files from a previous build that are no longer mapped here.
+    wanted = set(images)
+    for f in os.listdir(person_dir):
+        if f not in wanted:
+            os.remove(os.path.join(person_dir, f))
+
+    used = defaultdict(int)
     for img in images:
-        src = os.path.join(IMAGE_DIR, img)
-        dst = os.path.join(person_dir, img)
-
-        if os.path.exists(src):
-            shutil.copy(src, dst)
-            copied += 1
-
-    # ---------------- SAFETY CHECK ----------------
-    if copied < MIN_IMAGES_PER_ID:
-        shutil.rmtree(person_dir)
-        dropped += 1
-        continue
-
-    kept += 1
-    total_images_copied += copied
-
-# ---------------- FINAL INTEGRITY CHECK ----------------
-assert kept > 0, "No identities were kept!"
-assert total_images_copied >= kept * MIN_IMAGES_PER_ID
-
-# ---------------- SAVE METADATA ----------------
-meta = {
-    "min_images_per_id": MIN_IMAGES_PER_ID,
-    "identities_total": len(id_map),
-    "identities_kept": kept,
-    "identities_dropped": dropped,
-    "total_images_copied": total_images_copied
-}
-
-with open(META_FILE, "w") as f:
-    json.dump(meta, f, indent=2)
-
-# ---------------- SUMMARY ----------------
-print("\nCelebA identity preprocessing COMPLETE.")
-print(f"Identities kept   : {kept}")
-print(f"Identities dropped: {dropped}")
-print(f"Images copied     : {total_images_copied}")
-print("Dataset is stable, logged, and reproducible.")
+        used[place_file(
+            os.path.join(image_dir, img),
+            os.path.join(person_dir, img),
+            mode
+        )] += 1
+    return used
+
+
+# ---------------- INDEX ----------------
+def write_index(identities, images, offsets, identity_file, state_file,
+                output_dir):
+    # Valid as long as the mapping file and the build state are unchanged.
+    index = MetadataIndex(
+        identities, images, offsets,
+        {"identities": stamps([identity_file, state_file])}
+    )
+    return index.save(index_path(output_dir))
+
+
+def read_mapping(identity_file, image_dir, min_images=MIN_IMAGES_PER_ID):
+    images, pids = parse_identity_file(identity_file)
+    return group_identities(
+        images, pids, set(os.listdir(image_dir)), min_images
+    )
+
+
+# ---------------- BUILD ----------------
+def separate_identities(image_dir=IMAGE_DIR, identity_file=IDENTITY_FILE,
+                        output_dir=OUTPUT_DIR, link="auto", workers=16,
+                        incremental=False, verbose=True):
+    """Build one folder per identity under ``output_dir`` and return the
+    preprocessing metadata. An existing build is reused unless
+    ``incremental`` is set."""
+    log = print if verbose else (lambda *a, **k: None)
+    meta_file = os.path.join(output_dir, os.path.basename(META_FILE))
+    state_file = os.path.join(output_dir, os.path.basename(STATE_FILE))
+
+    # --------------------------------------------------
+    # DO NOT REBUILD IF ALREADY EXISTS (REPRODUCIBILITY)
+    # --------------------------------------------------
+    if os.path.exists(meta_file) and not incremental:
+        log("[INFO] celeba_identities already built. Skipping rebuild.")
+        with open(meta_file) as f:
+            meta = json.load(f)
+        log(f"[INFO] Loaded metadata: {meta}")
+
+        if (load_index(output_dir) is None and os.path.exists(state_file)
+                and os.path.isdir(image_dir)):
+            write_index(
+                *read_mapping(identity_file, image_dir)[:3],
+                identity_file, state_file, output_dir
+            )
+            log(f"[INFO] Metadata index rebuilt: {index_path(output_dir)}")
+        return meta
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if not os.path.isdir(image_dir):
+        raise FileNotFoundError(
+            f"Image directory not found: {image_dir}\n"
+            "Check CelebA extraction path."
+        )
+
+    # ---------------- READ IDENTITY MAPPING (VECTORIZED) ----------------
+    # One listing of the image folder; identities are grouped in file
+    # order and those left with too few images are dropped.
+    identities, images, offsets, num_pids = read_mapping(
+        identity_file, image_dir
+    )
+    plan = {
+        pid: images[start:end].tolist()
+        for pid, start, end in zip(
+            identities.tolist(), offsets[:-1], offsets[1:]
+        )
+    }
+    dropped = num_pids - len(plan)
+
+    log(f"[INFO] Total identities in mapping file: {num_pids}")
+    log(f"[INFO] Image source directory: {image_dir}")
+
+    # ---------------- INCREMENTAL STATE ----------------
+    state = {}
+    if incremental and os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+
+    new_state = {pid: identity_signature(imgs) for pid, imgs in plan.items()}
+    todo = [
+        pid for pid in plan
+        if state.get(pid) != new_state[pid]
+        or not os.path.isdir(os.path.join(output_dir, pid))
+    ]
+    stale = [pid for pid in state if pid not in plan]
+
+    for pid in stale:
+        shutil.rmtree(os.path.join(output_dir, pid), ignore_errors=True)
+
+    log(f"[INFO] Identities to (re)build: {len(todo)} / {len(plan)}")
+    if stale:
+        log(f"[INFO] Removed stale identities: {len(stale)}")
+
+    # ---------------- PROCESS IDENTITIES ----------------
+    if link == "auto" and todo:
+        link = probe_link(
+            os.path.join(image_dir, plan[todo[0]][0]), output_dir
+        )
+        log(f"[INFO] File placement: {link}")
+
+    placed = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                build_identity,
+                image_dir, os.path.join(output_dir, pid), plan[pid], link
+            )
+            for pid in todo
+        ]
+        for fut in futures:
+            for how, n in fut.result().items():
+                placed[how] += n
+
+    kept = len(plan)
+    total_images_copied = sum(len(imgs) for imgs in plan.values())
+
+    # ---------------- FINAL INTEGRITY CHECK ----------------
+    assert kept > 0, "No identities were kept!"
+    assert total_images_copied >= kept * MIN_IMAGES_PER_ID
+
+    # ---------------- SAVE METADATA ----------------
+    meta = {
+        "min_images_per_id": MIN_IMAGES_PER_ID,
+        "identities_total": num_pids,
+        "identities_kept": kept,
+        "identities_dropped": dropped,
+        "total_images_copied": total_images_copied
+    }
+
+    with open(meta_file, "w") as f:
+        json.dump(meta, f, indent=2)
+
+    with open(state_file, "w") as f:
+        json.dump(new_state, f)
+
+    write_index(
+        identities, images, offsets, identity_file, state_file, output_dir
+    )
+
+    # ---------------- SUMMARY ----------------
+    log("\nCelebA identity preprocessing COMPLETE.")
+    log(f"Identities kept   : {kept}")
+    log(f"Identities dropped: {dropped}")
+    log(f"Images placed     : {total_images_copied}")
+    log(f"Placed this run   : {dict(placed)}")
+    log(f"Metadata index    : {index_path(output_dir)}")
+    log("Dataset is stable, logged, and reproducible.")
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Group CelebA images into one folder per identity"
+    )
+    parser.add_argument(
+        "--link",
+        choices=["auto", "reflink", "hardlink", "copy"],
+        default="auto",
+        help="How files are placed (auto: reflink > hardlink > copy)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Threads creating identity folders"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Rebuild only identities whose image list changed"
+    )
+    args = parser.parse_args()
+
+    separate_identities(
+        link=args.link, workers=args.workers, incremental=args.incremental
+    )
+
+
+if __name__ == "__main__":
+    main()
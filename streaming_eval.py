@@ -0,0 +1,164 @@
+import numpy as np
+
+# ================= CONFIG =================
+# Cosine distances live in [0, 2]; 2^16 bins resolve scores to ~3e-5.
+SCORE_RANGE = (0.0, 2.0)
+NUM_BINS = 1 << 16
+
+BOOTSTRAP_CHUNK = 32           # resamples materialised at once
+# =========================================
+
+
+class StreamingROC:
+    """Fixed-memory ROC evaluator fed with score chunks.
+
+    Scores are accumulated into one histogram per class, so memory is
+    ``2 * bins`` counters no matter how many identities are scored, and
+    evaluators from different runs/seeds can be merged. Scores outside
+    ``score_range`` are clipped into the edge bins. Ties within a bin are
+    treated like tied scores (trapezoidal AUC), so the result matches the
+    exact ROC up to the bin width.
+    """
+
+    def __init__(self, score_range=SCORE_RANGE, bins=NUM_BINS):
+        self.lo, self.hi = map(float, score_range)
+        self.bins = int(bins)
+        self.pos = np.zeros(self.bins, dtype=np.int64)
+        self.neg = np.zeros(self.bins, dtype=np.int64)
+
+    # ---------------- ACCUMULATE ----------------
+    def _bin(self, scores):
+        scale = self.bins / (self.hi - self.lo)
+        idx = np.floor((np.asarray(scores, dtype=np.float64) - self.lo) * scale)
+        return np.clip(idx, 0, self.bins - 1).astype(np.int64)
+
+    def update(self, y_true, y_score):
+        y_true = np.asarray(y_true).astype(bool)
+        idx = self._bin(y_score)
+        self.pos += np.bincount(idx[y_true], minlength=self.bins)
+        self.neg += np.bincount(idx[~y_true], minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        if (other.lo, other.hi, other.bins) != (self.lo, self.hi, self.bins):
+            raise ValueError("Cannot merge evaluators with different bins")
+        self.pos += other.pos
+        self.neg += other.neg
+        return self
+
+    @property
+    def num_pos(self):
+        return int(self.pos.sum())
+
+    @property
+    def num_neg(self):
+        return int(self.neg.sum())
+
+    # ---------------- CURVE ----------------
+    @staticmethod
+    def _curve(pos, neg):
+        # Higher score = more anomalous: sweep thresholds from the top bin
+        # down. Works on (..., bins) arrays for batched bootstrap.
+        tp = np.cumsum(pos[..., ::-1], axis=-1)
+        fp = np.cumsum(neg[..., ::-1], axis=-1)
+        zero = np.zeros(tp.shape[:-1] + (1,))
+        tpr = np.concatenate([zero, tp / tp[..., -1:]], axis=-1)
+        fpr = np.concatenate([zero, fp / fp[..., -1:]], axis=-1)
+        return fpr, tpr
+
+    @staticmethod
+    def _auc(fpr, tpr):
+        return np.sum(
+            np.diff(fpr, axis=-1) * (tpr[..., 1:] + tpr[..., :-1]) / 2,
+            axis=-1
+        )
+
+    @staticmethod
+    def _tpr_at(fpr, tpr, targets):
+        # Highest operating point with fpr <= target (fpr is monotone).
+        targets = np.atleast_1d(np.asarray(targets, dtype=np.float64))
+        if fpr.ndim == 1:
+            idx = np.searchsorted(fpr, targets, side="right") - 1
+            return tpr[idx]
+        out = np.empty((fpr.shape[0], len(targets)))
+        for j, t in enumerate(targets):
+            idx = (fpr <= t).sum(axis=-1) - 1
+            out[:, j] = np.take_along_axis(tpr, idx[:, None], axis=-1)[:, 0]
+        return out
+
+    def _check(self):
+        if self.num_pos == 0 or self.num_neg == 0:
+            raise RuntimeError("ROC cannot be computed: only one class present.")
+
+    def roc_curve(self):
+        """Return ``(fpr, tpr, thresholds)`` with thresholds at bin edges,
+        dropping points where neither rate changes."""
+        self._check()
+        fpr, tpr = self._curve(self.pos, self.neg)
+        edges = np.linspace(self.lo, self.hi, self.bins + 1)[::-1]
+        keep = np.concatenate(
+            [[True], (np.diff(fpr) != 0) | (np.diff(tpr) != 0)]
+        )
+        thresholds = np.concatenate([[np.inf], edges[1:]])
+        return fpr[keep], tpr[keep], thresholds[keep]
+
+    def auc(self):
+        self._check()
+        return float(self._auc(*self._curve(self.pos, self.neg)))
+
+    def tpr_at_fpr(self, targets):
+        """TPR at one or more FPR operating points (vectorised)."""
+        self._check()
+        fpr, tpr = self._curve(self.pos, self.neg)
+        out = self._tpr_at(fpr, tpr, targets)
+        return float(out[0]) if np.ndim(targets) == 0 else out
+
+    # ---------------- BOOTSTRAP ----------------
+    def bootstrap(self, targets=(), n_boot=1000, ci=0.95, seed=0):
+        """Percentile confidence intervals for AUC and TPR@FPR.
+
+        Resamples are drawn as multinomial counts over the histogram
+        (stratified by class), ``BOOTSTRAP_CHUNK`` at a time, so memory stays
+        bounded by ``chunk * bins``.
+        """
+        self._check()
+        if n_boot < 1:
+            raise ValueError(f"n_boot must be at least 1, got {n_boot}")
+        rng = np.random.default_rng(seed)
+        p_pos = self.pos / self.num_pos
+        p_neg = self.neg / self.num_neg
+
+        aucs, tprs = [], []
+        for start in range(0, n_boot, BOOTSTRAP_CHUNK):
+            k = min(BOOTSTRAP_CHUNK, n_boot - start)
+            pos = rng.multinomial(self.num_pos, p_pos, size=k)
+            neg = rng.multinomial(self.num_neg, p_neg, size=k)
+            fpr, tpr = self._curve(pos, neg)
+            aucs.append(self._auc(fpr, tpr))
+            if len(targets):
+                tprs.append(self._tpr_at(fpr, tpr, targets))
+
+        alpha = (1.0 - ci) / 2 * 100
+        q = [alpha, 100 - alpha]
+        out = {"auc": np.percentile(np.concatenate(aucs), q).tolist()}
+        if len(targets):
+            tprs = np.vstack(tprs)
+            for j, t in enumerate(targets):
+                out[f"tpr@{t:g}"] = np.percentile(tprs[:, j], q).tolist()
+        return out
+
+    # ---------------- PERSISTENCE ----------------
+    def save(self, path):
+        np.savez_compressed(
+            path, pos=self.pos, neg=self.neg,
+            score_range=np.array([self.lo, self.hi]),
+            bins=np.array(self.bins)
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        ev = cls(tuple(data["score_range"]), int(data["bins"]))
+        ev.pos[:] = data["pos"]
+        ev.neg[:] = data["neg"]
+        return ev
@@ -0,0 +1,60 @@
+import os
+import sys
+import shutil
+from collections import defaultdict
+
+import pytest
+
+# The modules are flat scripts at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_pipeline import make_synthetic_celeba  # noqa: E402
+
+NUM_IDS = 12
+IMGS_PER_ID = 4
+IMG_SIZE = (32, 32)
+NUM_CLIENTS = 2
+NUM_ATTACKS = 4
+
+
+@pytest.fixture(scope="session")
+def celeba(tmp_path_factory):
+    """Synthetic CelebA from benchmark_pipeline, one folder per identity
+    (the celeba_identities layout)."""
+    root = tmp_path_factory.mktemp("celeba")
+    make_synthetic_celeba(str(root), NUM_IDS, IMGS_PER_ID, IMG_SIZE)
+    image_dir = root / "Celeba" / "img_align_celeba" / "img_align_celeba"
+
+    out = root / "identities"
+    with open(root / "Celeba" / "identity_CelebA.txt") as f:
+        for line in f:
+            name, pid = line.split()
+            (out / pid).mkdir(parents=True, exist_ok=True)
+            shutil.copy(image_dir / name, out / pid / name)
+    return out
+
+
+@pytest.fixture
+def pairs_dir(tmp_path, celeba):
+    """A fresh NormalPairs / AttackPairs tree: every identity registered
+    once as normal, and NUM_ATTACKS registrations mixing two identities."""
+    images = defaultdict(list)
+    for pid in sorted(os.listdir(celeba), key=int):
+        images[pid] = sorted(os.listdir(celeba / pid))
+    pids = list(images)
+
+    def register(kind, client, name, sources):
+        dst = tmp_path / "pairs" / kind / f"client_{client}" / name
+        dst.mkdir(parents=True)
+        for pid, img in sources:
+            shutil.copy(celeba / pid / img, dst / f"{pid}_{img}")
+
+    for n, pid in enumerate(pids):
+        register("NormalPairs", n % NUM_CLIENTS, f"id_{pid}",
+                 [(pid, img) for img in images[pid]])
+    for n in range(NUM_ATTACKS):
+        a, b = pids[n], pids[-1 - n]
+        register("AttackPairs", n % NUM_CLIENTS, f"attack_{n}",
+                 [(a, img) for img in images[a][:2]] +
+                 [(b, img) for img in images[b][:2]])
+    return tmp_path / "pairs"
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache, bytes_hash, content_hash
+
+DIM = 8
+
+
+def rows(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = EmbeddingCache(tmp_path, "fp")
+    out, hit = cache.get_many(["a"])
+    assert out is None and not hit.any()
+
+    emb = rows(2)
+    cache.put_many(["a", "b"], emb)
+    out, hit = cache.get_many(["b", "c", "a"])
+    assert hit.tolist() == [True, False, True]
+    np.testing.assert_array_equal(out[0], emb[1])
+    np.testing.assert_array_equal(out[2], emb[0])
+    assert not out[1].any()
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_persists_per_fingerprint(tmp_path):
+    cache = EmbeddingCache(tmp_path, "fp")
+    emb = rows(3)
+    cache.put_many(["a", "b", "c"], emb)
+    cache.flush()
+
+    again = EmbeddingCache(tmp_path, "fp")
+    out, hit = again.get_many(["a", "b", "c"])
+    assert hit.all()
+    np.testing.assert_array_equal(out, emb)
+
+    other = EmbeddingCache(tmp_path, "other-model")
+    assert len(other) == 0
+    assert not other.get_many(["a"])[1].any()
+
+
+def test_unflushed_rows_are_not_persisted(tmp_path):
+    EmbeddingCache(tmp_path, "fp").put_many(["a"], rows(1))
+    assert len(EmbeddingCache(tmp_path, "fp")) == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(tmp_path, "fp", max_bytes=3 * DIM * 4)
+    cache.put_many(["a", "b", "c"], rows(3))
+    cache.get_many(["a"])                   # "b" is now the oldest
+    cache.put_many(["d"], rows(1, seed=1))
+
+    assert len(cache) == 3
+    assert cache.rows == 3
+    hit = cache.get_many(["a", "b", "c", "d"])[1]
+    assert hit.tolist() == [True, False, True, True]
+
+
+def test_put_larger_than_capacity_keeps_last_rows(tmp_path):
+    cache = EmbeddingCache(tmp_path, "fp", max_bytes=2 * DIM * 4)
+    emb = rows(5)
+    cache.put_many(list("abcde"), emb)
+    out, hit = cache.get_many(list("abcde"))
+    assert hit.tolist() == [False, False, False, True, True]
+    np.testing.assert_array_equal(out[3:], emb[3:])
+
+
+def test_dim_mismatch(tmp_path):
+    cache = EmbeddingCache(tmp_path, "fp")
+    cache.put_many(["a"], rows(1))
+    with pytest.raises(ValueError):
+        cache.put_many(["b"], np.zeros((1, DIM + 1), dtype=np.float32))
+
+
+def test_readonly_drops_writes(tmp_path):
+    EmbeddingCache(tmp_path, "fp").flush()
+    cache = EmbeddingCache(tmp_path, "fp", readonly=True)
+    cache.put_many(["a"], rows(1))
+    cache.flush()
+    assert len(cache) == 0
+
+
+def test_segment_over_base_and_merge(tmp_path):
+    shared = EmbeddingCache(tmp_path / "shared", "fp")
+    base_rows = rows(2)
+    shared.put_many(["a", "b"], base_rows)
+    shared.flush()
+
+    base = EmbeddingCache(tmp_path / "shared", "fp", readonly=True)
+    segment = EmbeddingCache(tmp_path / "segment", "fp", base=base)
+    new_rows = rows(1, seed=1)
+    segment.put_many(["c"], new_rows)
+    out, hit = segment.get_many(["a", "c", "x"])
+    assert hit.tolist() == [True, True, False]
+    np.testing.assert_array_equal(out[0], base_rows[0])
+    np.testing.assert_array_equal(out[1], new_rows[0])
+
+    assert shared.merge(segment) == 1
+    assert shared.merge(segment) == 0
+    out, hit = shared.get_many(["a", "b", "c"])
+    assert hit.all()
+    np.testing.assert_array_equal(out[2], new_rows[0])
+
+
+def test_content_hash_matches_bytes_hash(tmp_path):
+    path = tmp_path / "img.jpg"
+    path.write_bytes(b"pixels")
+    assert content_hash(path) == bytes_hash(b"pixels")
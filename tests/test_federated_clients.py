@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from create_federated_clients import (
+    assign_clients, client_sizes, group_clients, load_clients,
+    partition_clients, save_clients, ASSIGNMENT_FILE
+)
+
+IDS = [f"{i:06d}" for i in range(5000)]
+
+
+@pytest.mark.parametrize("partition", ["dirichlet", "powerlaw"])
+def test_partition_sizes(partition):
+    client = partition_clients(IDS, 20, partition=partition, min_ids=50)
+    sizes = np.bincount(client, minlength=20)
+    assert len(client) == len(IDS)
+    assert sizes.sum() == len(IDS)
+    assert sizes.min() >= 50
+    assert client.min() == 0 and client.max() == 19
+
+
+def test_partition_is_seeded():
+    a = partition_clients(IDS, 10)
+    np.testing.assert_array_equal(a, partition_clients(IDS, 10))
+    assert (a != partition_clients(IDS, 10, base_seed=7)).any()
+
+
+def test_sizes_are_skewed():
+    rng = np.random.default_rng(0)
+    sizes = client_sizes(10000, 50, rng, "powerlaw", min_ids=10)
+    assert sizes.sum() == 10000 and sizes.min() >= 10
+    assert sizes.max() > 10 * np.median(sizes)
+
+
+def test_floor_that_does_not_fit():
+    with pytest.raises(ValueError, match="cannot give"):
+        partition_clients(IDS[:100], 20, min_ids=10)
+    with pytest.raises(ValueError, match="Unknown partition"):
+        client_sizes(100, 2, np.random.default_rng(0), "uniform")
+
+
+def test_image_skew_narrows_bands():
+    counts = np.random.default_rng(1).integers(1, 40, len(IDS))
+
+    def spread(skew):
+        client = partition_clients(
+            IDS, 10, image_skew=skew, counts=counts, min_ids=100
+        )
+        return np.mean([counts[client == c].std() for c in range(10)])
+
+    assert spread(1.0) < 0.5 * spread(0.0)
+
+
+def test_uniform_assignment_keeps_every_identity():
+    clients = assign_clients(IDS, 20)
+    assert sorted(i for ids in clients.values() for i in ids) == IDS
+    assert all(50 <= len(ids) for ids in clients.values())
+
+
+def test_save_and_load_round_trip(tmp_path):
+    client = partition_clients(IDS, 12, min_ids=5)
+    clients = group_clients(IDS, client, 12)
+    save_clients(tmp_path, clients, {"num_clients": 12})
+    assert (tmp_path / ASSIGNMENT_FILE).exists()
+    assert load_clients(tmp_path) == clients
+
+    # A smaller federation in the same folder leaves no stale text files.
+    clients = group_clients(IDS, partition_clients(IDS, 3, min_ids=5), 3)
+    save_clients(tmp_path, clients, {"num_clients": 3})
+    assert sorted(p.name for p in tmp_path.glob("client_*.txt")) == \
+        sorted(clients)
+    (tmp_path / ASSIGNMENT_FILE).unlink()
+    assert load_clients(tmp_path) == clients
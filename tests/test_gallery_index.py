@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from gallery_index import (
+    GalleryIndex, attribute_donors, evaluate_attribution, synthetic_gallery,
+    EXACT_BELOW
+)
+
+DIM = 32
+
+
+def unit(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+@pytest.fixture
+def small():
+    # Ten well separated identities: exact search.
+    vectors = unit(np.random.default_rng(0).normal(size=(10, DIM)))
+    return GalleryIndex([f"id_{i}" for i in range(10)], vectors), vectors
+
+
+def near(vectors, i, n, seed=0):
+    noise = np.random.default_rng(seed).normal(scale=0.05, size=(n, DIM))
+    return unit(vectors[i] + noise)
+
+
+def test_ivf_recall_against_exact():
+    vectors = synthetic_gallery(4 * EXACT_BELOW, DIM, clusters=64)
+    index = GalleryIndex(range(len(vectors)), vectors, nlist=32)
+    assert index.backend == "ivf"
+    queries = vectors[:200]
+
+    exact = index.search(queries, 5, exact=True)[0]
+    assert (exact[:, 0] == np.arange(200)).all()
+    full = index.search(queries, 5, nprobe=32)[0]
+    np.testing.assert_array_equal(full, exact)
+
+    probed = index.search(queries, 5, nprobe=4)[0]
+    recall = np.mean([
+        len(set(a) & set(b)) / 5 for a, b in zip(probed, exact)
+    ])
+    assert recall > 0.9
+
+
+def test_attribution_names_donors_of_claimed_identity(small):
+    index, vectors = small
+    emb = np.concatenate([near(vectors, 3, 3), near(vectors, 7, 2, seed=1)])
+    result = attribute_donors(index, emb, k=2, claimed="id_3")
+    assert result["majority"] == "id_3"
+    assert result["tied"] == []
+    assert [o["image"] for o in result["outliers"]] == [3, 4]
+    for o in result["outliers"]:
+        names = [name for name, _ in o["candidates"]]
+        assert names[0] == "id_7" and "id_3" not in names
+
+
+def test_tied_vote_is_reported_not_broken(small):
+    index, vectors = small
+    emb = np.concatenate([near(vectors, 5, 2), near(vectors, 1, 2, seed=1)])
+
+    result = attribute_donors(index, emb, claimed="id_5")
+    assert result["majority"] is None
+    assert sorted(result["tied"]) == ["id_1", "id_5"]
+    assert [o["image"] for o in result["outliers"]] == [2, 3]
+
+    unclaimed = attribute_donors(index, emb)
+    assert unclaimed["claimed"] is None and unclaimed["outliers"] == []
+
+
+def test_unknown_claimed_identity(small):
+    index, vectors = small
+    with pytest.raises(KeyError):
+        attribute_donors(index, vectors[:2], claimed="nobody")
+
+
+def test_padding_is_never_a_candidate():
+    n = EXACT_BELOW
+    vectors = synthetic_gallery(n, DIM, clusters=n, noise=0.01)
+    index = GalleryIndex(range(n), vectors, nlist=n // 2, nprobe=1)
+    idx = index.search(vectors[:50], 8)[0]
+    assert (idx == -1).any()
+
+    # Index -1 would read as the last gallery identity.
+    result = attribute_donors(index, vectors[:50], k=8, claimed=0)
+    assert result["outliers"]
+    assert n - 1 not in [
+        name for o in result["outliers"] for name, _ in o["candidates"]
+    ]
+
+
+def test_save_load_backend(tmp_path):
+    vectors = synthetic_gallery(EXACT_BELOW, DIM, clusters=16)
+    index = GalleryIndex(range(len(vectors)), vectors, nlist=16)
+    path = index.save(tmp_path / "gallery.npz")
+
+    same = GalleryIndex.load(path, nprobe=16)
+    assert same.backend == "ivf" and same.nprobe == 16
+    np.testing.assert_array_equal(
+        same.search(vectors[:20])[0], index.search(vectors[:20], nprobe=16)[0]
+    )
+    exact = GalleryIndex.load(path, backend="exact")
+    assert exact.backend == "exact"
+    with pytest.raises(ValueError):
+        GalleryIndex.load(path, backend="annoy")
+
+
+def test_evaluate_attribution(small):
+    index, vectors = small
+
+    class Corpus:
+        def lookup(self, keys):
+            return unit(np.stack([
+                vectors[int(pid[3:])] + 0.01 * int(img) for pid, img in keys
+            ]))
+
+    records = [
+        {"client": "c0", "identity": "id_2", "label": 1, "role": role,
+         "source_identity": pid, "source_image": img}
+        for role, pid, img in [
+            ("target", "id_2", "0"), ("target", "id_2", "1"),
+            ("target", "id_2", "2"), ("donor", "id_8", "0")
+        ]
+    ] + [
+        {"client": "c0", "identity": "id_4", "label": 0, "role": "target",
+         "source_identity": "id_4", "source_image": "0"}
+    ]
+    out = evaluate_attribution(index, Corpus(), {"records": records}, k=3)
+    assert out["attack_folders"] == 1
+    assert out["donor_recall@3"] == 1.0
+    assert out["majority_vote_accuracy"] == 1.0
+    assert out["majority_vote_ties"] == 0
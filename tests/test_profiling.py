@@ -0,0 +1,90 @@
+import json
+import threading
+
+import pytest
+
+import embedding_detection as ed
+from profiling import Profiler, aggregate, format_report
+
+
+def test_stages_and_counters():
+    prof = Profiler()
+    with prof.timer("decode"):
+        pass
+    prof.add("decode", 1.0, calls=2)
+    prof.add("forward", 3.0)
+    prof.count("images", 5)
+    prof.count("images")
+
+    report = prof.report()
+    assert list(report["stages"]) == ["forward", "decode"]
+    assert report["stages"]["decode"]["calls"] == 3
+    assert report["stages"]["decode"]["seconds"] >= 1.0
+    assert report["counters"] == {"images": 6}
+
+    prof.reset()
+    assert prof.report()["stages"] == {}
+
+
+def test_timer_records_on_exception():
+    prof = Profiler()
+    with pytest.raises(KeyError):
+        with prof.timer("lookup"):
+            raise KeyError("missing")
+    assert prof.report()["stages"]["lookup"]["calls"] == 1
+
+
+def test_threads_do_not_lose_updates():
+    prof = Profiler()
+
+    def work():
+        for _ in range(1000):
+            prof.add("decode", 0.001)
+            prof.count("images")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report = prof.report()
+    assert report["stages"]["decode"]["calls"] == 8000
+    assert report["counters"]["images"] == 8000
+
+
+def test_aggregate_runs():
+    runs = [
+        {"wall_seconds": 4.0, "stages": {"forward": {"seconds": 2.0,
+                                                     "calls": 1}},
+         "counters": {"images": 10}},
+        {"wall_seconds": 4.0, "stages": {"forward": {"seconds": 4.0,
+                                                     "calls": 2},
+                                         "decode": {"seconds": 1.0,
+                                                    "calls": 1}},
+         "counters": {"images": 10, "batches": 1}}
+    ]
+    out = aggregate(runs)
+    assert out["runs"] == 2
+    assert out["counters"] == {"batches": 1, "images": 20}
+    forward = out["stages"]["forward"]
+    assert forward["seconds"] == 6.0
+    assert forward["mean_seconds"] == 3.0
+    assert forward["std_seconds"] == 1.0
+    assert forward["calls"] == 3
+    assert forward["share_of_wall"] == 0.75
+    assert out["stages"]["decode"]["mean_seconds"] == 0.5
+    assert list(out["stages"]) == ["forward", "decode"]
+    assert format_report(out).splitlines()[1].startswith("forward")
+
+
+def test_detection_writes_profile(tmp_path, pairs_dir):
+    results = ed.run_detection(
+        pairs_dir=str(pairs_dir), name="resnet18", random_weights=True,
+        output_dir=str(tmp_path / "results"), batch_size=16, num_workers=0,
+        n_boot=0, plots=False, verbose=False
+    )
+    with open(results["profile_path"]) as f:
+        saved = json.load(f)
+    assert saved["stages"].keys() == results["profile"]["stages"].keys()
+    assert {"forward", "centroid", "collect"} <= saved["stages"].keys()
+    assert saved["counters"]["identities_scored"] == results["num_samples"]
@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import pytest
+
+import embedding_detection as ed
+from image_shards import ShardReader, write_shards
+from score_ledger import ScoreLedger, sample_key
+
+BACKBONE = "resnet18"
+
+
+def test_sample_key_follows_content_not_order():
+    assert sample_key(["a", "b", "c"]) == sample_key(["c", "a", "b"])
+    assert sample_key(["a", "b"]) != sample_key(["a", "c"])
+    assert sample_key(["a", "b"]) != sample_key(["a", "b", "b"])
+    assert sample_key(["a", None]) == sample_key([None, "a"])
+    assert sample_key(["a", None]) != sample_key(["a"])
+
+
+def test_ledger_persists_per_fingerprint(tmp_path):
+    ledger = ScoreLedger(tmp_path, "fp")
+    ledger.put_many(["k1", "k2"], [{"max": 0.5}, None])
+    ledger.flush()
+
+    again = ScoreLedger(tmp_path, "fp")
+    assert "k1" in again and "k2" in again
+    assert again.get("k1") == {"max": 0.5}
+    assert again.get("k2") is None
+    assert len(ScoreLedger(tmp_path, "other")) == 0
+
+
+def test_readonly_and_merge(tmp_path):
+    shared = ScoreLedger(tmp_path / "shared", "fp")
+    segment = ScoreLedger(tmp_path / "segment", "fp")
+    segment.put_many(["k"], [{"max": 0.1}])
+    shared.merge(segment)
+    assert shared.get("k") == {"max": 0.1}
+
+    readonly = ScoreLedger(tmp_path / "shared", "fp", readonly=True)
+    readonly.put_many(["j"], [{"max": 0.2}])
+    assert "j" not in readonly
+
+
+def test_ledger_fingerprint_tracks_model_and_image_source(tmp_path, celeba):
+    def fp(**kw):
+        return ed.open_ledger(tmp_path / "ledger", name=BACKBONE, **kw) \
+            .fingerprint
+
+    write_shards(str(celeba), str(tmp_path / "enc"))
+    write_shards(str(celeba), str(tmp_path / "raw"), raw=True)
+    encoded = ShardReader(str(tmp_path / "enc"))
+    raw = ShardReader(str(tmp_path / "raw"))
+
+    prints = {
+        fp(), fp(random_weights=True), fp(reader=encoded), fp(reader=raw)
+    }
+    assert len(prints) == 4
+    assert fp(reader=encoded) == fp(reader=ShardReader(str(tmp_path / "enc")))
+
+
+@pytest.fixture
+def scored(tmp_path, pairs_dir):
+    ledger_dir = tmp_path / "ledger"
+
+    def score():
+        ledger = ed.open_ledger(
+            ledger_dir, name=BACKBONE, random_weights=True
+        )
+        samples = ed.build_samples(pairs_dir=str(pairs_dir))
+        scores, stats = ed.ledger_scores(
+            samples, batch_size=16, num_workers=0, name=BACKBONE,
+            random_weights=True, ledger=ledger
+        )
+        return samples, scores, stats
+    return score
+
+
+def test_ledger_rescores_only_changed_identities(scored, pairs_dir):
+    samples, first, stats = scored()
+    assert stats["rescored"] == len(samples)
+    assert all(s is not None for s in first)
+
+    samples, again, stats = scored()
+    assert stats["rescored"] == 0
+    assert stats["ledger_hits"] == len(samples)
+    assert again == first
+
+    # Renamed or re-materialized files keep the key.
+    _, imgs = samples[0]
+    os.rename(imgs[0], imgs[0] + ".renamed.jpg")
+    assert scored()[2]["rescored"] == 0
+
+    # A replaced image changes it, even at the same image count.
+    _, imgs = samples[1]
+    shutil.copy(samples[2][1][0], imgs[0])
+    assert scored()[2]["rescored"] == 1
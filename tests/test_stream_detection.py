@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import embedding_detection as ed
+from embedding_detection import ResumeIndex
+
+HEADER = {"backbone": "resnet18", "pretrained": False, "scorers": ["max"]}
+
+
+@pytest.fixture
+def detect(tmp_path, pairs_dir):
+    kwargs = dict(
+        pairs_dir=str(pairs_dir), name="resnet18", random_weights=True,
+        output_dir=str(tmp_path / "results"), batch_size=16, num_workers=0,
+        n_boot=0, plots=False, verbose=False
+    )
+
+    def run(stream=True, **kw):
+        if stream:
+            return ed.stream_detection(chunk_identities=5, **kwargs, **kw)
+        return ed.run_detection(**kwargs, **kw)
+    return run
+
+
+def records(path):
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    return lines[0], lines[1:]
+
+
+def test_stream_matches_batch(detect):
+    streamed = detect()
+    batch = detect(stream=False)
+    assert streamed["num_samples"] == batch["num_samples"]
+    assert streamed["num_attack"] == batch["num_attack"]
+    assert streamed["roc_auc"] == pytest.approx(batch["roc_auc"], abs=1e-4)
+
+    header, recs = records(streamed["results_path"])
+    assert "header" in header
+    assert len(recs) == streamed["num_samples"]
+
+
+def test_resume_after_torn_write(detect):
+    first = detect()
+    path = first["results_path"]
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, "w") as f:
+        f.writelines(lines[:6])
+        f.write(lines[6][:20])              # killed mid-record
+
+    resumed = detect()
+    assert resumed["resumed"] == 5
+    assert resumed["dropped_stale"] == 0
+    assert resumed["embedding"]["written"] == first["num_samples"] - 5
+    assert resumed["roc_auc"] == first["roc_auc"]
+    _, recs = records(path)
+    assert len(recs) == first["num_samples"]
+
+    again = detect()
+    assert again["resumed"] == first["num_samples"]
+    assert again["roc_auc"] == first["roc_auc"]
+
+
+def test_changed_dataset_drops_stale_records(detect, pairs_dir):
+    first = detect()
+    normal = pairs_dir / "NormalPairs" / "client_0"
+    removed, changed = sorted(os.listdir(normal))[:2]
+    shutil.rmtree(normal / removed)
+    img = sorted(os.listdir(normal / changed))[0]
+    other = pairs_dir / "NormalPairs" / "client_1"
+    donor = sorted(os.listdir(other))[0]
+    shutil.copy(other / donor / sorted(os.listdir(other / donor))[0],
+                normal / changed / img)
+
+    second = detect()
+    assert second["num_samples"] == first["num_samples"] - 1
+    assert second["resumed"] == first["num_samples"] - 2
+    assert second["dropped_stale"] == 2
+    _, recs = records(second["results_path"])
+    assert len(recs) == second["num_samples"]
+
+
+def test_header_mismatch_and_no_resume(detect):
+    first = detect()
+    path = first["results_path"]
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, "w") as f:
+        f.write(json.dumps({"header": HEADER}) + "\n")
+        f.writelines(lines[1:])
+    with pytest.raises(RuntimeError, match="no-resume"):
+        detect()
+
+    fresh = detect(resume=False)
+    assert fresh["resumed"] == 0
+    assert records(path)[0]["header"]["backbone"] == "resnet18"
+
+
+def test_stream_fills_ledger_and_cache(tmp_path, detect, pairs_dir):
+    cache = ed.open_cache(tmp_path / "cache", name="resnet18",
+                          random_weights=True)
+    ledger = ed.open_ledger(tmp_path / "ledger", name="resnet18",
+                            random_weights=True)
+    first = detect(cache=cache, ledger=ledger, resume=False)
+    assert first["embedding"]["rescored"] == first["num_samples"]
+
+    cache = ed.open_cache(tmp_path / "cache", name="resnet18",
+                          random_weights=True)
+    ledger = ed.open_ledger(tmp_path / "ledger", name="resnet18",
+                            random_weights=True)
+    assert len(ledger) == first["num_samples"]
+    # Attack folders reuse normal identities' images: one row per content.
+    samples = ed.build_samples(pairs_dir=str(pairs_dir))
+    hashes = ed.sample_hashes(samples, num_workers=1)
+    assert len(cache) == len({h for sample in hashes for h in sample})
+
+    again = detect(cache=cache, ledger=ledger, resume=False)
+    assert again["embedding"]["ledger_hits"] == first["num_samples"]
+    assert again["embedding"].get("rescored", 0) == 0
+    assert again["roc_auc"] == first["roc_auc"]
+
+
+def test_resume_index_takes_each_record_once(tmp_path):
+    path = tmp_path / "scores.jsonl"
+    key_a, key_b = "ab" * 16, "cd" * 16
+    lines = [{"header": HEADER}] + [
+        {"key": key, "label": label, "scores": {"max": s}}
+        for key, label, s in [(key_a, 0, 0.1), (key_a, 0, 0.2),
+                              (key_a, 1, 0.3), (key_b, 1, 0.4)]
+    ]
+    path.write_text("".join(json.dumps(r) + "\n" for r in lines))
+
+    index = ResumeIndex(str(path), HEADER)
+    assert len(index) == 4
+    got = [index.take(key_a, 0), index.take(key_a, 0), index.take(key_a, 0)]
+    assert sorted(r["scores"]["max"] for r in got[:2]) == [0.1, 0.2]
+    assert got[2] is None
+    assert index.take(key_b, 0) is None
+    assert index.take(key_b, 1)["scores"]["max"] == 0.4
+    index.close()
+
+    assert index.drop_untaken() == 1
+    _, recs = records(path)
+    assert [r["scores"]["max"] for r in recs] == [0.1, 0.2, 0.4]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from streaming_eval import StreamingROC
+
+metrics = pytest.importorskip("sklearn.metrics")
+
+
+def scores(n=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 2, n)
+    s = np.clip(rng.normal(0.4 + 0.3 * y, 0.15), 0.0, 2.0)
+    return y, s
+
+
+def test_auc_matches_sklearn():
+    y, s = scores()
+    ev = StreamingROC().update(y, s)
+    assert ev.num_pos + ev.num_neg == len(y)
+    assert ev.auc() == pytest.approx(metrics.roc_auc_score(y, s), abs=1e-4)
+
+
+def test_chunked_and_merged_match_one_update():
+    y, s = scores()
+    whole = StreamingROC().update(y, s)
+    chunked = StreamingROC()
+    for i in range(0, len(y), 512):
+        chunked.update(y[i:i + 512], s[i:i + 512])
+    merged = StreamingROC().update(y[:1000], s[:1000]).merge(
+        StreamingROC().update(y[1000:], s[1000:])
+    )
+    assert chunked.auc() == whole.auc() == merged.auc()
+
+
+def test_tpr_at_fpr_matches_sklearn_curve():
+    y, s = scores()
+    fpr, tpr, _ = metrics.roc_curve(y, s)
+    ev = StreamingROC().update(y, s)
+    for target, got in zip((0.01, 0.1), ev.tpr_at_fpr([0.01, 0.1])):
+        expected = tpr[np.searchsorted(fpr, target, side="right") - 1]
+        assert got == pytest.approx(expected, abs=2e-3)
+
+
+def test_one_class_raises():
+    ev = StreamingROC().update([1, 1], [0.2, 0.3])
+    with pytest.raises(RuntimeError):
+        ev.auc()
+
+
+def test_merge_rejects_other_bins():
+    with pytest.raises(ValueError):
+        StreamingROC().merge(StreamingROC(bins=16))
+
+
+def test_bootstrap_brackets_auc():
+    y, s = scores()
+    ev = StreamingROC().update(y, s)
+    ci = ev.bootstrap(targets=(0.01,), n_boot=64)
+    lo, hi = ci["auc"]
+    assert lo <= ev.auc() <= hi
+    assert set(ci) == {"auc", "tpr@0.01"}
+    with pytest.raises(ValueError):
+        ev.bootstrap(n_boot=0)
+
+
+def test_save_load_round_trip(tmp_path):
+    y, s = scores()
+    ev = StreamingROC().update(y, s)
+    path = tmp_path / "roc.npz"
+    ev.save(path)
+    assert StreamingROC.load(path).auc() == ev.auc()